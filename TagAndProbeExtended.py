@@ -5,45 +5,100 @@ class TagAndProbeExtended(PhysicsModel):
 
     def __init__(self):
         super(PhysicsModel, self).__init__()
+        self._categories = []
+        self._categoryIndex = {}
+        self._sharedPOIs = False
+        self._failScale = "expr"
 
     def _getProcessCategory(self, process):
-        ret = None
-        if self.DC.isSignal[process] or True:
-            for cat in self._categories:
-                if cat == process:
-                    ret = cat
-                    break
-        return ret
+        return self._categoryIndex.get(process)
+
+    def _getChannel(self, bin):
+        """Split a bin name into its flag and channel suffix, e.g. pass_400to480 ==> ("pass", "_400to480")."""
+        if 'pass' in bin:
+            return 'pass', bin.replace('pass', '', 1)
+        elif 'fail' in bin:
+            return 'fail', bin.replace('fail', '', 1)
+        return None, None
 
     def setPhysicsOptions(self, physOptions):
         for po in physOptions[:]:
             if po.startswith("categories="):  # shorthand:  categories=cat1,cat2,cat3
                 physOptions.remove(po)
                 self._categories = po.replace("categories=", "").split(",")
+                self._categoryIndex = dict((cat, cat) for cat in self._categories)
+            elif po == "sharedPOIs":  # one SF per category for all pass/fail channel pairs
+                physOptions.remove(po)
+                self._sharedPOIs = True
+            elif po.startswith("failScale="):  # expr (interpreted formula) or poly (compiled RooPolyVar)
+                physOptions.remove(po)
+                self._failScale = po.replace("failScale=", "")
+                if self._failScale not in ["expr", "poly"]:
+                    raise RuntimeError("Unknown option failScale=%s, use expr or poly" % self._failScale)
         super(TagAndProbeExtended, self).setPhysicsOptions(physOptions)
 
+    def _getKey(self, cat, suffix):
+        """Name of the SF of a category in a given pass/fail channel pair, e.g. TTmatch_400to480."""
+        if self._sharedPOIs:
+            return cat
+        return cat + suffix
+
     def doParametersOfInterest(self):
         """Create POI and other parameters, and define the POI set."""
-        pois = []
-        for cat in self._categories:
-            self.modelBuilder.doVar("SF_%s[1,0.,2]" % cat)
-            pois.append('SF_%s' % cat)
-        self.modelBuilder.doSet("POI", ','.join(pois))
 
+        # Each pass/fail channel pair, e.g. pass_400to480 and fail_400to480, is identified by its suffix
+        suffixes = []
         exp_pass = {}
         exp_fail = {}
         for b in self.DC.bins:
+            flag, suffix = self._getChannel(b)
+            if flag is None:
+                continue
+            if suffix not in suffixes:
+                suffixes.append(suffix)
             for p in self.DC.exp[b].keys():
                 cat = self._getProcessCategory(p)
                 if cat is None:
                     continue
-                if 'pass' in b:
-                    exp_pass[cat] = self.DC.exp[b][p]
-                elif 'fail' in b:
-                    exp_fail[cat] = self.DC.exp[b][p]
+                if flag == 'pass':
+                    exp_pass[cat + suffix] = self.DC.exp[b][p]
+                else:
+                    exp_fail[cat + suffix] = self.DC.exp[b][p]
 
+        pois = []
         for cat in self._categories:
-            self.modelBuilder.factory_('expr::fail_scale_{cat}("max(0.,({pass_exp}+{fail_exp}-({pass_exp}*@0))/{fail_exp})", SF_{cat})'.format(cat=cat, pass_exp=exp_pass[cat], fail_exp=exp_fail[cat]))
+            for suffix in suffixes:
+                key = self._getKey(cat, suffix)
+                if cat + suffix not in exp_pass and cat + suffix not in exp_fail:
+                    continue
+                if 'SF_%s' % key in pois:
+                    continue
+                self.modelBuilder.doVar("SF_%s[1,0.,2]" % key)
+                pois.append('SF_%s' % key)
+        self.modelBuilder.doSet("POI", ','.join(pois))
+
+        # The fail yield of every channel pair is scaled such that the total yield of the category is conserved
+        for cat in self._categories:
+            for suffix in suffixes:
+                if cat + suffix not in exp_pass or cat + suffix not in exp_fail:
+                    continue
+                if self._failScale == "poly":
+                    self._doCompiledFailScale(cat + suffix, self._getKey(cat, suffix), exp_pass[cat + suffix], exp_fail[cat + suffix])
+                else:
+                    self.modelBuilder.factory_('expr::fail_scale_{cat}("max(0.,({pass_exp}+{fail_exp}-({pass_exp}*@0))/{fail_exp})", SF_{key})'.format(cat=cat + suffix, key=self._getKey(cat, suffix), pass_exp=exp_pass[cat + suffix], fail_exp=exp_fail[cat + suffix]))
+
+    def _doCompiledFailScale(self, name, key, pass_exp, fail_exp):
+        """Build fail_scale = (pass+fail-pass*SF)/fail = (1+pass/fail) - (pass/fail)*SF as a compiled RooPolyVar.
+        The formula version clamps the fail scale at zero, which only happens for SF > (pass+fail)/pass.
+        Instead, the upper bound of the SF is lowered to that value, such that both are identical on the allowed range."""
+        ratio = float(pass_exp) / float(fail_exp)
+        self.modelBuilder.doVar("fail_scale_%s_c0[%r]" % (name, 1.0 + ratio))
+        self.modelBuilder.doVar("fail_scale_%s_c1[%r]" % (name, -ratio))
+        self.modelBuilder.factory_("RooPolyVar::fail_scale_%s(SF_%s, {fail_scale_%s_c0, fail_scale_%s_c1})" % (name, key, name, name))
+
+        if ratio > 0.:
+            sf = self.modelBuilder.out.var("SF_%s" % key)
+            sf.setMax(min(sf.getMax(), 1.0 + 1.0 / ratio))
 
 
     def getYieldScale(self, bin, process):
@@ -52,10 +107,13 @@ class TagAndProbeExtended(PhysicsModel):
             cat = self._getProcessCategory(process)
             if cat is None:
                 return 1
-            if 'pass' in bin:
-                return 'SF_%s' % cat
+            flag, suffix = self._getChannel(bin)
+            if flag is None:
+                return 1
+            if flag == 'pass':
+                return 'SF_%s' % self._getKey(cat, suffix)
             else:
-                return 'fail_scale_%s' % cat
+                return 'fail_scale_%s' % (cat + suffix)
         else:
             return 1
 
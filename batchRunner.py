@@ -0,0 +1,126 @@
+#! /bin/env/python
+
+import sys
+import json
+import time
+import shlex
+import argparse
+import traceback
+import multiprocessing as mp
+
+from traceStages import stage, enableTrace
+
+# The stages that can be run as jobs, each module provides makeParser() for the
+# same options as on the command line and run(args) for a single configuration
+stages = {"inputs"       : "makeInputsAndCards",
+          "summaryPlots" : "makeSummaryPlots",
+}
+
+# Read the job list, either {"jobs" : [...]} or just the list, from a JSON or YAML file. Every job is
+# {"stage" : "inputs", "args" : "--year 2017 --measure Eff ..."} and the options in "defaults" of the
+# same stage are put in front of the options of each job, e.g. {"defaults" : {"inputs" : "--doSysts"}}
+def getJobs(jobsName):
+
+    if jobsName.endswith(".yaml") or jobsName.endswith(".yml"):
+        try:
+            import yaml
+        except ImportError:
+            print("PyYAML is needed to read \"%s\", use a JSON job list otherwise"%(jobsName))
+            return None
+        payload = yaml.safe_load(open(jobsName))
+    else:
+        payload = json.load(open(jobsName))
+
+    defaults = {}
+    if isinstance(payload, dict):
+        defaults = payload.get("defaults", {})
+        payload  = payload.get("jobs", [])
+
+    jobs = []
+    for job in payload:
+        if job.get("stage") not in stages:
+            print("Unknown stage \"%s\" of job %s, use one of %s"%(job.get("stage"), json.dumps(job), ",".join(sorted(stages.keys()))))
+            return None
+
+        options = []
+        for jobArgs in [defaults.get(job["stage"], []), job.get("args", [])]:
+            if isinstance(jobArgs, list):
+                options += jobArgs
+            else:
+                options += shlex.split(jobArgs)
+
+        jobs.append((job["stage"], options))
+
+    return jobs
+
+# Run one job in this process, the options are parsed exactly as on the command line. Any
+# failure, including an invalid option, is caught such that the following jobs still run
+def runJob(stageName, module, options, pool, manager):
+
+    try:
+        args = module.makeParser().parse_args(options)
+    except SystemExit:
+        return False
+
+    try:
+        if stageName == "inputs":
+            return module.run(args, pool, manager)
+        return module.run(args)
+    except Exception:
+        traceback.print_exc()
+        return False
+
+if __name__ == "__main__":
+    usage = "%batchRunner [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--jobs",      dest="jobs",      help="JSON/YAML job list",  required=True         )
+    parser.add_argument("--workers",   dest="workers",   help="pool processes",      default=4,   type=int )
+    parser.add_argument("--trace",     dest="trace",     help="dir for trace",       default=None          )
+
+    args = parser.parse_args()
+
+    jobs = getJobs(args.jobs)
+    if jobs == None:
+        exit(2)
+
+    # Tracing has to be enabled before the pool is started, such that the workers inherit it
+    if args.trace != None:
+        enableTrace(args.trace)
+
+    # ROOT and all stage modules are imported only once, and the pool and manager are started only
+    # once and shared by all jobs. Workers are forked here, so they already have everything imported
+    start = time.time()
+    modules = {}
+    for stageName in set(stageName for stageName, options in jobs):
+        modules[stageName] = __import__(stages[stageName])
+    print("Imported %s in %.1f s"%(", ".join(sorted(modules.keys())), time.time() - start))
+
+    manager = mp.Manager()
+    pool    = mp.Pool(processes=max(1, args.workers))
+
+    failed = []
+    for iJob in range(len(jobs)):
+        stageName, options = jobs[iJob]
+
+        print("Job %d/%d: %s %s"%(iJob+1, len(jobs), stageName, " ".join(options)))
+        sys.stdout.flush()
+
+        start = time.time()
+        with stage("batch job", stage=stageName, options=" ".join(options)):
+            ok = runJob(stageName, modules[stageName], options, pool, manager)
+
+        print("Job %d/%d %s in %.1f s"%(iJob+1, len(jobs), "finished" if ok else "FAILED", time.time() - start))
+        sys.stdout.flush()
+
+        if not ok:
+            failed.append(iJob+1)
+
+    pool.close()
+    pool.join()
+    manager.shutdown()
+
+    if len(failed) > 0:
+        print("%d of %d jobs failed: %s"%(len(failed), len(jobs), ", ".join([str(iJob) for iJob in failed])))
+        exit(1)
+
+    print("All %d jobs finished"%(len(jobs)))
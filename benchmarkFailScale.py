@@ -0,0 +1,144 @@
+#! /bin/env/python
+
+import os
+import time
+import shutil
+import argparse
+import subprocess
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+ROOT.RooMsgService.instance().setGlobalKillBelow(ROOT.RooFit.WARNING)
+
+# Build both implementations of the fail scale of the tag and probe model for the given pass and fail
+# expectations in a standalone workspace, exactly as TagAndProbeExtended does with failScale=expr and poly
+def makeWorkspace(passExp, failExp):
+
+    ratio = passExp / failExp
+
+    ws = ROOT.RooWorkspace("w")
+    ws.factory("SF_expr[1,0.,2]")
+    ws.factory("SF_poly[1,0.,%r]"%(min(2.0, 1.0 + 1.0 / ratio)))
+    ws.factory('expr::fail_scale_expr("max(0.,({pass_exp}+{fail_exp}-({pass_exp}*@0))/{fail_exp})", SF_expr)'.format(pass_exp=passExp, fail_exp=failExp))
+    ws.factory("c0[%r]"%(1.0 + ratio))
+    ws.factory("c1[%r]"%(-ratio))
+    ws.factory("RooPolyVar::fail_scale_poly(SF_poly, {c0, c1})")
+
+    return ws
+
+# Time the evaluation of a fail scale function, changing the SF before each evaluation
+# such that the cached value cannot be used, as in the minimization loop of a fit
+def timeEvaluations(ws, impl, nEvals):
+
+    sf    = ws.var("SF_%s"%(impl))
+    func  = ws.function("fail_scale_%s"%(impl))
+    rand  = ROOT.TRandom3(1234)
+    value = [rand.Uniform(sf.getMin(), sf.getMax()) for iEval in range(1000)]
+
+    # Loop overhead in python, to be subtracted from the time per evaluation
+    start = time.time()
+    for iEval in range(nEvals):
+        sf.setVal(value[iEval % 1000])
+    overhead = time.time() - start
+
+    start = time.time()
+    for iEval in range(nEvals):
+        sf.setVal(value[iEval % 1000])
+        func.getVal()
+    total = time.time() - start
+
+    return (total - overhead) / nEvals
+
+# Check that both implementations agree on the range allowed for the compiled version
+def checkAgreement(ws, nPoints=101):
+
+    maxDiff = 0.0
+    upper = ws.var("SF_poly").getMax()
+    for iPoint in range(nPoints):
+        value = upper * iPoint / (nPoints - 1.0)
+        ws.var("SF_expr").setVal(value)
+        ws.var("SF_poly").setVal(value)
+        maxDiff = max(maxDiff, abs(ws.function("fail_scale_expr").getVal() - ws.function("fail_scale_poly").getVal()))
+
+    return maxDiff
+
+# Run a shell command in a given folder and return its wall time in seconds, or None if it failed
+def timeCommand(command, cwd):
+
+    start = time.time()
+    status = subprocess.call("%s >> benchmarkFailScale.log 2>&1"%(command), shell=True, cwd=cwd)
+    if status != 0:
+        return None
+
+    return time.time() - start
+
+# Build the workspace of an existing card with each implementation, and time FitDiagnostics (and impacts)
+def timeFits(cardDir, categories, doImpacts):
+
+    fitOptions = "--robustFit=1 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH"
+
+    timings = {}
+    for impl in ["expr", "poly"]:
+
+        workspace = "sf_%s.root"%(impl)
+        subprocess.call("text2workspace.py -m 173.2 -P HiggsAnalysis.CombinedLimit.TagAndProbeExtended:tagAndProbe sf.txt --PO categories=%s --PO failScale=%s -o %s >> benchmarkFailScale.log 2>&1"%(categories, impl, workspace), shell=True, cwd=cardDir)
+
+        timings[impl] = {}
+        timings[impl]["FitDiagnostics"] = timeCommand("combine -M FitDiagnostics -m 173.2 %s -n .%s %s"%(workspace, impl, fitOptions), cardDir)
+
+        if doImpacts:
+            impactsDir = "%s/impacts_%s"%(cardDir, impl)
+            if os.path.exists(impactsDir):
+                shutil.rmtree(impactsDir)
+            os.makedirs(impactsDir)
+            shutil.copy("%s/%s"%(cardDir, workspace), impactsDir)
+
+            initial = timeCommand("combineTool.py -M Impacts -d %s -m 173.2 %s --doInitialFit --exclude 'rgx{prop.*}'"%(workspace, fitOptions), impactsDir)
+            fits    = timeCommand("combineTool.py -M Impacts -d %s -m 173.2 %s --doFits --parallel 4 --exclude 'rgx{prop.*}'"%(workspace, fitOptions), impactsDir)
+            timings[impl]["Impacts"] = None
+            if initial != None and fits != None:
+                timings[impl]["Impacts"] = initial + fits
+
+    return timings
+
+if __name__ == "__main__":
+    usage = "%benchmarkFailScale [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--passExp",    dest="passExp",    help="pass expectation",   default=1000.0, type=float        )
+    parser.add_argument("--failExp",    dest="failExp",    help="fail expectation",   default=1500.0, type=float        )
+    parser.add_argument("--nEvals",     dest="nEvals",     help="evaluations",        default=1000000, type=int         )
+    parser.add_argument("--cardDir",    dest="cardDir",    help="dir with sf.txt",    default=None                      )
+    parser.add_argument("--categories", dest="categories", help="categories PO",      default=None                      )
+    parser.add_argument("--doImpacts",  dest="doImpacts",  help="time impacts too",   default=False, action="store_true")
+
+    args = parser.parse_args()
+
+    ws = makeWorkspace(args.passExp, args.failExp)
+
+    print("Maximum difference between implementations on the allowed SF range: %g"%(checkAgreement(ws)))
+
+    perEval = {}
+    for impl in ["expr", "poly"]:
+        perEval[impl] = timeEvaluations(ws, impl, args.nEvals)
+        print("Time per evaluation of fail scale (%s): %.1f ns"%(impl, 1e9 * perEval[impl]))
+
+    if perEval["poly"] > 0.0:
+        print("Per evaluation speed-up: %.2fx"%(perEval["expr"] / perEval["poly"]))
+
+    if args.cardDir == None:
+        quit()
+
+    if args.categories == None:
+        print("Must specify '--categories' as passed to text2workspace.py to time the fits!")
+        quit()
+
+    timings = timeFits(os.path.realpath(args.cardDir), args.categories, args.doImpacts)
+
+    for step in ["FitDiagnostics", "Impacts"]:
+        if step not in timings["expr"]:
+            continue
+        if timings["expr"][step] == None or timings["poly"][step] == None:
+            print("%s failed, see \"%s/benchmarkFailScale.log\""%(step, args.cardDir))
+            continue
+        print("%s wall time: expr %.1f s, poly %.1f s, speed-up %.2fx"%(step, timings["expr"][step], timings["poly"][step], timings["expr"][step] / timings["poly"][step]))
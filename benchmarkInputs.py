@@ -0,0 +1,178 @@
+#! /bin/env/python
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import subprocess
+
+# Extra options of makeInputsAndCards.py for each histogramming mode that is benchmarked
+modes = {"draw"    : "",
+         "cube"    : "--cube",
+         "wpScan"  : "--wpScan",
+         "cutflow" : "--cutflow",
+         "jit"     : "--histMode jit",
+}
+
+# Commit of the checked out code the benchmark is run for, marked if there are local changes
+def getCommit():
+
+    repoDir = os.path.dirname(os.path.realpath(__file__))
+    try:
+        commit = subprocess.check_output("git rev-parse --short HEAD", shell=True, cwd=repoDir).decode("utf-8").strip()
+        status = subprocess.check_output("git status --porcelain --untracked-files=no", shell=True, cwd=repoDir).decode("utf-8").strip()
+    except subprocess.CalledProcessError:
+        return "unknown"
+
+    if status != "":
+        commit += "+dirty"
+
+    return commit
+
+# Number of events in all trees of the input files read for a given measurement, i.e. the
+# events that makeInputsAndCards.py has to loop over, nominal and systematic trees alike
+def getNumEvents(inputDir, year, measure, tagger, ptBin, doSysts, treeName, options):
+
+    import ROOT
+    ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+    importedGoods = __import__(options)
+    processes, histograms, systematics = importedGoods.initHistos(year, measure, tagger, ptBin, doSysts)
+
+    treeStubs = [""]
+    if doSysts:
+        treeStubs += ["JECup", "JECdown", "JERup", "JERdown"]
+
+    nEvents = 0
+    for stub in set(processes.values()):
+        infile = ROOT.TFile.Open("%s/%s_%s.root"%(inputDir, year, stub), "READ")
+        if infile == None:
+            continue
+        for treeStub in treeStubs:
+            tree = infile.Get(treeName + treeStub)
+            if tree != None:
+                nEvents += tree.GetEntries()
+        infile.Close()
+
+    return nEvents
+
+# Run a command and print the peak resident memory of its largest (sub)process in kB. This runs as a
+# separate child of the benchmark, such that the peak of each run is not mixed up with earlier runs
+def runChild(command):
+
+    status = subprocess.call(command, shell=True)
+    print("STATUS %d"%(status))
+    print("PEAKRSS %d"%(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+
+# Run makeInputsAndCards.py once for a mode and number of workers, returning the wall time
+# and peak RSS in MB, or None if makeInputsAndCards.py failed
+def runBenchmark(args, mode, workers, outputDir):
+
+    command  = "python %s/makeInputsAndCards.py --inputDir %s --outputDir %s --tree %s"%(os.path.dirname(os.path.realpath(__file__)), args.inputDir, outputDir, args.tree)
+    command += " --year %s --measure %s --tagger %s --ptBin %s --workers %d --overwrite %s"%(args.year, args.measure, args.tagger, args.ptBin, workers, modes[mode])
+    if args.doSysts:
+        command += " --doSysts"
+
+    start = time.time()
+    output = subprocess.check_output([sys.executable, os.path.realpath(__file__), "--child", "%s > %s/benchmark_%s_%d.log 2>&1"%(command, args.logDir, mode, workers)])
+    wallTime = time.time() - start
+
+    status  = None
+    peakRSS = None
+    for line in output.decode("utf-8").splitlines():
+        if line.startswith("STATUS"):
+            status = int(line.split()[-1])
+        elif line.startswith("PEAKRSS"):
+            peakRSS = int(line.split()[-1]) / 1024.0
+
+    if status != 0:
+        return None
+
+    return wallTime, peakRSS
+
+# Print the results of all commits stored in the results file, one line per mode and number of workers
+def printResults(results):
+
+    print("%-16s %-8s %7s %10s %12s %10s"%("commit", "mode", "workers", "time [s]", "events/s", "RSS [MB]"))
+    for commit in sorted(results.keys(), key=lambda commit : results[commit]["time"]):
+        for result in results[commit]["results"]:
+            peakRSS = "n/a"
+            if result["peakRSS"] != None:
+                peakRSS = "%.0f"%(result["peakRSS"])
+            print("%-16s %-8s %7d %10.1f %12.0f %10s"%(commit, result["mode"], result["workers"], result["wallTime"], result["eventsPerSec"], peakRSS))
+
+if __name__ == "__main__":
+    usage = "%benchmarkInputs [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--inputDir",  dest="inputDir",  help="synthetic ntuples",  default=None                      )
+    parser.add_argument("--year",      dest="year",      help="which year",         default="2017"                    )
+    parser.add_argument("--options",   dest="options",   help="options file",       default="makeInputsAndCards_aux"  )
+    parser.add_argument("--tree",      dest="tree",      help="TTree name to draw", default="TopTagSFSkim"            )
+    parser.add_argument("--measure",   dest="measure",   help="Eff or mis measure", default="Eff"                     )
+    parser.add_argument("--tagger",    dest="tagger",    help="Which tagger",       default="Mrg"                     )
+    parser.add_argument("--ptBin",     dest="ptBin",     help="top pt bin",         default="400to480"                )
+    parser.add_argument("--doSysts",   dest="doSysts",   help="include systs",      default=False, action="store_true")
+    parser.add_argument("--modes",     dest="modes",     help="comma sep. modes",   default="draw"                    )
+    parser.add_argument("--workers",   dest="workers",   help="comma sep. workers", default="1,2,4"                   )
+    parser.add_argument("--results",   dest="results",   help="results json",       default="benchmarkInputs.json"    )
+    parser.add_argument("--logDir",    dest="logDir",    help="dir for run logs",   default="BENCHMARK"               )
+    parser.add_argument("--show",      dest="show",      help="only print results", default=False, action="store_true")
+    parser.add_argument("--child",     dest="child",     help=argparse.SUPPRESS,    default=None                      )
+
+    args = parser.parse_args()
+
+    if args.child != None:
+        runChild(args.child)
+        quit()
+
+    results = {}
+    if os.path.exists(args.results):
+        results = json.load(open(args.results))
+
+    if args.show:
+        printResults(results)
+        quit()
+
+    if args.inputDir == None:
+        print("Must specify '--inputDir' with the (synthetic) ntuples to benchmark on!")
+        quit()
+
+    for mode in args.modes.split(","):
+        if mode not in modes:
+            print("Unknown mode \"%s\", use one of %s"%(mode, ",".join(sorted(modes.keys()))))
+            quit()
+
+    if not os.path.exists(args.logDir):
+        os.makedirs(args.logDir)
+
+    nEvents = getNumEvents(args.inputDir, args.year, args.measure, args.tagger, args.ptBin, args.doSysts, args.tree, args.options)
+    print("Benchmarking on %d events"%(nEvents))
+
+    commit = getCommit()
+    results[commit] = {"time" : time.time(), "nEvents" : nEvents, "results" : []}
+
+    # The outputs are written below the log folder, and removed after each run
+    outputDir = "%s/outputs"%(args.logDir)
+    for mode in args.modes.split(","):
+        for workers in [int(workers) for workers in args.workers.split(",")]:
+
+            timing = runBenchmark(args, mode, workers, outputDir)
+            if timing == None:
+                print("mode:%s, workers:%d failed, see \"%s/benchmark_%s_%d.log\""%(mode, workers, args.logDir, mode, workers))
+                continue
+
+            wallTime, peakRSS = timing
+
+            result = {"mode" : mode, "workers" : workers, "wallTime" : wallTime, "eventsPerSec" : nEvents / wallTime, "peakRSS" : peakRSS}
+            results[commit]["results"].append(result)
+
+            print("mode:%s, workers:%d ==> %.1f s, %.0f events/s, peak RSS %s MB"%(mode, workers, wallTime, result["eventsPerSec"], peakRSS))
+
+            shutil.rmtree(outputDir, ignore_errors=True)
+
+    json.dump(results, open(args.results, "w"), indent=4)
+
+    printResults(results)
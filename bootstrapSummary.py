@@ -0,0 +1,125 @@
+#! /bin/env/python
+
+import os
+import glob
+import json
+import math
+import argparse
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+# Mean and sample standard deviation of the values of a bin in all replicas
+def getMeanStd(values):
+
+    mean = sum(values) / len(values)
+    std  = 0.0
+    if len(values) > 1:
+        std = math.sqrt(sum([(value - mean)**2 for value in values]) / (len(values) - 1))
+
+    return mean, std
+
+# Values of every bin in all replicas of a template, from the TH2D written by makeInputsAndCards.py --bootstrap
+# with the template binning on x and the replicas on y. Under- and overflow are skipped
+def getReplicaValues(replicas):
+
+    return [[replicas.GetBinContent(xBin, yBin) for yBin in range(1, replicas.GetNbinsY()+1)] for xBin in range(1, replicas.GetNbinsX()+1)]
+
+# Compare the bootstrap spread of every bin of every template to the uncertainty from the sum of squared
+# weights, which is what autoMCStats uses for the template. The total MC of each category is summed replica
+# by replica, as the replicas of different processes are filled from independent events
+def summarize(inputDir, allSysts):
+
+    summary = {}
+    for bootName in sorted(glob.glob("%s/top_boot_*.root"%(inputDir))):
+
+        output = os.path.basename(bootName).replace(".root", "").replace("top_boot_", "top_", 1)
+
+        fboot = ROOT.TFile.Open(bootName, "READ")
+        fnom  = ROOT.TFile.Open("%s/%s.root"%(inputDir, output), "READ")
+        if fboot == None or fnom == None:
+            print("Could not open \"%s\" and its nominal templates"%(bootName))
+            continue
+
+        templates = {}
+        totalMC   = None
+        for key in fboot.GetListOfKeys():
+            name = key.GetName()
+            if not allSysts and "_" in name:
+                continue
+
+            nominal = fnom.Get(name)
+            if nominal == None:
+                print("No nominal template \"%s\" in \"%s\""%(name, output))
+                continue
+
+            values = getReplicaValues(fboot.Get(name))
+            templates[name] = (nominal, values)
+
+            if "_" in name:
+                continue
+
+            if totalMC == None:
+                totalMC = (nominal.Clone("totalMC"), values)
+                totalMC[0].SetDirectory(0)
+            else:
+                totalMC[0].Add(nominal)
+                totalMC = (totalMC[0], [[a + b for a, b in zip(totalBin, processBin)] for totalBin, processBin in zip(totalMC[1], values)])
+
+        if totalMC != None:
+            templates["total MC"] = totalMC
+
+        summary[output] = {}
+        for name, (nominal, values) in templates.items():
+            bins = []
+            for iBin in range(len(values)):
+                mean, std = getMeanStd(values[iBin])
+                error = nominal.GetBinError(iBin+1)
+                ratio = None
+                if error > 0.0:
+                    ratio = std / error
+                bins.append({"low" : nominal.GetXaxis().GetBinLowEdge(iBin+1), "nominal" : nominal.GetBinContent(iBin+1), "error" : error,
+                             "bootMean" : mean, "bootStd" : std, "ratio" : ratio})
+            summary[output][name] = bins
+
+        fboot.Close()
+        fnom.Close()
+
+    return summary
+
+def printSummary(summary, tolerance):
+
+    for output in sorted(summary.keys()):
+        for name in sorted(summary[output].keys()):
+            bins = summary[output][name]
+
+            print("%s | %s"%(output, name))
+            print("    %s%s%s%s%s%s"%("Bin low".ljust(10), "Nominal".rjust(14), "sqrt(sumw2)".rjust(14), "Boot. mean".rjust(14), "Boot. std".rjust(14), "std / err".rjust(12)))
+            for aBin in bins:
+                ratio = "--"
+                flag  = ""
+                if aBin["ratio"] != None:
+                    ratio = "%.3f"%(aBin["ratio"])
+                    if abs(aBin["ratio"] - 1.0) > tolerance:
+                        flag = "  <=="
+                print("    %s%s%s%s%s%s%s"%(("%g"%(aBin["low"])).ljust(10), ("%.3f"%(aBin["nominal"])).rjust(14), ("%.3f"%(aBin["error"])).rjust(14), ("%.3f"%(aBin["bootMean"])).rjust(14), ("%.3f"%(aBin["bootStd"])).rjust(14), ratio.rjust(12), flag))
+            print("")
+
+if __name__ == "__main__":
+    usage = "%bootstrapSummary [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--inputDir",  dest="inputDir",  help="inputs with replicas", required=True                   )
+    parser.add_argument("--allSysts",  dest="allSysts",  help="also syst. templates", default=False, action="store_true")
+    parser.add_argument("--tolerance", dest="tolerance", help="flag |std/err-1| >",   default=0.2,   type=float         )
+
+    args = parser.parse_args()
+
+    summary = summarize(args.inputDir, args.allSysts)
+    if len(summary) == 0:
+        print("No bootstrap replicas found in \"%s\", make the inputs with '--bootstrap N'"%(args.inputDir))
+        quit()
+
+    printSummary(summary, args.tolerance)
+
+    json.dump(summary, open("%s/bootstrapSummary.json"%(args.inputDir), "w"), indent=4)
@@ -0,0 +1,75 @@
+#! /bin/env/python
+
+import json
+import argparse
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+from runLikelihoodScan import getPOI
+
+# Read the best fit and the uncertainty of the POI from the signal+background fit of a FitDiagnostics output,
+# None is returned if there is no fit result
+def getPOIResult(fitFile, poi):
+
+    fdiag = ROOT.TFile.Open(fitFile, "READ")
+    if fdiag == None:
+        return None
+
+    ttree = fdiag.Get("tree_fit_sb")
+    if ttree == None:
+        fdiag.Close()
+        return None
+
+    ttree.GetEntry(0)
+    result = (getattr(ttree, poi), getattr(ttree, "%sErr"%(poi)), int(ttree.fit_status))
+
+    fdiag.Close()
+
+    return result
+
+# Compare the SF of the fit of the pruned card to the one of the card with all systematics. The
+# comparison is added to pruning.txt and pruning.json, and False is returned if the SF moved
+# by more than the tolerance or if either fit result is missing
+def checkPruning(prunedFit, unprunedFit, poi, tolerance):
+
+    pruned   = getPOIResult(prunedFit, poi)
+    unpruned = getPOIResult(unprunedFit, poi)
+
+    if pruned == None or unpruned == None:
+        print("Missing fit result to validate the pruning, \"%s\" and \"%s\" are needed"%(prunedFit, unprunedFit))
+        return False
+
+    delta = pruned[0] - unpruned[0]
+    ok    = abs(delta) <= tolerance
+
+    report = open("pruning.txt", "a")
+    report.write("Validation of %s with tolerance %g:\n"%(poi, tolerance))
+    report.write("    pruned:   %.4f +/- %.4f (fit status %d)\n"%(pruned[0], pruned[1], pruned[2]))
+    report.write("    unpruned: %.4f +/- %.4f (fit status %d)\n"%(unpruned[0], unpruned[1], unpruned[2]))
+    report.write("==> delta SF: %.4f, %s\n"%(delta, "OK" if ok else "EXCEEDS TOLERANCE"))
+    report.close()
+
+    json.dump({"poi" : poi, "tolerance" : tolerance, "pruned" : pruned[0], "prunedErr" : pruned[1], "unpruned" : unpruned[0],
+               "unprunedErr" : unpruned[1], "delta" : delta, "ok" : ok}, open("pruning.json", "w"), indent=4)
+
+    if ok:
+        print("Pruned %s = %.4f agrees with unpruned %s = %.4f within %g"%(poi, pruned[0], poi, unpruned[0], tolerance))
+    else:
+        print("Pruned %s = %.4f differs from unpruned %s = %.4f by %.4f, more than %g!"%(poi, pruned[0], poi, unpruned[0], delta, tolerance))
+
+    return ok
+
+if __name__ == "__main__":
+    usage = "%checkPruning [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--measure",   dest="measure",   help="Eff or mis measure", required=True                     )
+    parser.add_argument("--tolerance", dest="tolerance", help="max. abs. delta SF", default=0.01,  type=float         )
+    parser.add_argument("--pruned",    dest="pruned",    help="fit of pruned card", default="fitDiagnosticsTest.root" )
+    parser.add_argument("--unpruned",  dest="unpruned",  help="fit of all systs",   default="fitDiagnosticsUnpruned.root")
+
+    args = parser.parse_args()
+
+    if not checkPruning(args.pruned, args.unpruned, getPOI(args.measure), args.tolerance):
+        exit(1)
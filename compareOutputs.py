@@ -0,0 +1,184 @@
+#! /bin/env/python
+
+import os
+import glob
+import argparse
+import subprocess
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+from makeInputsAndCards import getOutputDir
+
+# Split a histogram name into its process and systematic, e.g. TTmatch_JECUp ==> ("TTmatch", "JECUp")
+# and data_obs ==> ("data_obs", ""), as written by processFile
+def getProcessAndSyst(histName):
+
+    if histName == "data_obs":
+        return histName, ""
+
+    chunks = histName.split("_")
+    if len(chunks) == 1:
+        return histName, ""
+
+    return "_".join(chunks[:-1]), chunks[-1]
+
+# Bin edges of all axes of a histogram, to check that both histograms have the same binning
+def getEdges(histo):
+
+    edges = []
+    for axis in [histo.GetXaxis(), histo.GetYaxis(), histo.GetZaxis()][:histo.GetDimension()]:
+        edges.append([axis.GetBinLowEdge(iBin) for iBin in range(1, axis.GetNbins()+2)])
+
+    return edges
+
+def isClose(a, b, rtol, atol):
+
+    return abs(a - b) <= atol + rtol * max(abs(a), abs(b))
+
+# Compare two histograms in every cell, including under- and overflow, on both the
+# contents and the sum of squared weights. Returns a description of the first mismatch
+def compareHistos(ref, cand, rtol, atol):
+
+    if ref.ClassName() != cand.ClassName():
+        return "class %s vs %s"%(ref.ClassName(), cand.ClassName())
+
+    if getEdges(ref) != getEdges(cand):
+        return "different binning"
+
+    refSumw2  = ref.GetSumw2N() > 0
+    candSumw2 = cand.GetSumw2N() > 0
+    if refSumw2 != candSumw2:
+        return "sumw2 stored in only one of them"
+
+    nMismatches = 0
+    firstMismatch = None
+    for iCell in range(ref.GetNcells()):
+
+        refVals  = (ref.GetBinContent(iCell),  ref.GetBinError(iCell)**2)
+        candVals = (cand.GetBinContent(iCell), cand.GetBinError(iCell)**2)
+
+        if isClose(refVals[0], candVals[0], rtol, atol) and isClose(refVals[1], candVals[1], rtol, atol):
+            continue
+
+        nMismatches += 1
+        if firstMismatch == None:
+            firstMismatch = "cell %d: content %g vs %g, sumw2 %g vs %g"%(iCell, refVals[0], candVals[0], refVals[1], candVals[1])
+
+    if nMismatches > 0:
+        return "%d cells differ, first %s"%(nMismatches, firstMismatch)
+
+    return None
+
+# Compare all histograms of all ROOT files of the reference folder to the candidate folder, returns
+# a list of (output, process, systematic, problem) for every histogram that does not agree. Extra
+# outputs of the candidate, e.g. a template cube, are not part of the reference and are ignored
+def compareDirs(refDir, candDir, rtol, atol):
+
+    refNames = sorted(glob.glob("%s/top_*.root"%(refDir)))
+    if len(refNames) == 0:
+        return [("*", "*", "*", "no outputs in reference")]
+
+    problems = []
+    for refName in refNames:
+
+        output = os.path.basename(refName).replace(".root", "")
+
+        candName = "%s/%s.root"%(candDir, output)
+        if not os.path.exists(candName):
+            problems.append((output, "*", "*", "missing file"))
+            continue
+
+        fref  = ROOT.TFile.Open(refName,  "READ")
+        fcand = ROOT.TFile.Open(candName, "READ")
+
+        refHists  = set([key.GetName() for key in fref.GetListOfKeys()])
+        candHists = set([key.GetName() for key in fcand.GetListOfKeys()])
+
+        for histName in sorted(refHists | candHists):
+            proc, syst = getProcessAndSyst(histName)
+
+            if histName not in candHists:
+                problems.append((output, proc, syst, "missing in candidate"))
+                continue
+            if histName not in refHists:
+                problems.append((output, proc, syst, "not in reference"))
+                continue
+
+            problem = compareHistos(fref.Get(histName), fcand.Get(histName), rtol, atol)
+            if problem != None:
+                problems.append((output, proc, syst, problem))
+
+        fref.Close()
+        fcand.Close()
+
+    return problems
+
+# Make the inputs of one configuration with makeInputsAndCards.py and the given extra options
+def makeInputs(args, outputDir, extraOptions):
+
+    command  = "python %s/makeInputsAndCards.py --inputDir %s --outputDir %s --tree %s --options %s"%(os.path.dirname(os.path.realpath(__file__)), args.inputDir, outputDir, args.tree, args.options)
+    command += " --year %s --measure %s --tagger %s --ptBin %s --overwrite %s"%(args.year, args.measure, args.tagger, args.ptBin, extraOptions)
+    if args.doSysts:
+        command += " --doSysts"
+
+    print("Running \"%s\""%(command))
+
+    return subprocess.call("%s > %s.log 2>&1"%(command, outputDir), shell=True)
+
+if __name__ == "__main__":
+    usage = "%compareOutputs [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--refDir",    dest="refDir",    help="reference outputs",  default=None                      )
+    parser.add_argument("--candDir",   dest="candDir",   help="candidate outputs",  default=None                      )
+    parser.add_argument("--inputDir",  dest="inputDir",  help="Path to ntuples",    default=None                      )
+    parser.add_argument("--outputDir", dest="outputDir", help="dir for both runs",  default="COMPARE"                 )
+    parser.add_argument("--candidate", dest="candidate", help="candidate options",  default=""                        )
+    parser.add_argument("--tree",      dest="tree",      help="TTree name to draw", default="TopTagSFSkim"            )
+    parser.add_argument("--year",      dest="year",      help="which year",         default="2017"                    )
+    parser.add_argument("--options",   dest="options",   help="options file",       default="makeInputsAndCards_aux"  )
+    parser.add_argument("--measure",   dest="measure",   help="Eff or mis measure", default="Eff"                     )
+    parser.add_argument("--tagger",    dest="tagger",    help="Which tagger",       default="Mrg"                     )
+    parser.add_argument("--ptBin",     dest="ptBin",     help="top pt bin",         default="400to480"                )
+    parser.add_argument("--doSysts",   dest="doSysts",   help="include systs",      default=False, action="store_true")
+    parser.add_argument("--rtol",      dest="rtol",      help="relative tolerance", default=1e-6,  type=float         )
+    parser.add_argument("--atol",      dest="atol",      help="absolute tolerance", default=1e-9,  type=float         )
+
+    args = parser.parse_args()
+
+    refDir  = args.refDir
+    candDir = args.candDir
+
+    # Unless two existing folders are given, the reference tree.Draw path and the
+    # candidate path (its extra options to makeInputsAndCards.py) are run on the same ntuples
+    if refDir == None or candDir == None:
+        if args.inputDir == None:
+            print("Must specify either '--refDir' and '--candDir' or '--inputDir' to make both!")
+            exit(2)
+
+        base = os.getenv("PWD")
+        if not os.path.exists(args.outputDir):
+            os.makedirs(args.outputDir)
+
+        refDir  = getOutputDir(base, "%s/reference"%(args.outputDir), args.year, args.tagger, args.measure, args.ptBin)
+        candDir = getOutputDir(base, "%s/candidate"%(args.outputDir), args.year, args.tagger, args.measure, args.ptBin)
+
+        if makeInputs(args, "%s/reference"%(args.outputDir), "") != 0 or makeInputs(args, "%s/candidate"%(args.outputDir), args.candidate) != 0:
+            print("Making the inputs failed, see the logs in \"%s\""%(args.outputDir))
+            exit(2)
+
+    problems = compareDirs(refDir, candDir, args.rtol, args.atol)
+
+    if len(problems) == 0:
+        print("All histograms in \"%s\" and \"%s\" agree"%(refDir, candDir))
+        exit(0)
+
+    print("%-20s %-14s %-12s %s"%("output", "process", "systematic", "problem"))
+    for output, proc, syst, problem in problems:
+        if syst == "":
+            syst = "nominal"
+        print("%-20s %-14s %-12s %s"%(output, proc, syst, problem))
+
+    print("%d histograms do not agree"%(len(problems)))
+    exit(1)
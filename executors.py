@@ -0,0 +1,263 @@
+#! /bin/env/python
+
+import os
+import sys
+import json
+import glob
+import time
+import socket
+import argparse
+import subprocess
+import multiprocessing as mp
+
+repoDir = os.path.dirname(os.path.realpath(__file__))
+
+# A task is a self-contained description of one unit of work, i.e. a shell command run in a folder, the outputs it
+# has to produce, as {path : [keys the ROOT file must contain]}, and optionally the group of tasks it belongs to
+# with a command run once all tasks of the group succeeded, e.g. to merge their outputs, and the outputs of that
+def makeTask(name, command, cwd, outputs, group=None, gather=None, gatherOutputs=None):
+
+    if gatherOutputs == None:
+        gatherOutputs = {}
+
+    return {"name" : name, "command" : command, "cwd" : os.path.realpath(cwd), "outputs" : outputs,
+            "group" : group, "gather" : gather, "gatherOutputs" : gatherOutputs}
+
+# Write the spec of a task to the task folder, returns the name of the spec file
+def writeTask(taskDir, task):
+
+    specName = "%s/%s.json"%(os.path.realpath(taskDir), task["name"])
+    writeJson(specName, task)
+
+    return specName
+
+# Write a JSON file atomically, such that a reader polling for it never sees a partial file
+def writeJson(name, payload):
+
+    tmpName = "%s.tmp%d"%(name, os.getpid())
+    json.dump(payload, open(tmpName, "w"), indent=4)
+    os.rename(tmpName, name)
+
+def getStatusName(specName):
+
+    return specName.replace(".json", ".status")
+
+def getLogName(specName):
+
+    return specName.replace(".json", ".log")
+
+def getSpecNames(taskDir):
+
+    return sorted(glob.glob("%s/*.json"%(taskDir)))
+
+# Run the command of a task and record its exit code, the time and the host in the status file next to its spec.
+# This is what runs on the worker, either in a local pool process or as the executable of a batch job
+def runTask(specName):
+
+    task = json.load(open(specName))
+
+    log   = open(getLogName(specName), "w")
+    start = time.time()
+    status = subprocess.call(task["command"], shell=True, cwd=task["cwd"], stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+
+    writeJson(getStatusName(specName), {"status" : status, "start" : start, "end" : time.time(), "host" : socket.gethostname()})
+
+    return status
+
+# Check that all outputs exist and are not empty, and that ROOT files can be opened and contain
+# the required keys. Returns a description of the first problem, or None if all outputs are fine
+def validateOutputs(outputs, cwd):
+
+    for output in sorted(outputs.keys()):
+        path = os.path.join(cwd, output)
+        if not os.path.exists(path):
+            return "missing output %s"%(output)
+        if os.path.getsize(path) == 0:
+            return "empty output %s"%(output)
+
+        if not output.endswith(".root"):
+            continue
+
+        import ROOT
+        ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+        outfile = ROOT.TFile.Open(path, "READ")
+        if outfile == None or outfile.IsZombie() or outfile.TestBit(ROOT.TFile.kRecovered):
+            return "corrupt output %s"%(output)
+
+        for key in outputs[output]:
+            if outfile.Get(key) == None:
+                outfile.Close()
+                return "no %s in output %s"%(key, output)
+        outfile.Close()
+
+    return None
+
+# Validate a finished task from its status file and its outputs, returns None if the task succeeded
+def validateTask(specName):
+
+    statusName = getStatusName(specName)
+    if not os.path.exists(statusName):
+        return "not finished"
+
+    status = json.load(open(statusName))["status"]
+    if status != 0:
+        return "exit code %d, see %s"%(status, getLogName(specName))
+
+    task = json.load(open(specName))
+
+    return validateOutputs(task["outputs"], task["cwd"])
+
+# Validate all tasks and run the gather command of every group whose tasks all succeeded, e.g. hadd and
+# write the data card once all processes of a configuration are drawn. Returns a list of (name, problem)
+def gatherTasks(specNames):
+
+    groups   = {}
+    problems = []
+    for specName in specNames:
+        task = json.load(open(specName))
+
+        problem = validateTask(specName)
+        if problem != None:
+            problems.append((task["name"], problem))
+
+        if task["group"] != None:
+            groups.setdefault(task["group"], []).append((task, problem))
+
+    for group in sorted(groups.keys()):
+        tasks = groups[group]
+        if any([problem != None for task, problem in tasks]):
+            problems.append((group, "not gathered, %d of %d tasks failed"%(len([1 for task, problem in tasks if problem != None]), len(tasks))))
+            continue
+
+        task = tasks[0][0]
+        if task["gather"] == None:
+            continue
+
+        logName = "%s/gather_%s.log"%(os.path.dirname(specNames[0]), os.path.basename(group.rstrip("/")))
+        status = subprocess.call("(%s) > %s 2>&1"%(task["gather"], logName), shell=True, cwd=task["cwd"])
+        if status != 0:
+            problems.append((group, "gather failed with exit code %d, see %s"%(status, logName)))
+            continue
+
+        problem = validateOutputs(task["gatherOutputs"], task["cwd"])
+        if problem != None:
+            problems.append((group, "gather: %s"%(problem)))
+
+    return problems
+
+# Backend running the tasks in a pool of local processes, e.g. on the login node or to test a
+# workflow end to end. Tasks are submitted without blocking and wait() returns once all are done
+class LocalExecutor:
+
+    def __init__(self, taskDir, workers=4):
+
+        self.taskDir = taskDir
+        self.workers = workers
+        self.pool    = None
+
+    def submit(self, specNames):
+
+        self.pool = mp.Pool(processes=max(1, min(self.workers, len(specNames))))
+        for specName in specNames:
+            self.pool.apply_async(runTask, args=(specName,))
+
+        return True
+
+    def wait(self):
+
+        if self.pool != None:
+            self.pool.close()
+            self.pool.join()
+
+# Backend writing an HTCondor submit file with one job per task, which runs executors.py --run on the spec of the task.
+# The task folder and outputs have to be on a file system shared with the worker nodes, and the environment
+# of the submitting shell is passed to the jobs. wait() polls the status files written by the jobs
+class CondorExecutor:
+
+    def __init__(self, taskDir, workers=None, doSubmit=True, pollInterval=60.0):
+
+        self.taskDir      = os.path.realpath(taskDir)
+        self.doSubmit     = doSubmit
+        self.pollInterval = pollInterval
+        self.specNames    = []
+        self.submitted    = False
+
+    def submit(self, specNames):
+
+        self.specNames = specNames
+
+        logDir = "%s/logs"%(self.taskDir)
+        if not os.path.exists(logDir):
+            os.makedirs(logDir)
+
+        tasksName = "%s/tasks.txt"%(self.taskDir)
+        tasks = open(tasksName, "w")
+        for specName in specNames:
+            tasks.write("%s\n"%(specName))
+        tasks.close()
+
+        wrapperName = "%s/runTask.sh"%(self.taskDir)
+        wrapper = open(wrapperName, "w")
+        wrapper.write("#!/bin/bash\n\n")
+        wrapper.write("%s %s/executors.py --run \"$1\"\n"%(sys.executable, repoDir))
+        wrapper.close()
+        os.chmod(wrapperName, 0o755)
+
+        submitName = "%s/condor.jdl"%(self.taskDir)
+        jdl = open(submitName, "w")
+        jdl.write("universe       = vanilla\n")
+        jdl.write("executable     = %s\n"%(wrapperName))
+        jdl.write("arguments      = $(spec)\n")
+        jdl.write("getenv         = True\n")
+        jdl.write("output         = %s/$(Cluster)_$(Process).out\n"%(logDir))
+        jdl.write("error          = %s/$(Cluster)_$(Process).err\n"%(logDir))
+        jdl.write("log            = %s/condor.log\n"%(logDir))
+        jdl.write("request_memory = 2000\n")
+        jdl.write("queue spec from %s\n"%(tasksName))
+        jdl.close()
+
+        if not self.doSubmit:
+            print("Wrote \"%s\" for %d tasks, submit with: condor_submit %s"%(submitName, len(specNames), submitName))
+            return True
+
+        if subprocess.call("condor_submit %s"%(submitName), shell=True) != 0:
+            print("Could not submit \"%s\""%(submitName))
+            return False
+
+        self.submitted = True
+
+        return True
+
+    def wait(self):
+
+        if not self.submitted:
+            return
+
+        while True:
+            nDone = len([specName for specName in self.specNames if os.path.exists(getStatusName(specName))])
+            if nDone == len(self.specNames):
+                break
+
+            print("%d of %d tasks finished"%(nDone, len(self.specNames)))
+            sys.stdout.flush()
+            time.sleep(self.pollInterval)
+
+executors = {"local"  : LocalExecutor,
+             "condor" : CondorExecutor,
+}
+
+def getExecutor(name, taskDir, workers):
+
+    return executors[name](taskDir, workers)
+
+if __name__ == "__main__":
+    usage = "%executors [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--run",       dest="run",       help="task spec to run",   required=True)
+
+    args = parser.parse_args()
+
+    # Entry point of a batch job, running a single task from its spec
+    exit(runTask(args.run))
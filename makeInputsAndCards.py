@@ -2,21 +2,32 @@
 
 import os
 import re
+import zlib
 import array
+import fcntl
+import hashlib
+import json
+import time
 import shutil
 import argparse
+import traceback
 import multiprocessing as mp
 
+from collections import OrderedDict as odict
+
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 ROOT.gROOT.SetBatch(True)
 ROOT.TH1.SetDefaultSumw2()
 ROOT.TH2.SetDefaultSumw2()
 
+from traceStages import stage, enableTrace
+from progressMonitor import ProgressMonitor, reportProgress
+
 # Routine that is called for each individual histogram that is to be 
 # drawn from the input tree. All information about what to draw, selections,
-# and weights is contained in the histOps dictionary
-def makeNDhisto(year, histName, histOps, outfile, tree):
+# and weights is contained in the histOps dictionary, returns False if the draw failed
+def makeNDhisto(year, histName, histOps, outfile, tree, chunkSize=0, onChunk=None):
 
     # To efficiently TTree->Draw(), we will only "activate"
     # necessary branches. So first, disable all branches
@@ -52,46 +63,293 @@ def makeNDhisto(year, histName, histOps, outfile, tree):
 
     outfile.cd()
 
-    # Handle when a list of custom bin edges is passed versus when a standard range is passed
-    if histOps["xbins"].__class__.__name__ == "list":
-        temph = ROOT.TH1F(histName, "", len(histOps["xbins"])-1, array.array('d', histOps["xbins"]))
-    else:
-        temph = ROOT.TH1F(histName, "", histOps["xbins"], histOps["xmin"], histOps["xmax"])
+    temph = bookHisto(histName, histOps)
 
     # For MC, we multiply the selection string by our chosen weight in order
     # to fill the histogram with an event's corresponding weight
     drawExpression = "%s>>%s"%(variable, histName)
-    tree.Draw(drawExpression, "(%s)*(%s)"%(weight,selection))
+
+    if "yvariable" in histOps:
+        drawExpression = "%s:%s>>%s"%(histOps["yvariable"], variable, histName)
+
+    # Large trees can be drawn in chunks of entries, adding to the same histogram, such that
+    # the progress can be reported while drawing. The entries are filled in the same order
+    nEntries = tree.GetEntries()
+    if chunkSize > 0 and nEntries > chunkSize:
+        drawExpression = drawExpression.replace(">>", ">>+")
+        for firstEntry in range(0, nEntries, chunkSize):
+            nChunk = min(chunkSize, nEntries - firstEntry)
+            if tree.Draw(drawExpression, "(%s)*(%s)"%(weight,selection), "", nChunk, firstEntry) < 0:
+                return False
+            if onChunk != None:
+                onChunk(nChunk)
+    else:
+        if tree.Draw(drawExpression, "(%s)*(%s)"%(weight,selection)) < 0:
+            return False
+        if onChunk != None:
+            onChunk(nEntries)
       
     temph = ROOT.gDirectory.Get(histName)
     temph.Sumw2()
 
     temph.Write(histName, ROOT.TObject.kOverwrite)
 
-# Main function that a given pool process runs, the input TTree is opened
-# and the list of requested histograms are drawn to the output ROOT file
-def processFile(outputDir, inputDir, year, proc, stub, histograms, treeName):
+    return True
 
-    inFileName = "%s/%s_%s.root"%(inputDir, year, stub)
-    infile = ROOT.TFile.Open(inFileName.replace("/eos/uscms/", "root://cmseos.fnal.gov///"),  "READ"); infile.cd()
-    if infile == None:
-        print("Could not open input ROOT file \"%s\""%(inFileName))
-        return
+# Book an empty histogram in the current directory with the binning of the histOps
+def bookHisto(histName, histOps):
+
+    # Two dimensional histograms, e.g. the template cube, always come with custom bin edges
+    if "yvariable" in histOps:
+        return ROOT.TH2F(histName, "", len(histOps["xbins"])-1, array.array('d', histOps["xbins"]), len(histOps["ybins"])-1, array.array('d', histOps["ybins"]))
+
+    # Handle when a list of custom bin edges is passed versus when a standard range is passed
+    if histOps["xbins"].__class__.__name__ == "list":
+        return ROOT.TH1F(histName, "", len(histOps["xbins"])-1, array.array('d', histOps["xbins"]))
 
-    trees = {""        : infile.Get(treeName),
-             "JECUp"   : infile.Get(treeName + "JECup"),
-             "JECDown" : infile.Get(treeName + "JECdown"),
-             "JERUp"   : infile.Get(treeName + "JERup"),
-             "JERDown" : infile.Get(treeName + "JERdown"),
+    return ROOT.TH1F(histName, "", histOps["xbins"], histOps["xmin"], histOps["xmax"])
+
+# Name of a histogram in the output ROOT files, i.e. the process and systematic as
+# used in the data card, e.g. TTmatch_JECUp, and data_obs for the data
+def getTemplateName(proc, histName):
+
+    syst = histName.split("_")[-1]
+    if syst != "":
+        return proc + "_" + syst
+    elif proc == "JetHT" or proc == "SingleMuon":
+        return "data_obs"
+
+    return proc
+
+# Generated fill function of a group of histograms drawn from the same tree. Each branch used by
+# any of the selections, weights or variables is read once per event into a buffer of its type and
+# is then available as a double under its own name, as TTreeFormula evaluates in double precision.
+# Every histogram is filled from the compiled expressions as by tree.Draw, i.e. an entry is filled
+# with the weight times the selection, if that is not zero, and a division by zero gives zero as
+# in TTreeFormula. Entries with a weight that is not finite are skipped. With bootstrap replicas,
+# the replicas of a template are filled in the same loop, right after the template itself. The seed
+# and the key of the input file are arguments, such that the same kernel serves any seed and file
+kernelCode = """#include "TTree.h"
+#include "TObjArray.h"
+#include "TH1.h"
+#include "TH2.h"
+#include "TMath.h"
+#include <cmath>
+#include <algorithm>
+
+%(comments)s
+%(division)s
+%(bootFunctions)s
+void %(name)s(TTree* kernelTree, TObjArray* kernelHistos, Long64_t kernelFirst, Long64_t kernelEntries, ULong64_t kernelBootSeed, ULong64_t kernelFileKey)
+{
+%(branches)s
+    kernelTree->SetBranchStatus("*", 0);
+%(addresses)s
+%(histos)s
+%(bootState)s
+    for (Long64_t kernelEntry = kernelFirst; kernelEntry < kernelFirst + kernelEntries; kernelEntry++)
+    {
+        kernelTree->GetEntry(kernelEntry);
+
+%(values)s
+
+%(fills)s
     }
 
-    for flag in ["pass", "fail"]:
+    kernelTree->ResetBranchAddresses();
+    kernelTree->SetBranchStatus("*", 1);
+}
+"""
+
+# Branches used by a group of histograms with the type of their leaf, e.g. Float_t, or None if any of
+# them is not a single value per entry, e.g. an array, which the generated kernels do not handle
+def getKernelBranches(tree, group):
+
+    branches = odict()
+    for nameToPass, histOps, output in group:
+        for key in ["selection", "weight", "variable", "yvariable"]:
+            if key not in histOps:
+                continue
+            for branch in getExpressionBranches(histOps[key], tree):
+                leaf = tree.GetLeaf(branch)
+                if leaf == None or leaf.GetLenStatic() != 1 or leaf.GetLeafCount() != None:
+                    return None
+                branches[branch] = leaf.GetTypeName()
+
+    return branches
+
+# Source of the fill kernel of a group of histograms. The name of the function is the hash of its
+# source and of the ROOT version, such that a compiled kernel is reused for the same expressions
+# and branch types only, and a changed expression or ROOT release gives a new kernel. With nBoot
+# replicas, the replicas of the bootstrap templates of the group follow its histograms in the array
+def makeKernelCode(group, branches, nBoot=0):
+
+    bootHists = getBootHists(group, nBoot)
+
+    comments  = []
+    fills     = []
+    histos    = []
+    for iHist in range(len(group)):
+        nameToPass, histOps, output = group[iHist]
+
+        comments.append("// %d: %s/%s"%(iHist, output, nameToPass))
 
-        outfile = ROOT.TFile.Open("%s/%s_%s.root"%(outputDir, proc, flag), "RECREATE")
+        # Divisions give 0 for a zero denominator, as in TTreeFormula, through the division function of the kernel
+        variable = getCppExpression(histOps["variable"], "${NAME}_div")
 
+        histType = "TH1"
+        fill     = "kernelHisto%d->Fill((double)(%s), kernelWeight);"%(iHist, variable)
+        if "yvariable" in histOps:
+            histType = "TH2"
+            fill     = "kernelHisto%d->Fill((double)(%s), (double)(%s), kernelWeight);"%(iHist, variable, getCppExpression(histOps["yvariable"], "${NAME}_div"))
+
+        histos.append("    %s* kernelHisto%d = (%s*)kernelHistos->At(%d);"%(histType, iHist, histType, iHist))
+
+        # The weight is only evaluated for selected entries, and entries with a weight that is zero or not finite are skipped
+        fills.append("        {")
+        fills.append("            double kernelSelection = (double)(%s);"%(getCppExpression(histOps["selection"], "${NAME}_div")))
+        fills.append("            if (kernelSelection != 0.0)")
+        fills.append("            {")
+        fills.append("                double kernelWeight = (double)(%s) * kernelSelection;"%(getCppExpression(histOps["weight"], "${NAME}_div")))
+        fills.append("                if (kernelWeight != 0.0 && std::isfinite(kernelWeight))")
+        fills.append("                {")
+        if iHist not in bootHists:
+            fills.append("                    %s"%(fill))
+        else:
+            # The Poisson weights of the event are only made once, for the first replica it enters
+            iBootHist = len(group) + bootHists.index(iHist)
+            histos.append("    TH2* kernelBoot%d = (TH2*)kernelHistos->At(%d);"%(iHist, iBootHist))
+            fills.append("                    double kernelX = (double)(%s);"%(variable))
+            fills.append("                    kernelHisto%d->Fill(kernelX, kernelWeight);"%(iHist))
+            fills.append("                    if (!kernelBootReady)")
+            fills.append("                    {")
+            fills.append("                        unsigned long long kernelBootBase = ${NAME}_bootBase(kernelBootSeed, kernelFileKey, kernelEntry);")
+            fills.append("                        for (int kernelBootIndex = 0; kernelBootIndex < %d; kernelBootIndex++)"%(nBoot))
+            fills.append("                            kernelBootWeights[kernelBootIndex] = ${NAME}_bootPoisson(kernelBootBase, kernelBootIndex);")
+            fills.append("                        kernelBootReady = true;")
+            fills.append("                    }")
+            fills.append("                    for (int kernelBootIndex = 0; kernelBootIndex < %d; kernelBootIndex++)"%(nBoot))
+            fills.append("                        kernelBoot%d->Fill(kernelX, kernelBootIndex + 0.5, kernelWeight * kernelBootWeights[kernelBootIndex]);"%(iHist))
+        fills.append("                }")
+        fills.append("            }")
+        fills.append("        }")
+
+    values = ["        const double %s = kernelBranch_%s;"%(branch, branch) for branch in branches]
+
+    # The functions of the weights get the prefix of the kernel, as several kernels are loaded into the same process
+    bootFunctions = ""
+    bootState     = ""
+    if len(bootHists) > 0:
+        comments.append("// Bootstrap: %d replicas"%(nBoot))
+        bootFunctions = bootFunctionsCode%{"prefix" : "${NAME}_boot"}
+        bootState     = "    double kernelBootWeights[%d];\n    bool kernelBootReady = false;\n"%(nBoot)
+        values.append("        kernelBootReady = false;")
+
+    code = kernelCode%{"comments"      : "\n".join(comments),
+                       "division"      : divisionCode%{"divide" : "${NAME}_div"},
+                       "bootFunctions" : bootFunctions,
+                       "name"          : "${NAME}",
+                       "branches"      : "\n".join(["    %s kernelBranch_%s = 0;"%(branchType, branch) for branch, branchType in branches.items()]),
+                       "addresses"     : "\n".join(["    kernelTree->SetBranchStatus(\"%s\", 1); kernelTree->SetBranchAddress(\"%s\", &kernelBranch_%s);"%(branch, branch, branch) for branch in branches]),
+                       "values"        : "\n".join(values),
+                       "histos"        : "\n".join(histos),
+                       "bootState"     : bootState,
+                       "fills"         : "\n".join(fills)}
+
+    kernelName = "topTagFill_%s"%(hashlib.sha1((ROOT.gROOT.GetVersion() + code).encode("utf-8")).hexdigest()[:16])
+
+    return kernelName, code.replace("${NAME}", kernelName)
+
+# Get the compiled fill kernel of a group of histograms, compiling it with ACLiC into the kernel folder if
+# there is no library of it yet. Workers compiling the same kernel at the same time wait for each other
+# through a lock file. Returns None if the group cannot be compiled, e.g. uses array branches
+def getKernel(kernelDir, tree, group, nBoot=0):
+
+    branches = getKernelBranches(tree, group)
+    if branches == None:
+        return None
+
+    kernelName, code = makeKernelCode(group, branches, nBoot)
+    if hasattr(ROOT, kernelName):
+        return getattr(ROOT, kernelName)
+
+    sourceName = "%s/%s.C"%(kernelDir, kernelName)
+
+    lock = open("%s.lock"%(sourceName), "w")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+        if not os.path.exists(sourceName):
+            tmpName = "%s.tmp%d"%(sourceName, os.getpid())
+            source = open(tmpName, "w")
+            source.write(code)
+            source.close()
+            os.rename(tmpName, sourceName)
+
+        # Without the "f" option, ACLiC only compiles if the library is older than the source, otherwise it is loaded
+        with stage("ACLiC", kernel=kernelName):
+            status = ROOT.gSystem.CompileMacro(sourceName, "kO")
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    if not status:
+        print("Could not compile the fill kernel \"%s\""%(sourceName))
+        return None
+
+    return getattr(ROOT, kernelName)
+
+# Fill all histograms of a group drawn from the same tree in a single loop over its entries with the compiled
+# kernel, booking each histogram in the output file it is written to. The bootstrap replicas of the group, if
+# any, are filled in the same loop into their own output files. Returns False if there is no kernel
+def fillKernel(kernelDir, group, outfiles, tree, chunkSize=0, onChunk=None, nBoot=0, bootSeed=0, fileKey=0):
+
+    kernel = getKernel(kernelDir, tree, group, nBoot)
+    if kernel == None:
+        return False
+
+    histos = ROOT.TObjArray()
+    for nameToPass, histOps, output in group:
+        outfiles[output].cd()
+        histos.Add(bookHisto(nameToPass, histOps))
+
+    bootHists = getBootHists(group, nBoot)
+    for iHist in bootHists:
+        nameToPass, histOps, output = group[iHist]
+        outfiles[getBootOutput(output)].cd()
+        histos.Add(bookBootHisto(nameToPass, histOps, nBoot))
+
+    nEntries = tree.GetEntries()
+    if chunkSize <= 0:
+        chunkSize = max(nEntries, 1)
+
+    for firstEntry in range(0, nEntries, chunkSize):
+        nChunk = min(chunkSize, nEntries - firstEntry)
+        kernel(tree, histos, firstEntry, nChunk, bootSeed, fileKey)
+        if onChunk != None:
+            onChunk(nChunk)
+
+    for iHist in range(len(group)):
+        nameToPass, histOps, output = group[iHist]
+        outfiles[output].cd()
+        histos.At(iHist).Write(nameToPass, ROOT.TObject.kOverwrite)
+
+    for iBoot in range(len(bootHists)):
+        nameToPass, histOps, output = group[bootHists[iBoot]]
+        outfiles[getBootOutput(output)].cd()
+        histos.At(len(group) + iBoot).Write(nameToPass, ROOT.TObject.kOverwrite)
+
+    return True
+
+# The histograms of a process grouped by the tree they are drawn from, i.e. the nominal or a JEC/JER varied one,
+# as {treeSyst : [(nameToPass, histOps, output)]}. Each group is one task of a worker, which is filled in a single
+# loop by a compiled kernel in the jit mode, and is written and checkpointed on its own
+def getTreeGroups(proc, histograms):
+
+    groups = odict()
+    for output in getOutputs(histograms):
         for histName, histOps in histograms.items():
             if proc not in histName: continue
-            if flag not in histName: continue
+            if histOps["output"] != output: continue
 
             syst = histName.split("_")[-1]
 
@@ -99,15 +357,857 @@ def processFile(outputDir, inputDir, year, proc, stub, histograms, treeName):
             if "JE" in syst:
                 treeSyst = syst
 
-            nameToPass = proc
-            if syst != "":
-                nameToPass = proc + "_" + syst
-            elif proc == "JetHT" or proc == "SingleMuon":
-                nameToPass = "data_obs"
+            groups.setdefault(treeSyst, []).append((getTemplateName(proc, histName), histOps, output))
+
+    return groups
+
+# Create a folder that may also be created at the same time by other tasks, e.g. of submitJobs.py
+# running on the same output folder or sharing the kernel folder
+def makeSharedDir(path):
+
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Another task may have created it in the meantime
+            if not os.path.isdir(path):
+                raise
+
+# Folder in the output folder with the files written by each task and their checkpoints,
+# which are merged into the outputs, e.g. top_mass_pass.root, once all tasks are done
+def getTasksDir(outputDir):
+
+    return "%s/tasks"%(outputDir.rstrip("/"))
+
+# Name of the task of a tree group of a process, e.g. TTmatch_nominal or TTmatch_JECUp
+def getTaskName(proc, treeSyst):
+
+    if treeSyst == "":
+        return "%s_nominal"%(proc)
+
+    return "%s_%s"%(proc, treeSyst)
+
+# Output file of a task, e.g. tasks/TTmatch_JECUp_top_mass_pass.root
+def getTaskOutput(tasksDir, taskName, output):
+
+    return "%s/%s_%s.root"%(tasksDir, taskName, output)
+
+# Hash of everything a task depends on, such that a checkpoint of an earlier run with a
+# different input file, tree or histogram definition is not mistaken for a finished task
+def getTaskKey(*payload):
+
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+# Write the checkpoint of a task once it is finished, successfully if problem is None. It is written
+# to a temporary file and renamed, such that a killed worker never leaves a partial checkpoint
+def writeCheckpoint(tasksDir, taskName, key, outputs, problem, duration):
+
+    checkpointName = "%s/%s.json"%(tasksDir, taskName)
+    tmpName = "%s.tmp%d"%(checkpointName, os.getpid())
+    json.dump({"key" : key, "outputs" : outputs, "problem" : problem, "time" : duration}, open(tmpName, "w"), indent=4)
+    os.rename(tmpName, checkpointName)
+
+# Problem of a task from its checkpoint, None if it finished successfully with the same key and all its outputs
+# exist. Without a key, only the success of the task is checked, e.g. before merging the outputs of all tasks
+def getTaskProblem(tasksDir, taskName, key=None):
+
+    checkpointName = "%s/%s.json"%(tasksDir, taskName)
+    if not os.path.exists(checkpointName):
+        return "not done"
+
+    checkpoint = json.load(open(checkpointName))
+    if checkpoint["problem"] != None:
+        return checkpoint["problem"]
+    if key != None and checkpoint["key"] != key:
+        return "done with another configuration"
+    for output in checkpoint["outputs"]:
+        if not os.path.exists(getTaskOutput(tasksDir, taskName, output)):
+            return "missing output %s"%(output)
+
+    return None
+
+# Outputs of a tree group, including those of the bootstrap replicas of its templates with nBoot replicas
+def getGroupOutputs(group, nBoot=0):
+
+    outputs = set([output for nameToPass, histOps, output in group])
+    for iHist in getBootHists(group, nBoot):
+        outputs.add(getBootOutput(group[iHist][2]))
+
+    return sorted(outputs)
+
+# Fill the histograms of a tree group into the task's own output files, which are written under a temporary
+# name and only renamed once complete. The bootstrap replicas of the group are filled in the loop of the
+# compiled kernel, and otherwise by fillBootstrap. Returns a description of the problem, or None if all were filled
+def fillTreeGroup(outputDir, tasksDir, taskName, year, proc, group, tree, chunkSize, onChunk, histMode, kernelDir, progress, nBoot=0, bootSeed=0, fileKey=0):
+
+    outputs  = getGroupOutputs(group, nBoot)
+    tmpNames = odict((output, "%s.tmp%d"%(getTaskOutput(tasksDir, taskName, output), os.getpid())) for output in outputs)
+    outfiles = odict((output, ROOT.TFile.Open(tmpNames[output], "RECREATE")) for output in outputs)
+
+    problem = None
+    if histMode == "jit":
+        with stage("kernel", job=outputDir, proc=proc, task=taskName, histograms=len(group), replicas=nBoot):
+            filled = fillKernel(kernelDir, group, outfiles, tree, chunkSize, onChunk, nBoot, bootSeed, fileKey)
+
+        # Fall back to drawing the histograms of a group that cannot be compiled
+        if not filled:
+            print("No fill kernel for %s, drawing its histograms"%(taskName))
+            histMode = "draw"
+
+    if histMode == "draw":
+        for nameToPass, histOps, output in group:
+            reportProgress(progress, proc, task="%s/%s"%(output, nameToPass))
+            with stage("tree.Draw", job=outputDir, proc=proc, hist=nameToPass, output=output):
+                if not makeNDhisto(year, nameToPass, histOps, outfiles[output], tree, chunkSize, onChunk):
+                    problem = "tree.Draw failed for %s/%s"%(output, nameToPass)
+                    break
+
+        # tree.Draw fills a single histogram per loop and cannot apply the per-event weights of the replicas,
+        # so they take one more loop over the tree, for all replicas at once, besides the one per template
+        if problem == None and len(getBootHists(group, nBoot)) > 0:
+            with stage("bootstrap", job=outputDir, proc=proc, task=taskName, replicas=nBoot):
+                fillBootstrap(group, outfiles, tree, nBoot, bootSeed, fileKey)
+
+    for outfile in outfiles.values():
+        outfile.Close()
+
+    for output in outputs:
+        if problem == None:
+            os.rename(tmpNames[output], getTaskOutput(tasksDir, taskName, output))
+        elif os.path.exists(tmpNames[output]):
+            os.remove(tmpNames[output])
+
+    return problem
+
+# Main function that a given pool process runs, the input TTree is opened and the list of requested histograms
+# are drawn, one task per tree of the input file. Every task writes its own output files and a checkpoint once
+# it is done, and a failing task is recorded without stopping the others. When resuming, tasks done in an earlier
+# run with the same configuration are skipped. Returns a list of (task, problem) for all failed tasks
+def processFile(outputDir, inputDir, year, proc, stub, histograms, treeName, chunkSize=0, progress=None, nBoot=0, bootSeed=0, histMode="draw", kernelDir=None, resume=False):
+
+    tasksDir   = getTasksDir(outputDir)
+    inFileName = "%s/%s_%s.root"%(inputDir, year, stub)
+
+    # Bootstrap replicas are only needed for the MC templates, to study their statistical uncertainty
+    if "Data" in stub:
+        nBoot = 0
+    fileKey = zlib.crc32(stub.encode("utf-8")) & 0xffffffff
+
+    groups = getTreeGroups(proc, histograms)
+    keys   = odict((treeSyst, getTaskKey(inFileName, treeName, treeSyst, histMode, group, nBoot, bootSeed)) for treeSyst, group in groups.items())
+
+    todo = [treeSyst for treeSyst in groups if not resume or getTaskProblem(tasksDir, getTaskName(proc, treeSyst), keys[treeSyst]) != None]
+
+    if len(todo) == 0:
+        print("All tasks of %s are done, skipping"%(proc))
+        reportProgress(progress, proc, task="done", status="done")
+        return []
+
+    failures = []
+
+    with stage("TFile.Open", job=outputDir, proc=proc):
+        infile = ROOT.TFile.Open(inFileName.replace("/eos/uscms/", "root://cmseos.fnal.gov///"),  "READ")
+    if infile == None or infile.IsZombie():
+        problem = "could not open input ROOT file \"%s\""%(inFileName)
+        for treeSyst in todo:
+            writeCheckpoint(tasksDir, getTaskName(proc, treeSyst), keys[treeSyst], [], problem, 0.0)
+            failures.append((getTaskName(proc, treeSyst), problem))
+        reportProgress(progress, proc, task="failed", status="done")
+        return failures
+    infile.cd()
+
+    treeNames = {""        : treeName,
+                 "JECUp"   : treeName + "JECup",
+                 "JECDown" : treeName + "JECdown",
+                 "JERUp"   : treeName + "JERup",
+                 "JERDown" : treeName + "JERdown",
+    }
+    trees = dict((treeSyst, infile.Get(name)) for treeSyst, name in treeNames.items())
+
+    # The total number of entries looped over by this worker, for the progress and ETA
+    total = 0
+    for treeSyst in todo:
+        if trees[treeSyst] == None:
+            continue
+        if histMode == "jit":
+            total += trees[treeSyst].GetEntries()
+        else:
+            total += trees[treeSyst].GetEntries() * len(groups[treeSyst])
+    reportProgress(progress, proc, file=os.path.basename(inFileName), total=total)
+
+    onChunk = None
+    if progress != None:
+        onChunk = lambda nChunk : reportProgress(progress, proc, events=nChunk)
+
+    for treeSyst in todo:
+        taskName = getTaskName(proc, treeSyst)
+        outputs  = getGroupOutputs(groups[treeSyst], nBoot)
+
+        reportProgress(progress, proc, task=taskName)
+
+        start = time.time()
+        try:
+            if trees[treeSyst] == None:
+                problem = "no tree %s in \"%s\""%(treeNames[treeSyst], inFileName)
+            else:
+                problem = fillTreeGroup(outputDir, tasksDir, taskName, year, proc, groups[treeSyst], trees[treeSyst], chunkSize, onChunk, histMode, kernelDir, progress, nBoot, bootSeed, fileKey)
+        except Exception:
+            problem = traceback.format_exc()
+
+        writeCheckpoint(tasksDir, taskName, keys[treeSyst], outputs, problem, time.time() - start)
+        if problem != None:
+            print("Task %s failed: %s"%(taskName, problem))
+            failures.append((taskName, problem))
+
+    infile.Close()
+
+    reportProgress(progress, proc, task="done", status="done")
+
+    return failures
+
+# Names of all tasks of the given processes, to check that all of them are done before merging their outputs
+def getTaskNames(processes, histograms):
+
+    taskNames = []
+    for proc, stub in processes.items():
+        for treeSyst in getTreeGroups(proc, histograms):
+            taskNames.append(getTaskName(proc, treeSyst))
+
+    return taskNames
+
+# Per-event Poisson(1) weights of the bootstrap replicas. The weights are a function of the seed, the input
+# file and the entry of the tree only, such that they are reproducible, and an event gets the same weights in
+# every template filled from the same tree, i.e. in pass and fail and in the nominal and weight systematic
+# templates. The JEC and JER templates are filled from their own trees, whose entries are not the same events,
+# so their replicas are independent of the nominal ones. The functions get a prefix, such that the kernels,
+# each compiled into its own library, do not clash with each other or with the interpreted version
+bootFunctionsCode = """
+inline unsigned long long %(prefix)sSplitMix(unsigned long long x)
+{
+    x += 0x9E3779B97F4A7C15ULL;
+    x  = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    x  = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+    return x ^ (x >> 31);
+}
+
+inline unsigned long long %(prefix)sBase(unsigned long long seed, unsigned long long fileKey, unsigned long long entry)
+{
+    return %(prefix)sSplitMix(seed ^ %(prefix)sSplitMix(fileKey ^ %(prefix)sSplitMix(entry)));
+}
+
+// Uniform number in [0, 1) from the top 53 bits, turned into a Poisson(1) number by inverting the CDF
+inline double %(prefix)sPoisson(unsigned long long base, int iBoot)
+{
+    double u   = (%(prefix)sSplitMix(base + iBoot) >> 11) * (1.0 / 9007199254740992.0);
+    double p   = 0.36787944117144233;
+    double cdf = p;
+    int k = 0;
+    while (u > cdf && k < 20)
+    {
+        k++;
+        p   /= k;
+        cdf += p;
+    }
+    return k;
+}
+"""
+
+bootstrapCode = """
+#include "ROOT/RVec.hxx"
+""" + bootFunctionsCode%{"prefix" : "boot"} + """
+ROOT::RVec<double> bootWeights(unsigned long long seed, unsigned long long fileKey, unsigned long long entry, int nBoot)
+{
+    ROOT::RVec<double> weights(nBoot);
+    unsigned long long base = bootBase(seed, fileKey, entry);
+    for (int iBoot = 0; iBoot < nBoot; iBoot++)
+        weights[iBoot] = bootPoisson(base, iBoot);
+    return weights;
+}
+
+ROOT::RVec<double> bootIndices(int nBoot)
+{
+    ROOT::RVec<double> indices(nBoot);
+    for (int iBoot = 0; iBoot < nBoot; iBoot++)
+        indices[iBoot] = iBoot + 0.5;
+    return indices;
+}
+"""
+
+# Name of the output with the bootstrap replicas of the templates of an output, e.g. top_mass_pass ==> top_boot_mass_pass
+def getBootOutput(output):
+
+    return output.replace("top_", "top_boot_", 1)
+
+# Indices of the histograms of a tree group with bootstrap replicas, i.e. the one dimensional mass templates
+def getBootHists(group, nBoot):
+
+    if nBoot <= 0:
+        return []
+
+    return [iHist for iHist in range(len(group)) if group[iHist][2].startswith("top_mass") and "yvariable" not in group[iHist][1]]
+
+# Book the replicas of a template as one TH2D with the template binning on x and the replica on y
+def bookBootHisto(nameToPass, histOps, nBoot):
+
+    return ROOT.TH2D(nameToPass, "", len(histOps["xbins"])-1, array.array('d', histOps["xbins"]), nBoot, 0, nBoot)
+
+# Fill the bootstrap replicas of the templates of a tree group with RDataFrame, in a single event loop for all
+# replicas, when the group is drawn instead of filled by a compiled kernel. The replicas of each template are
+# stored in the bootstrap output under the same name as the template. Must be run without implicit
+# multithreading to keep rdfentry_ the entry of the tree, as used by the kernels
+def fillBootstrap(group, outfiles, tree, nBoot, bootSeed, fileKey):
+
+    if not hasattr(ROOT, "bootWeights"):
+        ROOT.gInterpreter.Declare(bootstrapCode)
+    declareDivision()
+
+    df = ROOT.RDataFrame(tree)
+    df = df.Define("bootPoisson", "bootWeights(%dULL, %dULL, rdfentry_, %d)"%(bootSeed, fileKey, nBoot))
+    df = df.Define("bootIndex",   "bootIndices(%d)"%(nBoot))
+
+    replicas = []
+    for iHist in getBootHists(group, nBoot):
+        nameToPass, histOps, output = group[iHist]
+
+        # As in the kernels, the weight is only evaluated for selected entries, and the weight times
+        # the selection, if it is not zero and finite, is the weight of the entry
+        node = df.Filter(getCppExpression(histOps["selection"]))
+        node = node.Define("bootSW%d"%(iHist), "(double)(%s) * (double)(%s)"%(getCppExpression(histOps["weight"]), getCppExpression(histOps["selection"])))
+        node = node.Filter("bootSW%d != 0.0 && std::isfinite(bootSW%d)"%(iHist, iHist))
+        node = node.Define("bootX%d"%(iHist), "ROOT::RVec<double>(%d, (double)(%s))"%(nBoot, getCppExpression(histOps["variable"])))
+        node = node.Define("bootW%d"%(iHist), "bootSW%d * bootPoisson"%(iHist))
+
+        model = ROOT.RDF.TH2DModel(nameToPass, "", len(histOps["xbins"])-1, array.array('d', histOps["xbins"]), nBoot, 0, nBoot)
+        replicas.append((getBootOutput(output), node.Histo2D(model, "bootX%d"%(iHist), "bootIndex", "bootW%d"%(iHist))))
+
+    # Accessing the first replica runs the event loop for all replicas booked on the tree
+    for output, histo in replicas:
+        outfiles[output].cd()
+        replica = histo.GetValue()
+        replica.Write(replica.GetName(), ROOT.TObject.kOverwrite)
+
+# Get the sorted list of output ROOT file names, e.g. top_mass_pass, that the histograms are written to
+def getOutputs(histograms):
+
+    return sorted(set(histOps["output"] for histOps in histograms.values()))
+
+# Hadd the ROOT files of all tasks into one total ROOT file per output, returns False if any hadd failed.
+# The task files are kept, such that a failed merge can be redone with --mergeOnly without drawing again
+def haddOutputs(outputDir, outputs):
+
+    for output in outputs:
+        if os.system("hadd -f %s/%s.root %s/*_%s.root >> %s/python.log 2>&1"%(outputDir, output, getTasksDir(outputDir), output, outputDir)) != 0:
+            print("Could not merge the outputs %s, see \"%s/python.log\""%(output, outputDir))
+            return False
+
+    return True
+
+# Split a selection string into its ordered terms at the top level "&&" operators,
+# e.g. "pass_TTCR&&(a||b)&&c>1" ==> ["pass_TTCR", "(a||b)", "c>1"]
+def splitSelection(selection):
+
+    return splitTopLevel(selection, "&&")
+
+# Split a weight string into its factors at the top level "*" operators,
+# e.g. "weightTTbar*puSysUpCorr/puWeightCorr" ==> ["weightTTbar", "puSysUpCorr/puWeightCorr"]
+def splitWeight(weight):
+
+    return splitTopLevel(weight, "*")
+
+# Split an expression at all occurrences of an operator outside of any parentheses
+def splitTopLevel(expression, operator):
+
+    terms = []
+    depth = 0
+    term  = ""
+    iChar = 0
+    while iChar < len(expression):
+        char = expression[iChar]
+        if   char == "(": depth += 1
+        elif char == ")": depth -= 1
+
+        if depth == 0 and expression[iChar:iChar+len(operator)] == operator:
+            terms.append(term.strip())
+            term   = ""
+            iChar += len(operator)
+            continue
+
+        term  += char
+        iChar += 1
+
+    terms.append(term.strip())
+
+    return [term for term in terms if term != ""]
+
+# Tokens of an expression: names (including namespaces, e.g. TMath::Abs), numbers, parentheses and operators
+expressionTokens = re.compile(r"\s+|[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|&&|\|\||==|!=|<=|>=|.")
+
+# Rewrite every division of an expression, e.g. "w*a/b" ==> "divide(w*a, b)", keeping the precedence of C++,
+# i.e. a chain of * and / is evaluated from the left and ends at any other operator or a comma
+def getSafeDivisions(expression, divide):
+
+    tokens = [token for token in expressionTokens.findall(expression) if not token.isspace()]
+
+    output = []
+    chain  = None
+    iToken = 0
+    while iToken < len(tokens):
+        token = tokens[iToken]
+
+        # An operand is a name or number, a call of a function or a group in parentheses
+        if token == "(" or re.match(r"[A-Za-z_\d.]", token):
+            operand = ""
+            if token != "(":
+                operand = token
+                iToken += 1
+            if iToken < len(tokens) and tokens[iToken] == "(":
+                depth = 0
+                start = iToken
+                while True:
+                    if   tokens[iToken] == "(": depth += 1
+                    elif tokens[iToken] == ")": depth -= 1
+                    if depth == 0:
+                        break
+                    iToken += 1
+                operand += "(%s)"%(getSafeDivisions("".join(tokens[start+1:iToken]), divide))
+                iToken += 1
+
+            if chain == None:
+                chain = operand
+            elif chain.endswith("/"):
+                chain = "%s(%s, %s)"%(divide, chain[:-1], operand)
+            else:
+                chain += operand
+            continue
+
+        if token in ["*", "/"] and chain != None:
+            chain += token
+        else:
+            if chain != None:
+                output.append(chain)
+                chain = None
+            output.append(token)
+        iToken += 1
+
+    if chain != None:
+        output.append(chain)
+
+    return "".join(output)
+
+# Division as done by TTreeFormula, which gives 0 instead of inf or nan for a zero denominator
+divisionCode = """
+inline double %(divide)s(double numerator, double denominator)
+{
+    return denominator == 0.0 ? 0.0 : numerator / denominator;
+}
+"""
+
+# Declare the division of TTreeFormula for the expressions of RDataFrame
+def declareDivision():
+
+    if not hasattr(ROOT, "topTagDiv"):
+        ROOT.gInterpreter.Declare(divisionCode%{"divide" : "topTagDiv"})
+
+# TTreeFormula accepts a few functions that are not valid C++ for mixed argument types, e.g.
+# max(double, float), so translate expressions for use in RDataFrame or compiled code. Divisions
+# go through the given function, e.g. the one of divisionCode, to give 0 for a zero denominator
+def getCppExpression(expression, divide="topTagDiv"):
+
+    expression = getSafeDivisions(expression, divide)
+    expression = re.sub(r"\bmax\(", "std::max<double>(", expression)
+    expression = re.sub(r"\bmin\(", "std::min<double>(", expression)
+
+    return expression
+
+# Main function that a given pool process runs in cutflow mode. For each tree of the input file, the
+# cumulative weighted yields after each term of the selection of every template are computed in a single
+# event loop. Templates sharing the first terms of their selection share the corresponding filters, such
+# that each term is evaluated only once per event. Returns {histName : [(term, raw events, weighted yield)]}
+def processCutflow(inputDir, year, proc, stub, histograms, treeName):
+
+    inFileName = "%s/%s_%s.root"%(inputDir, year, stub)
+    infile = ROOT.TFile.Open(inFileName.replace("/eos/uscms/", "root://cmseos.fnal.gov///"),  "READ")
+    if infile == None:
+        print("Could not open input ROOT file \"%s\""%(inFileName))
+        return {}
+
+    treeStubs = {"" : "", "JECUp" : "JECup", "JECDown" : "JECdown", "JERUp" : "JERup", "JERDown" : "JERdown"}
+
+    # Only the templates entering the fit are considered, grouped by the tree they are drawn from
+    groups = {}
+    for histName, histOps in histograms.items():
+        if proc not in histName: continue
+        if not histOps["output"].startswith("top_mass"): continue
+
+        syst = histName.split("_")[-1]
+
+        treeSyst = ""
+        if "JE" in syst:
+            treeSyst = syst
+
+        groups.setdefault(treeSyst, []).append(histName)
+
+    declareDivision()
+
+    results = {}
+    for treeSyst, histNames in groups.items():
+
+        tree = infile.Get(treeName + treeStubs[treeSyst])
+        df = ROOT.RDataFrame(tree)
+
+        # All weights are defined upfront on the root node, such that every filter can use them
+        weights = sorted(set(histograms[histName]["weight"] for histName in histNames))
+        for iWeight in range(len(weights)):
+            df = df.Define("cutflowWeight%d"%(iWeight), "(double)(%s)"%(getCppExpression(weights[iWeight])))
+
+        nodes  = {() : df}
+        counts = {}
+        sums   = {}
+        for histName in histNames:
+
+            weightName = "cutflowWeight%d"%(weights.index(histograms[histName]["weight"]))
+
+            prefix = ()
+            bookings = [("all events", prefix)]
+            for term in splitSelection(histograms[histName]["selection"]):
+                parent = prefix
+                prefix = prefix + (term,)
+                if prefix not in nodes:
+                    nodes[prefix] = nodes[parent].Filter(getCppExpression(term), term)
+                bookings.append((term, prefix))
+
+            for term, prefix in bookings:
+                if prefix not in counts:
+                    counts[prefix] = nodes[prefix].Count()
+                if (prefix, weightName) not in sums:
+                    sums[(prefix, weightName)] = nodes[prefix].Sum(weightName)
+
+            results[histName] = [(term, prefix, weightName) for term, prefix in bookings]
+
+        # Accessing the first result runs the single event loop for all booked results of this tree
+        with stage("cutflow event loop", proc=proc, tree=treeSyst):
+            for histName in histNames:
+                results[histName] = [(term, counts[prefix].GetValue(), sums[(prefix, weightName)].GetValue()) for term, prefix, weightName in results[histName]]
+
+    infile.Close()
+
+    return results
+
+# Write the cutflows of all templates as a text table to cutflow.txt in the output folder
+def writeCutflowTable(outputDir, histograms, cutflows):
+
+    table = open("%s/cutflow.txt"%(outputDir), "w")
+
+    for histName in sorted(cutflows.keys()):
+
+        syst = histName.split("_")[-1]
+        if syst == "":
+            syst = "nominal"
+
+        table.write("%s | category: %s | systematic: %s\n"%(histName.split("_")[0], histograms[histName]["output"].split("_")[-1], syst))
+        table.write("    %s%s%s%s\n"%("Cut".ljust(60), "Events".rjust(14), "Yield".rjust(18), "Cumul. eff.".rjust(14)))
+
+        total = cutflows[histName][0][2]
+        for term, count, yieldSum in cutflows[histName]:
+            eff = "--"
+            if total != 0.0:
+                eff = "%.4f"%(yieldSum / total)
+            table.write("    %s%s%s%s\n"%(term.ljust(60), str(count).rjust(14), ("%.3f"%(yieldSum)).rjust(18), eff.rjust(14)))
+        table.write("\n")
+
+    table.close()
+
+# Names of all branches of a tree used in an expression, i.e. all identifiers that are
+# not called as a function, e.g. "max(101.0, min(bestMTopMass, 264.0))" ==> ["bestMTopMass"]
+def getExpressionBranches(expression, tree):
+
+    branches = []
+    for match in re.finditer(r"[A-Za-z_]\w*(::\w+)*", expression):
+        name = match.group(0)
+        if "::" in name or expression[match.end():].lstrip().startswith("("):
+            continue
+        if name not in branches and tree.GetBranch(name) != None:
+            branches.append(name)
+
+    return branches
+
+# Time a single TTree::Draw of an expression on a freshly opened input file, such that
+# no baskets are kept in memory from an earlier draw and all branches used are read again.
+# Returns the time in seconds and the bytes read from the file, or None if the draw failed
+def timeExpression(inFileName, treeName, expression, nEvents):
+
+    infile = ROOT.TFile.Open(inFileName, "READ")
+    if infile == None:
+        return None
+
+    tree = infile.Get(treeName)
+    if tree == None:
+        infile.Close()
+        return None
+
+    start = time.time()
+    if nEvents > 0:
+        status = tree.Draw(expression, "", "goff", nEvents)
+    else:
+        status = tree.Draw(expression, "", "goff")
+    duration = time.time() - start
+
+    bytesRead = infile.GetBytesRead()
+    infile.Close()
+
+    if status < 0:
+        return None
+
+    return duration, bytesRead
+
+# Main function that a given pool process runs in profile mode. Every unique variable, selection
+# and weight drawn from a given input file is timed on its own, together with the terms of each
+# selection, the factors of each weight and every branch used, to attribute the evaluation time
+# and bytes read of the histograms. A draw of a constant is timed first and subtracted from all
+# others, such that the remaining cost is the one of the expression. Returns a list of rows
+# {tree, kind, expression, uses, time, bytesRead} and the number of events per draw
+def processProfile(inputDir, year, stub, procs, histograms, treeName, nEvents):
+
+    inFileName = "%s/%s_%s.root"%(inputDir, year, stub)
+    inFileName = inFileName.replace("/eos/uscms/", "root://cmseos.fnal.gov///")
+
+    infile = ROOT.TFile.Open(inFileName, "READ")
+    if infile == None:
+        print("Could not open input ROOT file \"%s\""%(inFileName))
+        return [], 0
+
+    treeStubs = {"" : "", "JECUp" : "JECup", "JECDown" : "JECdown", "JERUp" : "JERup", "JERDown" : "JERdown"}
+
+    # Count how many histograms evaluate each expression, as each tree.Draw evaluates it again
+    uses = {}
+    for histName, histOps in histograms.items():
+        if histName.split("_")[0] not in procs: continue
+
+        syst = histName.split("_")[-1]
+
+        treeSyst = ""
+        if "JE" in syst:
+            treeSyst = syst
+
+        tree = infile.Get(treeName + treeStubs[treeSyst])
+        if tree == None:
+            continue
+
+        keys = set()
+        for kind in ["variable", "yvariable", "selection", "weight"]:
+            if kind not in histOps:
+                continue
+            expression = histOps[kind]
+            keys.add((treeSyst, kind, expression))
+
+            subTerms = []
+            if   kind == "selection": subTerms = [("sel. term", term) for term in splitSelection(expression)]
+            elif kind == "weight":    subTerms = [("weight factor", factor) for factor in splitWeight(expression)]
+            if len(subTerms) > 1:
+                keys.update([(treeSyst, subKind, term) for subKind, term in subTerms])
+
+            keys.update([(treeSyst, "branch", branch) for branch in getExpressionBranches(expression, tree)])
+
+        for key in keys:
+            uses[key] = uses.get(key, 0) + 1
+
+    entries = {}
+    for treeSyst in set(key[0] for key in uses.keys()):
+        entries[treeSyst] = infile.Get(treeName + treeStubs[treeSyst]).GetEntries()
+    infile.Close()
+
+    rows = []
+    for treeSyst in sorted(entries.keys()):
+
+        fullTreeName = treeName + treeStubs[treeSyst]
+
+        baseline = timeExpression(inFileName, fullTreeName, "1", nEvents)
+        if baseline == None:
+            continue
+
+        for key in sorted(uses.keys()):
+            if key[0] != treeSyst:
+                continue
+
+            with stage("profile expression", proc=stub, tree=treeSyst, expression=key[2]):
+                timing = timeExpression(inFileName, fullTreeName, key[2], nEvents)
+            if timing == None:
+                print("Could not draw \"%s\" from tree \"%s\" of \"%s\""%(key[2], fullTreeName, inFileName))
+                continue
+
+            rows.append({"tree" : treeSyst, "kind" : key[1], "expression" : key[2], "uses" : uses[key],
+                         "time" : max(0.0, timing[0] - baseline[0]), "bytesRead" : max(0, timing[1] - baseline[1])})
+
+    if nEvents > 0:
+        entries = dict((treeSyst, min(nEvents, nEntries)) for treeSyst, nEntries in entries.items())
+
+    return rows, max(entries.values()) if len(entries) > 0 else 0
+
+# Print the ranked profile of every input file and write it to profile.txt in the output folder. The
+# expressions are ranked by their total time, i.e. the time per draw times the number of draws evaluating
+# them, and the share is relative to the summed total time of all variables, selections and weights
+def writeProfileReport(outputDir, profiles):
+
+    report = open("%s/profile.txt"%(outputDir), "w")
+
+    for stub in sorted(profiles.keys()):
+        rows, nEvents = profiles[stub]
+
+        grandTotal = sum(row["time"] * row["uses"] for row in rows if row["kind"] in ["variable", "yvariable", "selection", "weight"])
+
+        lines = ["Input file: %s, %d events per draw, %.2f s for all expressions"%(stub, nEvents, grandTotal)]
+        lines.append("    %s%s%s%s%s%s%s%s%s  %s"%("Rank".ljust(6), "Kind".ljust(15), "Tree".ljust(9), "Uses".rjust(6), "ms/draw".rjust(10), "ns/event".rjust(10), "Total [s]".rjust(11), "MB/draw".rjust(10), "Share".rjust(7), "Expression"))
+
+        rows = sorted(rows, key=lambda row : -row["time"] * row["uses"])
+        for iRow in range(len(rows)):
+            row = rows[iRow]
 
-            makeNDhisto(year, nameToPass, histOps, outfile, trees[treeSyst])
+            tree = row["tree"]
+            if tree == "":
+                tree = "nominal"
+
+            nsPerEvent = "--"
+            if nEvents > 0:
+                nsPerEvent = "%.1f"%(row["time"] / nEvents * 1e9)
+
+            share = "--"
+            if grandTotal > 0.0:
+                share = "%.1f%%"%(100.0 * row["time"] * row["uses"] / grandTotal)
+
+            lines.append("    %s%s%s%s%s%s%s%s%s  %s"%(str(iRow+1).ljust(6), row["kind"].ljust(15), tree.ljust(9), str(row["uses"]).rjust(6), ("%.1f"%(row["time"] * 1e3)).rjust(10), nsPerEvent.rjust(10), ("%.2f"%(row["time"] * row["uses"])).rjust(11), ("%.2f"%(row["bytesRead"] / 1024.0**2)).rjust(10), share.rjust(7), row["expression"]))
+
+        for line in lines:
+            print(line)
+            report.write("%s\n"%(line))
+
+        print("")
+        report.write("\n")
+
+    report.close()
+
+# Find the range of bins on a fine axis that exactly covers [low, high].
+# A low (high) edge of None extends the range into the underflow (overflow) bin.
+# If a requested edge does not coincide with a fine bin edge, None is returned
+def getFineBinRange(axis, low, high):
+
+    edges = [axis.GetBinLowEdge(iBin) for iBin in range(1, axis.GetNbins()+2)]
+
+    binLow = 0
+    if low != None:
+        matches = [iEdge for iEdge in range(len(edges)) if abs(edges[iEdge] - low) < 1e-6]
+        if not matches:
+            return None
+        binLow = matches[0] + 1
+
+    binHigh = axis.GetNbins() + 1
+    if high != None:
+        matches = [iEdge for iEdge in range(len(edges)) if abs(edges[iEdge] - high) < 1e-6]
+        if not matches:
+            return None
+        binHigh = matches[0]
+
+    return binLow, binHigh
+
+# Convert a pt bin string like "400to480", "600toInf" or "inclusive" into
+# low and high edges, where None means the range is open on that side
+def getPtEdges(ptBin):
+
+    if "to" not in ptBin:
+        return None, None
+
+    ptRange = ptBin.split("to")
+    ptHigh = None
+    if ptRange[-1] != "Inf":
+        ptHigh = float(ptRange[-1])
+
+    return float(ptRange[0]), ptHigh
+
+# Derive a mass template with the requested binning from a finely binned
+# 2D histogram, e.g. top mass x top pt, by summing bins. The y range is given by
+# low and high edges, where None extends the range into the under- or overflow bin.
+# Contents beyond the requested mass range are added to the under- and overflow bins
+def getTemplateFromCube(cube, histName, massBins, yLow, yHigh):
+
+    yBinLow, yBinHigh = getFineBinRange(cube.GetYaxis(), yLow, yHigh)
+
+    xaxis = cube.GetXaxis()
+    nFineBins = xaxis.GetNbins()
+
+    templ = ROOT.TH1F(histName, "", len(massBins)-1, array.array('d', massBins))
+    templ.SetDirectory(0)
+
+    nBins = templ.GetNbinsX()
+    contents = [0.0 for iBin in range(nBins+2)]
+    errors2  = [0.0 for iBin in range(nBins+2)]
+    for xBin in range(0, nFineBins+2):
+
+        target = 0
+        if xBin == nFineBins+1:
+            target = nBins + 1
+        elif xBin > 0:
+            target = templ.FindBin(xaxis.GetBinCenter(xBin))
+
+        for yBin in range(yBinLow, yBinHigh+1):
+            contents[target] += cube.GetBinContent(xBin, yBin)
+            errors2[target]  += cube.GetBinError(xBin, yBin)**2.0
+
+    for iBin in range(nBins+2):
+        templ.SetBinContent(iBin, contents[iBin])
+        templ.SetBinError(iBin, errors2[iBin]**0.5)
+
+    return templ
+
+# Write the top_mass_{pass,fail}.root input files for a given mass binning by
+# summing bins of the 2D histograms in the source file of each category over
+# the [low, high] range of the y axis requested for that category
+def makeTemplates(sourceFiles, yRanges, outputDir, massBins):
+
+    for flag in ["pass", "fail"]:
+
+        fsource = ROOT.TFile.Open(sourceFiles[flag], "READ")
+        if fsource == None:
+            print("Could not open ROOT file \"%s\""%(sourceFiles[flag]))
+            return False
+
+        # All requested edges must coincide with edges of the fine binning
+        source = fsource.Get(fsource.GetListOfKeys().At(0).GetName())
+        for edge in massBins:
+            if getFineBinRange(source.GetXaxis(), float(edge), None) == None:
+                print("Mass bin edge %s does not align with the binning in \"%s\""%(edge, sourceFiles[flag]))
+                return False
+        if getFineBinRange(source.GetYaxis(), *yRanges[flag]) == None:
+            print("Range %s does not align with the binning in \"%s\""%(str(yRanges[flag]), sourceFiles[flag]))
+            return False
+
+        outfile = ROOT.TFile.Open("%s/top_mass_%s.root"%(outputDir, flag), "RECREATE")
+
+        for key in fsource.GetListOfKeys():
+            templ = getTemplateFromCube(key.ReadObj(), key.GetName(), massBins, *yRanges[flag])
+
+            outfile.cd()
+            templ.Write(key.GetName(), ROOT.TObject.kOverwrite)
 
         outfile.Close()
+        fsource.Close()
+
+    return True
+
+# Inputs for a given mass binning and pt bin from the template cube found in the cubeDir directory
+def makeTemplatesFromCube(cubeDir, outputDir, massBins, ptBin):
+
+    sourceFiles = {"pass" : "%s/top_cube_pass.root"%(cubeDir), "fail" : "%s/top_cube_fail.root"%(cubeDir)}
+    yRanges     = {"pass" : getPtEdges(ptBin),                 "fail" : getPtEdges(ptBin)}
+
+    return makeTemplates(sourceFiles, yRanges, outputDir, massBins)
+
+# Inputs for a given mass binning and working point from the mass vs. discriminant histograms
+# found in the scanDir directory, events at exactly the working point are counted as passing
+def makeTemplatesFromScan(scanDir, outputDir, massBins, WP):
+
+    sourceFiles = {"pass" : "%s/top_disc_scan.root"%(scanDir), "fail" : "%s/top_disc_scan.root"%(scanDir)}
+    yRanges     = {"pass" : (WP, None),                         "fail" : (None, WP)}
+
+    return makeTemplates(sourceFiles, yRanges, outputDir, massBins)
 
 def writeLine(processes, card, header1, header2, value1, value2, appliesTo):
 
@@ -117,8 +1217,11 @@ def writeLine(processes, card, header1, header2, value1, value2, appliesTo):
 
     line = [header1.ljust(headerSpace/2), header2.ljust(headerSpace/2)]
 
+    # Values can also be given per process as a dictionary, where missing processes get "--"
     for process in processes:
         insertVal = str(value1).replace("$PNAME", process).replace("$PINST", str(processes.index(process)))
+        if isinstance(value1, dict):
+            insertVal = str(value1.get(process, "--"))
         if appliesTo[0] == "ALL" or process in appliesTo:
             line.append(insertVal.ljust(columnSpacing))
         else:
@@ -126,6 +1229,8 @@ def writeLine(processes, card, header1, header2, value1, value2, appliesTo):
     line.append(passfailspace)
     for process in processes:
         insertVal = str(value2).replace("$PNAME", process).replace("$PINST", str(processes.index(process)))
+        if isinstance(value2, dict):
+            insertVal = str(value2.get(process, "--"))
         if appliesTo[0] == "ALL" or process in appliesTo:
             line.append(insertVal.ljust(columnSpacing))
         else:
@@ -135,6 +1240,98 @@ def writeLine(processes, card, header1, header2, value1, value2, appliesTo):
 
     return card
 
+# Compare the Up and Down templates of each shape systematic to the nominal template of every process
+# in both categories. The normalization effect is the largest relative change of the integral, the
+# shape effect is the largest fraction of the normalized template that migrates between bins.
+# A systematic is negligible for a process and category if both effects are below their threshold,
+# and if for all processes its shape effect is negligible, it is converted to a lnN uncertainty.
+# Returns {syst : (card line type or None if dropped, pass values, fail values)} and writes pruning.txt
+def pruneSystematics(outputDir, processes, systematics, normThreshold, shapeThreshold):
+
+    report = open("%s/pruning.txt"%(outputDir), "w")
+    report.write("Normalization threshold: %g, shape threshold: %g\n\n"%(normThreshold, shapeThreshold))
+    report.write("%s%s%s%s%s%s%s\n"%("Systematic".ljust(14), "Process".ljust(14), "Category".ljust(10), "Norm. Down".rjust(12), "Norm. Up".rjust(12), "Shape".rjust(12), "Decision".rjust(10)))
+
+    decisions = {}
+    for syst in systematics:
+
+        entries = {}
+        for flag in ["pass", "fail"]:
+
+            finputs = ROOT.TFile.Open("%s/top_mass_%s.root"%(outputDir, flag), "READ")
+
+            for proc in processes:
+
+                nominal = finputs.Get(proc)
+                up      = finputs.Get("%s_%sUp"%(proc, syst))
+                down    = finputs.Get("%s_%sDown"%(proc, syst))
+
+                # Without templates nothing can be judged, so keep the shape as is
+                if nominal == None or up == None or down == None:
+                    entries[(proc, flag)] = ("shape", 1.0, 1.0, -1.0)
+                    continue
+
+                nomInt = nominal.Integral()
+                if nomInt <= 0.0:
+                    entries[(proc, flag)] = ("drop", 1.0, 1.0, 0.0)
+                    continue
+
+                kappaUp   = up.Integral()   / nomInt
+                kappaDown = down.Integral() / nomInt
+
+                shapeEffect = 0.0
+                for variation in [up, down]:
+                    varInt = variation.Integral()
+                    if varInt <= 0.0:
+                        shapeEffect = 1.0
+                        continue
+                    migration = 0.0
+                    for iBin in range(1, nominal.GetNbinsX()+1):
+                        migration += abs(variation.GetBinContent(iBin) / varInt - nominal.GetBinContent(iBin) / nomInt)
+                    shapeEffect = max(shapeEffect, 0.5 * migration)
+
+                normEffect = max(abs(kappaUp - 1.0), abs(kappaDown - 1.0))
+
+                decision = "shape"
+                if shapeEffect < shapeThreshold:
+                    decision = "lnN"
+                    if normEffect < normThreshold:
+                        decision = "drop"
+
+                entries[(proc, flag)] = (decision, kappaDown, kappaUp, shapeEffect)
+
+            finputs.Close()
+
+        decided = [entry[0] for entry in entries.values()]
+
+        lineType = None
+        if   "shape" in decided: lineType = "shape"
+        elif "lnN"   in decided: lineType = "lnN"
+
+        values = {"pass" : {}, "fail" : {}}
+        for (proc, flag), (decision, kappaDown, kappaUp, shapeEffect) in entries.items():
+            if decision == "drop":
+                continue
+            if lineType == "shape":
+                values[flag][proc] = 1
+            else:
+                values[flag][proc] = "%.4f/%.4f"%(kappaDown, kappaUp)
+
+        for proc in processes:
+            for flag in ["pass", "fail"]:
+                decision, kappaDown, kappaUp, shapeEffect = entries[(proc, flag)]
+                if decision != "drop" and lineType == "shape":
+                    decision = "shape"
+                report.write("%s%s%s%s%s%s%s\n"%(syst.ljust(14), proc.ljust(14), flag.ljust(10), ("%.4f"%(kappaDown)).rjust(12), ("%.4f"%(kappaUp)).rjust(12), ("%.4f"%(shapeEffect)).rjust(12), decision.rjust(10)))
+
+        report.write("==> %s: %s\n\n"%(syst, str(lineType).replace("None", "dropped")))
+
+        decisions[syst] = (lineType, values["pass"], values["fail"])
+
+    report.close()
+
+    return decisions
+
 def getDataMCfactor(directory, processes):
 
     fpass = ROOT.TFile.Open("%s/top_mass_pass.root"%(directory), "READ")
@@ -155,9 +1352,24 @@ def getDataMCfactor(directory, processes):
 
     return Ndata / Nmc
 
-def makeDatacard(outputDir, processes, systematics, measure, year):
+# Luminosity uncertainty to put in the card for a given year
+def getLumiSystVal(year):
 
-    card = open("%s/sf.txt"%(outputDir), "w")
+    lumiSystVal = 1.012
+    if year == 2017:
+        lumiSystVal = 1.023
+    elif year == 2018:
+        lumiSystVal = 1.025
+
+    return lumiSystVal
+
+def makeDatacard(outputDir, processes, systematics, measure, year, pruning=None, cardName="sf.txt"):
+
+    # When pruning, the card with all systematics is kept for comparing the fit results
+    if pruning != None:
+        makeDatacard(outputDir, processes, systematics, measure, year, None, "sf_unpruned.txt")
+
+    card = open("%s/%s"%(outputDir, cardName), "w")
 
     # Do not need data in this list
     if "JetHT"      in processes: processes.pop("JetHT")
@@ -194,11 +1406,7 @@ def makeDatacard(outputDir, processes, systematics, measure, year):
 
     card.write("\n------------\n\n")
 
-    lumiSystVal = 1.012
-    if year == 2017:
-        lumiSystVal = 1.023
-    elif year == 2018:
-        lumiSystVal = 1.025
+    lumiSystVal = getLumiSystVal(year)
 
     card = writeLine(processes.keys(), card, "lumi", "lnN", lumiSystVal, lumiSystVal, ["ALL"])
 
@@ -208,35 +1416,227 @@ def makeDatacard(outputDir, processes, systematics, measure, year):
         # Minimum add 50% uncertainty for QCD
         card = writeLine(processes.keys(), card, "QCDnorm", "lnN", 1.5, 1.5, ["QCD"])
     else:
+        decisions = {}
+        if pruning != None:
+            decisions = pruneSystematics(outputDir, processes, systematics, pruning["norm"], pruning["shape"])
+
         for syst in systematics:
             # Use Up version as syst name while stripping up/down
-            card = writeLine(processes.keys(), card, syst, "shape", 1, 1, ["ALL"])
+            if syst not in decisions:
+                card = writeLine(processes.keys(), card, syst, "shape", 1, 1, ["ALL"])
+                continue
+
+            lineType, passValues, failValues = decisions[syst]
+            if lineType == None:
+                continue
+
+            card = writeLine(processes.keys(), card, syst, lineType, passValues, failValues, ["ALL"])
 
     card.write("\nMCnorm rateParam * * %f [0.0,%f]\n"%(dataMC,10.0*dataMC))
 
     card.write("\n*  autoMCStats  0\n")
     card.close()
 
-def makeCombineScript(outputDir, categories, year, tagger, measure, ptBin):
+# Write one line of the combined card, where each column is a (channel, process) pair
+def writeCombinedLine(card, header1, header2, values, columnSpacing):
+
+    line = [header1.ljust(24), header2.ljust(8)]
+    for value in values:
+        line.append(str(value).ljust(columnSpacing))
+    line.append("\n")
+    card.write("".join(line))
+
+    return card
+
+# Write a single card in which every pt bin (and year) of an existing set of inputs folders is a pass/fail
+# channel pair, e.g. pass_400to480/fail_400to480. The tag and probe model gives each process its own
+# SF_<proc>_<channel> POI and fail scale in every channel pair. Shape systematics are correlated
+# across all channels, while the luminosity is correlated within a year and each channel pair
+# gets its own MCnorm. The channels are given as a list of (channel name, inputs folder, year)
+# and are recorded in channels.json for unpacking the per-channel results after the fit
+def makeCombinedDatacard(outputDir, channels, processes, systematics, measure):
+
+    # Do not need data in this list
+    if "JetHT"      in processes: processes.pop("JetHT")
+    if "SingleMuon" in processes: processes.pop("SingleMuon")
+
+    procs = list(processes.keys())
+
+    columns = []
+    for channel, inputsDir, year in channels:
+        for flag in ["pass", "fail"]:
+            for proc in procs:
+                columns.append(("%s_%s"%(flag, channel), proc))
+
+    columnSpacing = max(len(column) for column, proc in columns) + 2
+
+    card = open("%s/sf.txt"%(outputDir), "w")
+
+    card.write("imax %d  number of channels\n"%(2*len(channels)))
+    card.write("jmax %d  number of backgrounds\n"%(len(procs)-1))
+    card.write("kmax *  number of nuisance parameters (sources of systematical uncertainties)\n\n")
+    card.write("------------\n\n")
+
+    observations = []
+    for channel, inputsDir, year in channels:
+        relDir = os.path.relpath(inputsDir, outputDir)
+        for flag in ["pass", "fail"]:
+            card.write("shapes  *  %s_%s   %s/top_mass_%s.root  $PROCESS $PROCESS_$SYSTEMATIC\n"%(flag, channel, relDir, flag))
+
+            finputs = ROOT.TFile.Open("%s/top_mass_%s.root"%(inputsDir, flag), "READ")
+            hobs = finputs.Get("data_obs")
+            observations.append(("%s_%s"%(flag, channel), hobs.Integral(1, hobs.GetNbinsX())))
+            finputs.Close()
+
+    card.write("\n------------\n\n")
+    card = writeCombinedLine(card, "bin",         "", [column for column, value in observations], columnSpacing)
+    card = writeCombinedLine(card, "observation", "", [value  for column, value in observations], columnSpacing)
+    card.write("\n------------\n\n")
+
+    card = writeCombinedLine(card, "bin",     "", [column for column, proc in columns],      columnSpacing)
+    card = writeCombinedLine(card, "process", "", [proc for column, proc in columns],        columnSpacing)
+    card = writeCombinedLine(card, "process", "", [procs.index(proc) for column, proc in columns], columnSpacing)
+    card = writeCombinedLine(card, "rate",    "", [-1 for column, proc in columns],          columnSpacing)
+
+    card.write("\n------------\n\n")
+
+    years = []
+    for channel, inputsDir, year in channels:
+        if year not in years:
+            years.append(year)
+
+    for year in years:
+        lumiSystVal = getLumiSystVal(year)
+
+        yearColumns = ["%s_%s"%(flag, channel) for channel, inputsDir, aYear in channels if aYear == year for flag in ["pass", "fail"]]
+
+        lumiName = "lumi"
+        if len(years) > 1:
+            lumiName = "lumi_%s"%(year)
+
+        card = writeCombinedLine(card, lumiName, "lnN", [lumiSystVal if column in yearColumns else "--" for column, proc in columns], columnSpacing)
+
+    if len(systematics) == 0:
+        # Minimum add 50% uncertainty for QCD
+        card = writeCombinedLine(card, "QCDnorm", "lnN", [1.5 if proc == "QCD" else "--" for column, proc in columns], columnSpacing)
+    else:
+        for syst in systematics:
+            card = writeCombinedLine(card, syst, "shape", [1 for column, proc in columns], columnSpacing)
+
+    card.write("\n")
+    for channel, inputsDir, year in channels:
+        dataMC = getDataMCfactor(inputsDir, processes)
+        for flag in ["pass", "fail"]:
+            card.write("MCnorm_%s rateParam %s_%s * %f [0.0,%f]\n"%(channel, flag, channel, dataMC, 10.0*dataMC))
+
+    card.write("\n*  autoMCStats  0\n")
+    card.close()
+
+    manifest = {"processes" : procs, "channels" : [{"name" : channel, "dir" : os.path.realpath(inputsDir), "year" : year} for channel, inputsDir, year in channels]}
+    json.dump(manifest, open("%s/channels.json"%(outputDir), "w"), indent=4)
+
+    return ",".join(procs)
+
+def makeCombineScript(outputDir, categories, year, tagger, measure, ptBin, combined=False, failScale="expr", cacheDir="../.workspaces", warmStart=None, pruneTolerance=None, sharedPOIs=False):
 
     script = open("%s/runfits.sh"%(outputDir), "w")
 
-    script.write("DOIMPACTS=0\n\n")
+    repoDir = os.path.dirname(os.path.realpath(__file__))
+
+    # Every stage is run through traceStages.py if tracing is enabled with the TOPTAGSF_TRACE folder
+    script.write("traced() {\n")
+    script.write("    if [[ -n \"${TOPTAGSF_TRACE}\" ]]\n")
+    script.write("    then\n")
+    script.write("        python %s/traceStages.py --run \"$@\"\n"%(repoDir))
+    script.write("    else\n")
+    script.write("        \"${@:2}\"\n")
+    script.write("    fi\n")
+    script.write("}\n\n")
+
+    # The fit level decides how much is run: poi only fits the SFs, diag also saves the pre- and post-fit
+    # shapes needed for plotting, and impacts runs the impacts on top. 0 and 1 are kept for diag and impacts
+    script.write("FITLEVEL=diag\n\n")
     script.write("if [[ $# -gt 0 ]]\n")
     script.write("then\n")
-    script.write("    DOIMPACTS=$1\n")
+    script.write("    FITLEVEL=$1\n")
+    script.write("fi\n\n")
+    script.write("if [[ ${FITLEVEL} == \"0\" ]]\n")
+    script.write("then\n")
+    script.write("    FITLEVEL=diag\n")
+    script.write("elif [[ ${FITLEVEL} == \"1\" ]]\n")
+    script.write("then\n")
+    script.write("    FITLEVEL=impacts\n")
+    script.write("fi\n\n")
+    script.write("if [[ ${FITLEVEL} != \"poi\" && ${FITLEVEL} != \"diag\" && ${FITLEVEL} != \"impacts\" ]]\n")
+    script.write("then\n")
+    script.write("    echo \"Unknown fit level \\\"${FITLEVEL}\\\", use poi, diag or impacts\"\n")
+    script.write("    exit 1\n")
+    script.write("fi\n\n")
+    # The fit can be started from the best-fit values of a related folder, e.g. the adjacent
+    # pt bin or "." for the previous fit of this folder, given here or as second argument
+    seedDir = ""
+    if warmStart != None:
+        seedDir = warmStart
+    script.write("SEEDDIR=\"%s\"\n\n"%(seedDir))
+    script.write("if [[ $# -gt 1 ]]\n")
+    script.write("then\n")
+    script.write("    SEEDDIR=$2\n")
     script.write("fi\n\n")
     script.write("echo \"Do tag and probe\"\n")
-    script.write("text2workspace.py -m 173.2 -P HiggsAnalysis.CombinedLimit.TagAndProbeExtended:tagAndProbe sf.txt --PO categories=%s\n\n"%(categories))
-    script.write("echo \"Run the FitDiagnostics\"\n")
-    script.write("combine -M FitDiagnostics -m 173.2 sf.root --saveShapes --saveWithUncertainties --robustFit=1 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH\n\n")
-    script.write("if [[ ${DOIMPACTS} -eq 1 ]]\n")
+    # The fail scale functions can be built from compiled RooFit classes instead of interpreted formulas
+    physOptions = "--PO categories=%s"%(categories)
+    if failScale != "expr":
+        physOptions += " --PO failScale=%s"%(failScale)
+    if sharedPOIs:
+        physOptions += " --PO sharedPOIs"
+
+    # Workspaces are taken from a cache shared by all folders of the output tree, keyed by the card,
+    # its shape files, the physics model and its options, such that unchanged cards are only built once
+    if cacheDir == None:
+        script.write("traced text2workspace text2workspace.py -m 173.2 -P HiggsAnalysis.CombinedLimit.TagAndProbeExtended:tagAndProbe sf.txt %s\n\n"%(physOptions))
+    else:
+        script.write("traced text2workspace python %s/workspaceCache.py --card sf.txt --output sf.root --options \"%s\" --cacheDir %s || exit 1\n\n"%(repoDir, physOptions, cacheDir))
+    script.write("SEEDOPTIONS=\"\"\n")
+    script.write("rm -f seed.txt\n")
+    script.write("if [[ -n \"${SEEDDIR}\" ]]\n")
+    script.write("then\n")
+    script.write("    python %s/warmStart.py --seedDir ${SEEDDIR} --workspace sf.root --output seed.txt\n"%(repoDir))
+    script.write("    SEEDOPTIONS=`cat seed.txt`\n")
+    script.write("fi\n\n")
+    # A separate fit of this folder replaces any result unpacked into it from a combined fit
+    if not combined:
+        script.write("rm -f unpacked.json\n")
+    script.write("STARTTIME=`date +%s.%N`\n")
+    script.write("if [[ ${FITLEVEL} == \"poi\" ]]\n")
+    script.write("then\n")
+    script.write("    echo \"Run the FitDiagnostics for the POIs only\"\n")
+    script.write("    traced FitDiagnostics combine -M FitDiagnostics -m 173.2 sf.root --skipBOnlyFit --robustFit=1 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH ${SEEDOPTIONS} > fit.log 2>&1\n")
+    script.write("else\n")
+    script.write("    echo \"Run the FitDiagnostics\"\n")
+    script.write("    traced FitDiagnostics combine -M FitDiagnostics -m 173.2 sf.root --saveShapes --saveWithUncertainties --robustFit=1 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH ${SEEDOPTIONS} > fit.log 2>&1\n")
+    script.write("fi\n")
+    script.write("ENDTIME=`date +%s.%N`\n")
+    script.write("cat fit.log\n\n")
+    script.write("python %s/warmStart.py --record --seedDir \"${SEEDDIR}\" --output seed.txt --fitLog fit.log --wallTime `python -c \"print(${ENDTIME} - ${STARTTIME})\"`\n\n"%(repoDir))
+    # With pruning, the card with all systematics is fit as well and the fit fails if the SF moved beyond the tolerance
+    if pruneTolerance != None:
+        script.write("echo \"Validate the pruning against the card with all systematics\"\n")
+        if cacheDir == None:
+            script.write("traced text2workspace text2workspace.py -m 173.2 -P HiggsAnalysis.CombinedLimit.TagAndProbeExtended:tagAndProbe sf_unpruned.txt %s\n"%(physOptions))
+        else:
+            script.write("traced text2workspace python %s/workspaceCache.py --card sf_unpruned.txt --output sf_unpruned.root --options \"%s\" --cacheDir %s || exit 1\n"%(repoDir, physOptions, cacheDir))
+        script.write("traced FitDiagnosticsUnpruned combine -M FitDiagnostics -m 173.2 sf_unpruned.root --skipBOnlyFit --robustFit=1 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH -n Unpruned > fit_unpruned.log 2>&1\n")
+        script.write("traced checkPruning python %s/checkPruning.py --measure %s --tolerance %g || exit 1\n\n"%(repoDir, measure, pruneTolerance))
+    if combined:
+        script.write("echo \"Unpack the results of each channel into its inputs folder\"\n")
+        script.write("traced unpackCombinedFit python %s/unpackCombinedFit.py --combinedDir .\n\n"%(repoDir))
+    script.write("if [[ ${FITLEVEL} == \"impacts\" ]]\n")
     script.write("then\n")
     script.write("    echo \"Run impacts\"\n")
-    script.write("    combineTool.py -M Impacts -d sf.root -m 173.2 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH --doInitialFit --robustFit 1 --exclude 'rgx{prop.*}'\n")
-    script.write("    combineTool.py -M Impacts -d sf.root -m 173.2 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH --robustFit 1 --doFits --parallel 4 --exclude 'rgx{prop.*}'\n")
-    script.write("    combineTool.py -M Impacts -d sf.root -m 173.2 -o impacts.json --exclude 'rgx{prop.*}'\n")
-    script.write("    plotImpacts.py -i impacts.json -o impacts\n")
+    script.write("    traced impacts.initialFit combineTool.py -M Impacts -d sf.root -m 173.2 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH --doInitialFit --robustFit 1 --exclude 'rgx{prop.*}'\n")
+    script.write("    traced impacts.fits combineTool.py -M Impacts -d sf.root -m 173.2 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH --robustFit 1 --doFits --parallel 4 --exclude 'rgx{prop.*}'\n")
+    script.write("    traced impacts.collect combineTool.py -M Impacts -d sf.root -m 173.2 -o impacts.json --exclude 'rgx{prop.*}'\n")
+    script.write("    traced plotImpacts plotImpacts.py -i impacts.json -o impacts\n")
     script.write("    mv impacts.pdf %s_%s_%s%s_impacts.pdf\n"%(year, tagger, measure, ptBin))
     script.write("fi\n")
 
@@ -244,10 +1644,59 @@ def makeCombineScript(outputDir, categories, year, tagger, measure, ptBin):
 
     os.system("chmod +x %s/runfits.sh"%(outputDir))
 
-if __name__ == "__main__":
+# Construct the path to the output folder for a given configuration
+def getOutputDir(base, outputDir, year, tagger, measure, ptBin):
+
+    ptBinStr = ""
+    if ptBin != "inclusive":
+        ptBinStr = "_topPt%s"%(ptBin)
+
+    return "%s/%s/%s_inputs_%s_%s%s/"%(base,outputDir,year,tagger,measure,ptBinStr)
+
+# Construct the path to the output folder for a given configuration and prepare it,
+# returns None if the folder already exists and should not be overwritten
+def makeOutputDir(base, outputDir, year, tagger, measure, ptBin, overwrite):
+
+    outputDir = getOutputDir(base, outputDir, year, tagger, measure, ptBin)
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+    else:
+        if overwrite:
+            print("Removing existing directory \"%s\" and recreating..."%(outputDir))
+            shutil.rmtree(outputDir)
+            os.makedirs(outputDir)
+        else:
+            print("Must specify '--overwrite' option if inputs folder already exists!")
+            return None
+
+    return outputDir
+
+# Run a function in pool processes, once for each tuple of arguments. Either a new pool with up to the given
+# number of workers is started and stopped again, or the given pool, kept alive by the caller, is used.
+# Returns the results of all calls once all are finished
+def runInPool(pool, workers, function, argsList):
+
+    ownPool = pool == None
+    if ownPool:
+        pool = mp.Pool(processes=max(1, min(workers, len(argsList))))
+
+    results = [pool.apply_async(function, args=args) for args in argsList]
+
+    if ownPool:
+        pool.close()
+        pool.join()
+    else:
+        for result in results:
+            result.wait()
+
+    return results
+
+# Command line options of a single configuration, also used to parse the jobs of batchRunner.py
+def makeParser():
+
     usage = "%makeInputsAndCards [options]"
     parser = argparse.ArgumentParser(usage)
-    parser.add_argument("--inputDir",  dest="inputDir",  help="Path to ntuples",    required=True                     )
+    parser.add_argument("--inputDir",  dest="inputDir",  help="Path to ntuples",    default=None                      )
     parser.add_argument("--outputDir", dest="outputDir", help="storing combine",    required=True                     )
     parser.add_argument("--tree",      dest="tree",      help="TTree name to draw", default="TopTagSFSkim"            )
     parser.add_argument("--year",      dest="year",      help="which year",         default="Run2UL"                  )
@@ -257,8 +1706,49 @@ if __name__ == "__main__":
     parser.add_argument("--ptBin",     dest="ptBin",     help="top pt bin",         default="inclusive"               )
     parser.add_argument("--doSysts",   dest="doSysts",   help="include systs",      default=False, action="store_true")
     parser.add_argument("--overwrite", dest="overwrite", help="clear existing dir", default=False, action="store_true")
+    parser.add_argument("--cube",      dest="cube",      help="fill mass x pt cube",default=False, action="store_true")
+    parser.add_argument("--fromCube",  dest="fromCube",  help="dir with cube",      default=None                      )
+    parser.add_argument("--massBins",  dest="massBins",  help="mass bin edges",     default=None                      )
+    parser.add_argument("--wpScan",    dest="wpScan",    help="fill mass x disc",   default=False, action="store_true")
+    parser.add_argument("--cutflow",   dest="cutflow",   help="only make cutflow",  default=False, action="store_true")
+    parser.add_argument("--profile",   dest="profile",   help="profile expressions",default=False, action="store_true")
+    parser.add_argument("--profileEvents",dest="profileEvents",help="events per draw", default=0,     type=int           )
+    parser.add_argument("--combined",  dest="combined",  help="one card all bins",  default=False, action="store_true")
+    parser.add_argument("--sharedPOIs",dest="sharedPOIs",help="one SF all bins",    default=False, action="store_true")
+    parser.add_argument("--failScale", dest="failScale", help="expr or poly",       default="expr"                    )
+    parser.add_argument("--prune",     dest="prune",     help="prune systs",        default=False, action="store_true")
+    parser.add_argument("--pruneNorm", dest="pruneNorm", help="norm. threshold",    default=0.005, type=float         )
+    parser.add_argument("--pruneShape",dest="pruneShape",help="shape threshold",    default=0.005, type=float         )
+    parser.add_argument("--pruneTolerance",dest="pruneTolerance",help="max. delta SF", default=0.01,  type=float         )
+    parser.add_argument("--cacheDir",  dest="cacheDir",  help="workspace cache",    default="../.workspaces"          )
+    parser.add_argument("--noCache",   dest="noCache",   help="no workspace cache", default=False, action="store_true")
+    parser.add_argument("--warmStart", dest="warmStart", help="dir to seed fit",    default=None                      )
+    parser.add_argument("--workers",   dest="workers",   help="pool processes",     default=4,     type=int           )
+    parser.add_argument("--trace",     dest="trace",     help="dir for trace",      default=None                      )
+    parser.add_argument("--progress",  dest="progress",  help="status every N sec", default=30.0,  type=float         )
+    parser.add_argument("--chunkSize", dest="chunkSize", help="entries per draw",   default=0,     type=int           )
+    parser.add_argument("--bootstrap", dest="bootstrap", help="bootstrap replicas", default=0,     type=int           )
+    parser.add_argument("--bootSeed",  dest="bootSeed",  help="bootstrap seed",     default=12345, type=int           )
+    parser.add_argument("--procs",     dest="procs",     help="only draw procs",    default=None                      )
+    parser.add_argument("--mergeOnly", dest="mergeOnly", help="only hadd and card", default=False, action="store_true")
+    parser.add_argument("--histMode",  dest="histMode",  help="draw or jit",        default="draw"                    )
+    parser.add_argument("--kernelDir", dest="kernelDir", help="compiled kernels",   default=".kernels"                )
+    parser.add_argument("--resume",    dest="resume",    help="redo failed tasks",  default=False, action="store_true")
+
+    return parser
+
+# Make the inputs, data card and combine script of a single configuration. A pool of workers (and a
+# multiprocessing manager) can be given to be reused across configurations, e.g. by batchRunner.py,
+# otherwise a pool is started for this configuration only. Returns False if anything went wrong
+def run(args, pool=None, manager=None):
 
-    args = parser.parse_args()
+    # Tracing can also be enabled for the whole pipeline through the environment
+    if args.trace != None:
+        enableTrace(args.trace)
+
+    if args.inputDir == None and args.fromCube == None and not args.combined and not args.mergeOnly:
+        print("Must specify '--inputDir' unless deriving inputs with '--fromCube' or '--combined'!")
+        return False
     
     # The auxiliary file contains many "hardcoded" items
     # describing which histograms to get and how to draw
@@ -266,52 +1756,245 @@ if __name__ == "__main__":
     # and thus are kept in separate sidecar file.
     importedGoods = __import__(args.options)
 
-    processes, histograms, systematics = importedGoods.initHistos(args.year, args.measure, args.tagger, args.ptBin, args.doSysts)
+    # When deriving from the template cube or making a combined card, several
+    # comma separated pt bins (and years for the latter) may be requested at once
+    ptBins = [args.ptBin]
+    years  = [args.year]
+    if args.fromCube != None or args.combined:
+        ptBins = args.ptBin.split(",")
+        years  = args.year.split(",")
+        args.ptBin = "inclusive"
+        args.year  = years[0]
+
+    processes, histograms, systematics = importedGoods.initHistos(args.year, args.measure, args.tagger, args.ptBin, args.doSysts, args.cube, args.wpScan)
     
     for hname, ops in histograms.items():
         print(hname, ops)
 
     base = os.getenv("PWD")
+
+    # Workspaces are built directly in runfits.sh if the cache is disabled
+    cacheDir = args.cacheDir
+    if args.noCache:
+        cacheDir = None
+
+    # Negligible shape systematics can be dropped or converted to lnN before writing the card
+    pruning        = None
+    pruneTolerance = None
+    if args.prune:
+        pruning        = {"norm" : args.pruneNorm, "shape" : args.pruneShape}
+        pruneTolerance = args.pruneTolerance
+
+    # A single card for all requested pt bins and years is made from the existing
+    # inputs folders, such that one fit gives the SFs of all of them at once
+    if args.combined:
+
+        channels = []
+        for year in years:
+            for ptBin in ptBins:
+                channel = ptBin
+                if len(years) > 1:
+                    channel = "%s_%s"%(year, ptBin)
+
+                inputsDir = getOutputDir(base, args.outputDir, year, args.tagger, args.measure, ptBin)
+                if not os.path.exists("%s/top_mass_pass.root"%(inputsDir)):
+                    print("Missing inputs for year:%s, pt:%s in \"%s\""%(year, ptBin, inputsDir))
+                    return False
+
+                channels.append((channel, inputsDir, year))
+
+        outputDir = "%s/%s/%s_combined_%s_%s/"%(base, args.outputDir, "-".join(years), args.tagger, args.measure)
+        if os.path.exists(outputDir):
+            if not args.overwrite:
+                print("Must specify '--overwrite' option if combined folder already exists!")
+                return False
+            shutil.rmtree(outputDir)
+        os.makedirs(outputDir)
+
+        categories = makeCombinedDatacard(outputDir, channels, processes, systematics, args.measure)
+
+        makeCombineScript(outputDir, categories, "-".join(years), args.tagger, args.measure, "_combined", True, args.failScale, cacheDir, args.warmStart, None, args.sharedPOIs)
+
+        return True
+
+    # Inputs for any mass binning and pt bin can be derived from an existing
+    # template cube by summing bins, without the need to redraw from the ntuples
+    if args.fromCube != None:
+
+        massBins = importedGoods.massBins[args.tagger]
+        if args.massBins != None:
+            massBins = [float(edge) for edge in args.massBins.split(",")]
+
+        for ptBin in ptBins:
+
+            outputDir = makeOutputDir(base, args.outputDir, args.year, args.tagger, args.measure, ptBin, args.overwrite)
+            if outputDir == None:
+                return False
+
+            if os.path.realpath(outputDir) == os.path.realpath(args.fromCube):
+                print("Cannot derive inputs into the folder holding the template cube!")
+                return False
+
+            if not makeTemplatesFromCube(args.fromCube, outputDir, massBins, ptBin):
+                return False
+
+            makeDatacard(outputDir, processes, systematics, args.measure, args.year, pruning)
+
+            ptBinStr = ""
+            if ptBin != "inclusive":
+                ptBinStr = "_%s"%(ptBin)
+
+            makeCombineScript(outputDir, ",".join(processes), args.year, args.tagger, args.measure, ptBinStr, False, args.failScale, cacheDir, args.warmStart, pruneTolerance)
+
+        return True
     
+    # In cutflow mode, no histograms are drawn and the cutflow table is
+    # written next to the data card of a possibly existing output folder
+    if args.cutflow:
+
+        outputDir = getOutputDir(base, args.outputDir, args.year, args.tagger, args.measure, args.ptBin)
+        if not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+
+        results = runInPool(pool, args.workers, processCutflow, [(args.inputDir, args.year, proc, stub, histograms, args.tree) for proc, stub in processes.items()])
+
+        cutflows = {}
+        for result in results:
+            cutflows.update(result.get())
+
+        writeCutflowTable(outputDir, histograms, cutflows)
+
+        return True
+
+    # In profile mode, no histograms are written and the profile of the expressions
+    # of each input file is written next to the data card of a possibly existing output folder
+    if args.profile:
+
+        outputDir = getOutputDir(base, args.outputDir, args.year, args.tagger, args.measure, args.ptBin)
+        if not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+
+        # Processes drawn from the same input file, e.g. TTmatch and TTunmatch, are profiled together
+        stubs = {}
+        for proc, stub in processes.items():
+            stubs.setdefault(stub, []).append(proc)
+
+        stubNames = sorted(stubs.keys())
+        results   = runInPool(pool, args.workers, processProfile, [(args.inputDir, args.year, stub, stubs[stub], histograms, args.tree, args.profileEvents) for stub in stubNames])
+
+        writeProfileReport(outputDir, dict((stubNames[iStub], results[iStub].get()) for iStub in range(len(stubNames))))
+
+        return True
+
     # The draw histograms and their host ROOT files are kept in the output
     # folder in the user's condor folder. This then makes running a plotter
     # on the output exactly like running on histogram output from an analyzer
-
-    ptBinStr = ""
-    if args.ptBin != "inclusive":
-        ptBinStr = "_topPt%s"%(args.ptBin)
-            
-    outputDir = "%s/%s/%s_inputs_%s_%s%s/"%(base,args.outputDir,args.year,args.tagger,args.measure,ptBinStr)
-    if not os.path.exists(outputDir):
-        os.makedirs(outputDir)
+    # When split into tasks, e.g. by submitJobs.py, each task draws only some processes into the
+    # already prepared output folder, and the outputs are merged by a final run with --mergeOnly
+    # When resuming, the output folder of an earlier run is kept and only the tasks not done are drawn
+    if args.procs != None or args.mergeOnly or args.resume:
+        outputDir = getOutputDir(base, args.outputDir, args.year, args.tagger, args.measure, args.ptBin)
+        if not os.path.exists(outputDir):
+            if args.mergeOnly:
+                print("Nothing to merge in \"%s\""%(outputDir))
+                return False
+            makeSharedDir(outputDir)
     else:
-        if args.overwrite:
-            print("Removing existing directory \"%s\" and recreating..."%(outputDir))
-            shutil.rmtree(outputDir)
-            os.makedirs(outputDir)
-        else:
-            print("Must specify '--overwrite' option if inputs folder already exists!")
-            quit()
-    
+        outputDir = makeOutputDir(base, args.outputDir, args.year, args.tagger, args.measure, args.ptBin, args.overwrite)
+        if outputDir == None:
+            return False
+
+    drawProcesses = processes
+    if args.procs != None:
+        drawProcesses = odict([(proc, stub) for proc, stub in processes.items() if proc in args.procs.split(",")])
+    elif args.mergeOnly:
+        drawProcesses = odict()
+
+    if args.histMode not in ["draw", "jit"]:
+        print("Unknown histogramming mode \"%s\", use draw or jit"%(args.histMode))
+        return False
+
+    tasksDir = getTasksDir(outputDir)
+    makeSharedDir(tasksDir)
+
+    # The compiled fill kernels are kept across runs, such that the same expressions are compiled only once
+    kernelDir = os.path.realpath(args.kernelDir)
+    if args.histMode == "jit":
+        makeSharedDir(kernelDir)
+
+    # Workers report their progress through a shared queue to a monitor thread, which
+    # prints a status line and appends throughput snapshots to progress.jsonl
+    progress = None
+    monitor  = None
+    if args.progress > 0 and len(drawProcesses) > 0:
+        if manager == None:
+            manager = mp.Manager()
+        progress = manager.Queue()
+        monitor  = ProgressMonitor(progress, "%s/progress.jsonl"%(outputDir), args.progress, os.path.basename(outputDir.rstrip("/")))
+        monitor.start()
+
     # For speed, histogramming for each specified physics process, e.g. TT, QCD
-    # is run in a separate pool process. This is limited to 4 at a time to avoid abuse
-    manager = mp.Manager()
-    pool = mp.Pool(processes=min(4, len(processes)))
-    
+    # is run in a separate pool process. This is limited to 4 at a time by default to avoid abuse.
     # The processFile function is attached to each process
-    for proc, stub in processes.items():
-        pool.apply_async(processFile, args=(outputDir, args.inputDir, args.year, proc, stub, histograms, args.tree))
-    
-    pool.close()
-    pool.join()
+    with stage("histogramming", job=outputDir, workers=args.workers):
+        results = runInPool(pool, args.workers, processFile, [(outputDir, args.inputDir, args.year, proc, stub, histograms, args.tree, args.chunkSize, progress, args.bootstrap, args.bootSeed, args.histMode, kernelDir, args.resume) for proc, stub in drawProcesses.items()])
 
-    # Hadd ROOT files with the drawn histograms into two total ROOT files and cleanup the rest
-    os.system("hadd -f %s/top_mass_pass.root %s/*_pass.root >> %s/python.log 2>&1"%(outputDir, outputDir, outputDir))
-    os.system("hadd -f %s/top_mass_fail.root %s/*_fail.root >> %s/python.log 2>&1"%(outputDir, outputDir, outputDir))
-    os.system("rm %s/[A-Z]*_{fail,pass}.root >> %s/python.log"%(outputDir, outputDir))
+    if monitor != None:
+        monitor.stop()
 
-    makeDatacard(outputDir, processes, systematics, args.measure, args.year)
+    # Failures of single tasks are returned by the workers, anything else is raised again by get()
+    failures = []
+    for proc, result in zip(drawProcesses.keys(), results):
+        try:
+            failures += result.get()
+        except Exception:
+            failures.append((proc, traceback.format_exc()))
+
+    if len(failures) > 0:
+        for taskName, problem in failures:
+            print("%-30s %s"%(taskName, problem.strip()))
+        print("%d tasks failed in \"%s\", rerun with '--resume' to redo only the failed and missing tasks"%(len(failures), outputDir))
+        return False
+
+    if args.procs != None:
+        return True
+
+    # All tasks, also of processes drawn by other runs with --procs, have to be done before merging
+    missing = [(taskName, getTaskProblem(tasksDir, taskName)) for taskName in getTaskNames(processes, histograms)]
+    missing = [(taskName, problem) for taskName, problem in missing if problem != None]
+    if len(missing) > 0:
+        for taskName, problem in missing:
+            print("%-30s %s"%(taskName, problem.strip()))
+        print("%d tasks are not done in \"%s\", not merging the outputs"%(len(missing), outputDir))
+        return False
+
+    # Hadd ROOT files with the drawn histograms into total ROOT files, e.g. top_mass_pass.root
+    with stage("hadd", job=outputDir):
+        outputs = getOutputs(histograms)
+        if args.bootstrap > 0:
+            outputs += [getBootOutput(output) for output in getOutputs(histograms) if output.startswith("top_mass")]
+        if not haddOutputs(outputDir, outputs):
+            return False
+
+    with stage("makeDatacard", job=outputDir):
+        makeDatacard(outputDir, processes, systematics, args.measure, args.year, pruning)
 
     categories = ",".join(processes)
 
-    makeCombineScript(outputDir, categories, args.year, args.tagger, args.measure, ptBinStr.replace("topPt", ""))
+    ptBinStr = ""
+    if args.ptBin != "inclusive":
+        ptBinStr = "_%s"%(args.ptBin)
+
+    makeCombineScript(outputDir, categories, args.year, args.tagger, args.measure, ptBinStr, False, args.failScale, cacheDir, args.warmStart, pruneTolerance)
+
+    # The outputs of the tasks are only removed once everything is merged and written
+    shutil.rmtree(tasksDir)
+
+    return True
+
+if __name__ == "__main__":
+
+    args = makeParser().parse_args()
+
+    if not run(args):
+        exit(1)
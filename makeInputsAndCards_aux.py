@@ -3,7 +3,21 @@ import copy
 
 from collections import OrderedDict as odict
 
-def initHistos(year, measurement, tagger, ptbin, doSysts):
+# Mass binning of the templates used in the fit for each tagger
+massBins = {"Res" : list(range(100, 275, 25)),
+            "Mrg" : list(range(100, 280, 15))}
+
+# Fine binning of the optional top mass x top pt template cube. The edges
+# are chosen such that any of the standard mass binnings above and any of
+# the pt bin boundaries used in runAllFits.sh can be recovered by summing bins
+cubeMassBins = list(range(100, 285, 5))
+cubePtBins   = list(range(0, 2010, 10))
+
+# Fine binning of the top tagger discriminant for the working point scan,
+# any working point given with a precision of 0.001 falls onto a bin edge
+discBins = [iBin / 1000.0 for iBin in range(0, 1001)]
+
+def initHistos(year, measurement, tagger, ptbin, doSysts, doCube=False, doWPScan=False):
 
     # Define working points for merged and resolved tagger per year
     WPs = {}
@@ -29,10 +43,22 @@ def initHistos(year, measurement, tagger, ptbin, doSysts):
     selections = {"Eff_pass" : "pass_TTCR${SYST}&&best%sTopDisc${SYST}>${WP}"%(topType),
                   "Eff_fail" : "pass_TTCR${SYST}&&best%sTopDisc${SYST}<=${WP}"%(topType),
                   "Mis_pass" : "pass_QCDCR${SYST}&&NGoodBJets_pt30${SYST}==0&&best%sTopDisc${SYST}>${WP}"%(topType),
-                  "Mis_fail" : "pass_QCDCR${SYST}&&NGoodBJets_pt30${SYST}==0&&best%sTopDisc${SYST}<=${WP}"%(topType)
+                  "Mis_fail" : "pass_QCDCR${SYST}&&NGoodBJets_pt30${SYST}==0&&best%sTopDisc${SYST}<=${WP}"%(topType),
+                  "Eff_scan" : "pass_TTCR${SYST}",
+                  "Mis_scan" : "pass_QCDCR${SYST}&&NGoodBJets_pt30${SYST}==0"
     }
 
-    histosInfo = {"${TOP}TopCandMass" : {"weight" : "weight${PROC}${SYST}", "selection" : "${SELECTION}", "variable" : "max(101.0, min(best%sTopMass${SYST}, 264.0))"%(topType), "xbins" : 15, "xmin" : 100, "xmax" : 250}}
+    histosInfo = {"${TOP}TopCandMass" : {"weight" : "weight${PROC}${SYST}", "selection" : "${SELECTION}", "variable" : "max(101.0, min(best%sTopMass${SYST}, 264.0))"%(topType), "xbins" : massBins[tagger], "output" : "top_mass", "categories" : ["pass", "fail"]}}
+
+    # The template cube is filled inclusively in top pt, such that the mass
+    # binning and pt slicing can be decided later when making the data card
+    if doCube:
+        histosInfo["${TOP}TopCandMassVsPt"] = {"weight" : "weight${PROC}${SYST}", "selection" : "${SELECTION}", "variable" : "max(101.0, min(best%sTopMass${SYST}, 264.0))"%(topType), "xbins" : cubeMassBins, "yvariable" : "best%sTopPt${SYST}"%(topType), "ybins" : cubePtBins, "output" : "top_cube", "categories" : ["pass", "fail"], "inclusivePt" : True}
+
+    # For the working point scan, mass vs. discriminant is filled without any cut on the
+    # discriminant, pass and fail templates for any working point are then cumulative sums
+    if doWPScan:
+        histosInfo["${TOP}TopCandMassVsDisc"] = {"weight" : "weight${PROC}${SYST}", "selection" : "${SELECTION}", "variable" : "max(101.0, min(best%sTopMass${SYST}, 264.0))"%(topType), "xbins" : cubeMassBins, "yvariable" : "best%sTopDisc${SYST}"%(topType), "ybins" : discBins, "output" : "top_disc", "categories" : ["scan"]}
 
     # Match process names to generic name used for naming ROOT files
     # Also, for efficiency, split TT into GEN matched and unmatched categories
@@ -90,18 +116,18 @@ def initHistos(year, measurement, tagger, ptbin, doSysts):
                 elif process == "TTunmatch": extraSel = "&&best%sTopMassGenMatch%s==0"%(topType, systTreeStub)
                 #elif process == "QCD":       extraSel = "&&weightQCD%s<=100.0"%(systTreeStub)
 
-                for cat in ["pass", "fail"]:
+                for cat in ["pass", "fail", "scan"]:
 
                     selStr = "%s_%s"%(measurement, cat)
                     selExp = selections[selStr]
 
                     for histoName, histoOps in histosInfo.items():
+                        if cat not in histoOps["categories"]: continue
+
                         hopsCopy = copy.copy(histoOps)
 
-                        if   tagger == "Res":
-                            hopsCopy["xbins"] = range(100, 275, 25)
-                        elif tagger == "Mrg":
-                            hopsCopy["xbins"] = range(100, 280, 15)
+                        # Histograms are collected into one ROOT file per output type and category
+                        hopsCopy["output"] = "%s_%s"%(histoOps["output"], cat)
 
                         # Decide which event weight to use based on the desired measurement
                         proc = ""
@@ -111,7 +137,7 @@ def initHistos(year, measurement, tagger, ptbin, doSysts):
 
                         # Resolved string "100to150" to make selection on top pt
                         ptSel = ""
-                        if "to" in ptbin:
+                        if "to" in ptbin and not hopsCopy.get("inclusivePt", False):
                             ptRange = ptbin.split("to")
                             ptSel = "&&best%sTopPt%s>%s&&best%sTopPt%s<=%s"%(topType, systTreeStub, ptRange[0], topType, systTreeStub, ptRange[-1].replace("Inf", "9999"))
 
@@ -121,6 +147,8 @@ def initHistos(year, measurement, tagger, ptbin, doSysts):
                         else:              hopsCopy["weight"] = hopsCopy["weight"].replace("${PROC}", proc).replace("${SYST}", systTreeStub)
 
                         hopsCopy["variable"] = hopsCopy["variable"].replace("${SYST}", systTreeStub)
+                        if "yvariable" in hopsCopy:
+                            hopsCopy["yvariable"] = hopsCopy["yvariable"].replace("${SYST}", systTreeStub)
 
                         if   systematic == "puUp":      hopsCopy["weight"] += "*puSysUpCorr/puWeightCorr"
                         elif systematic == "puDown":    hopsCopy["weight"] += "*puSysDownCorr/puWeightCorr"
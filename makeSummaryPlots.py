@@ -5,6 +5,11 @@ import json
 import array
 import shutil
 import argparse
+import traceback
+import subprocess
+import multiprocessing as mp
+
+from collections import OrderedDict as odict
 
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
@@ -14,6 +19,9 @@ ROOT.gStyle.SetOptStat(0)
 ROOT.gStyle.SetOptFit(0)
 ROOT.gStyle.SetPalette(1)
 
+from traceStages import stage, enableTrace
+from makeInputsAndCards import getDataMCfactor
+
 class SFresult:
 
     def __init__(self, SF, SFHiErr, SFLoErr, tagger, measurement, ptBin):
@@ -74,14 +82,98 @@ class SFresult:
 
         print(self.SFHiErr, self.SFLoErr)
 
+# Read the SF and its uncertainties for the process the SF is measured for
+# from the signal+background fit of a FitDiagnostics output in fitpath
+def getFitResult(fitpath, tagger, measurement, ptBin):
+
+    fdiag = ROOT.TFile.Open("%s/fitDiagnosticsTest.root"%(fitpath), "READONLY")
+    if fdiag == None:
+        return None
+
+    ttree = fdiag.Get("tree_fit_sb")
+    if ttree == None:
+        fdiag.Close()
+        return None
+
+    proc = "TTmatch"
+    if measurement == "Mis":
+        proc = "QCD"
+
+    ttree.GetEntry(0)
+    SF      = getattr(ttree, "SF_%s"%(proc))
+    SFLoErr = getattr(ttree, "SF_%sLoErr"%(proc))
+    SFHiErr = getattr(ttree, "SF_%sHiErr"%(proc))
+
+    fdiag.Close()
+
+    return SFresult(SF, SFHiErr, SFLoErr, tagger, measurement, ptBin)
+
+# Read the SF and its 68% interval from the likelihood scan made by runLikelihoodScan.py,
+# None is returned if there is no scan or its interval is not contained in the scan range
+def getScanResult(fitpath, tagger, measurement, ptBin):
+
+    scanJson = "%s/scan.json"%(fitpath)
+    if not os.path.exists(scanJson):
+        return None
+
+    payload = json.load(open(scanJson))
+    if payload["SFLoErr"] == None or payload["SFHiErr"] == None:
+        return None
+
+    return SFresult(payload["SF"], payload["SFHiErr"], payload["SFLoErr"], tagger, measurement, ptBin)
+
+# SF result of a fit folder: the profile likelihood interval of the scan if requested and available, otherwise
+# the FitDiagnostics result, whose uncertainty is increased from the impacts if they were run. The impacts
+# are never applied to the scan result, as increaseUnc resets the SF from the impacts fit for Mis
+def getSFResult(fitpath, tagger, measurement, ptBin, useScans=False):
+
+    if useScans:
+        scanResult = getScanResult(fitpath, tagger, measurement, ptBin)
+        if scanResult != None:
+            return scanResult
+        print("No likelihood scan in \"%s\", using the FitDiagnostics result"%(fitpath))
+
+    aResult = getFitResult(fitpath, tagger, measurement, ptBin)
+    if aResult != None and os.path.exists("%s/impacts.json"%(fitpath)):
+        aResult.increaseUnc("%s/impacts.json"%(fitpath))
+
+    return aResult
+
+# Check if the FitDiagnostics output in fitpath has the pre- and post-fit shapes,
+# which are only saved when runfits.sh is run at the diag or impacts level
+def hasFitShapes(fitpath):
+
+    fdiag = ROOT.TFile.Open("%s/fitDiagnosticsTest.root"%(fitpath), "READONLY")
+    if fdiag == None:
+        return False
+
+    shapes = fdiag.Get("shapes_fit_s") != None
+
+    fdiag.Close()
+
+    return shapes
+
+# Year, tagger, measurement and pt bin of a fit folder, e.g. 2017_inputs_Mrg_Eff_topPt600toInf
+# ==> ("2017", "Mrg", "Eff", "600to1200"), or None if it is not the folder of a single pt bin
+def getFitDirInfo(fitDir):
+
+    chunks = os.path.basename(fitDir.rstrip("/")).split("_")
+    if len(chunks) < 4 or "topPt" not in chunks[-1]:
+        return None
+
+    return chunks[0], chunks[2], chunks[3], chunks[-1].split("topPt")[-1].replace("Inf", "1200")
+
 class Plotter:
     
-    def __init__(self, year, approved, inputDir, outputDir):
-
-        self.year      = year
-        self.inputDir  = os.path.realpath(inputDir)
-        self.outputDir = os.path.realpath(outputDir)
-        self.approved  = approved
+    def __init__(self, year, approved, inputDir, outputDir, makeShapes=False, useScans=False, fmt="pdf"):
+
+        self.year       = year
+        self.inputDir   = os.path.realpath(inputDir)
+        self.outputDir  = os.path.realpath(outputDir)
+        self.approved   = approved
+        self.makeShapes = makeShapes
+        self.useScans   = useScans
+        self.fmt        = fmt
     
         self.LeftMargin = 0.1
         self.RightMargin = 0.04
@@ -123,7 +215,8 @@ class Plotter:
             "2016preVFP"  : 19.52,
             "2016postVFP" : 16.81,
             "2017"        : 41.48,
-            "2018"        : 59.83
+            "2018"        : 59.83,
+            "Run2UL"      : 137.64
         }
 
         if not os.path.isdir(self.outputDir):
@@ -139,19 +232,38 @@ class Plotter:
         doMis = False
         for fitDir in fitDirs:
         
-            chunks = fitDir.split("_")
-
-            if self.year != chunks[0]: continue
+            info = getFitDirInfo(fitDir)
+            if info == None: continue
 
-            if "topPt" not in chunks[-1]: continue
+            year, tagger, measure, ptBin = info
 
-            ptBin   = chunks[-1].split("topPt")[-1].replace("Inf", "1200")
-            tagger  = chunks[2]
-            measure = chunks[3]
+            if self.year != year: continue
 
             fitPath = self.inputDir + "/" + fitDir
-            aResult = self.makePrePostFitPlot(fitPath, ptBin, measure, tagger, "pass")
-            _       = self.makePrePostFitPlot(fitPath, ptBin, measure, tagger, "fail")
+
+            # The fits may have been run for the POIs only, in which case the shapes
+            # for the pre- and post-fit plots are only made if explicitly requested
+            # Folders holding the unpacked result of a combined fit are not refit on their own,
+            # which would replace the combined result, the combined folder has to be rerun instead
+            if self.makeShapes and not hasFitShapes(fitPath):
+                if os.path.exists("%s/unpacked.json"%(fitPath)):
+                    combinedDir = json.load(open("%s/unpacked.json"%(fitPath)))["combinedDir"]
+                    print("Not refitting \"%s\" holding the result of a combined fit, rerun \"%s\" at the diag level instead"%(fitPath, combinedDir))
+                else:
+                    print("Running fits with shapes for \"%s\"..."%(fitPath))
+                    with stage("runfits.sh diag", job=fitPath):
+                        subprocess.call("./runfits.sh diag >> combine.log 2>&1", shell=True, cwd=fitPath)
+
+            # The profile likelihood interval replaces the FitDiagnostics one where a scan is available
+            with stage("getFitResult", job=fitPath):
+                aResult = getSFResult(fitPath, tagger, measure, ptBin, self.useScans)
+
+            if hasFitShapes(fitPath):
+                with stage("makePrePostFitPlot", job=fitPath):
+                    self.makePrePostFitPlot(fitPath, ptBin, measure, tagger, "pass")
+                    self.makePrePostFitPlot(fitPath, ptBin, measure, tagger, "fail")
+            else:
+                print("No fit shapes in \"%s\", skipping pre- and post-fit plots"%(fitPath))
 
             if   measure == "Eff":
                 doEff = True
@@ -163,16 +275,14 @@ class Plotter:
 
             impactsFile = fitDir.replace("/", "").replace("_inputs", "").replace("topPt", "") + "_impacts.pdf"
             impactsPath = fitPath + "/" + impactsFile 
-            impactsJson = fitPath + "/impacts.json"
             if os.path.exists(impactsPath):
                 shutil.copyfile(impactsPath, self.outputDir + "/" + impactsFile.replace("Inf", "1200"))
 
-            aResult.increaseUnc(impactsJson)
-
-        if doEff:
-            self.getSFSummary(results, "Eff")
-        if doMis:
-            self.getSFSummary(results, "Mis")
+        with stage("getSFSummary"):
+            if doEff:
+                self.getSFSummary(results, "Eff")
+            if doMis:
+                self.getSFSummary(results, "Mis")
 
     def remapAxis(self, obj, objRef):
 
@@ -293,18 +403,11 @@ class Plotter:
         SFLoErr = 0.
         SFHiErr = 0.
 
-        ttree = fdiag.Get("tree_fit_sb")
-        if ttree != None:
-            ttree.GetEntry(0)
-        
-            if   measurement == "Eff":
-                SF      = ttree.SF_TTmatch
-                SFLoErr = ttree.SF_TTmatchLoErr
-                SFHiErr = ttree.SF_TTmatchHiErr
-            elif measurement == "Mis":
-                SF      = ttree.SF_QCD
-                SFLoErr = ttree.SF_QCDLoErr
-                SFHiErr = ttree.SF_QCDHiErr
+        fitResult = getFitResult(fitpath, tagger, measurement, ptBin)
+        if fitResult != None:
+            SF      = fitResult.SF
+            SFLoErr = fitResult.SFLoErr
+            SFHiErr = fitResult.SFHiErr
     
         for hname in prefitHistos.keys():
             prefitHistos[hname].SetTitle("")
@@ -485,10 +588,297 @@ class Plotter:
 
         canvas.RedrawAxis()
         
-        canvas.Print(self.outputDir + "/%s_%s_%s_%s_%s.pdf"%(self.year, tagger, measurement, ptBin, category))
+        canvas.Print(self.outputDir + "/%s_%s_%s_%s_%s.%s"%(self.year, tagger, measurement, ptBin, category, self.fmt))
 
         return SFresult(SF, SFHiErr, SFLoErr, tagger, measurement, ptBin)
     
+    # Templates of a category read from the inputs, as {process : {"" : nominal, systematic : (Up, Down)}}
+    # for the MC and the data_obs histogram, which is None if the inputs were made without data
+    def getPrefitTemplates(self, finputs):
+
+        templates = odict()
+        for key in finputs.GetListOfKeys():
+            name = key.GetName()
+            if name == "data_obs" or "_" in name:
+                continue
+            histo = key.ReadObj()
+            histo.SetDirectory(0)
+            templates[name] = {"" : histo}
+
+        for key in finputs.GetListOfKeys():
+            name = key.GetName()
+            if not name.endswith("Up") or "_" not in name:
+                continue
+
+            proc, syst = name.rsplit("_", 1)
+            syst = syst[:-len("Up")]
+
+            up   = key.ReadObj()
+            down = finputs.Get("%s_%sDown"%(proc, syst))
+            if proc not in templates or down == None:
+                continue
+
+            up.SetDirectory(0)
+            down.SetDirectory(0)
+            templates[proc][syst] = (up, down)
+
+        data = finputs.Get("data_obs")
+        if data != None:
+            data.SetDirectory(0)
+
+        return templates, data
+
+    # Uncertainty band on the total prefit MC per bin: each systematic is varied for all processes at once, the
+    # larger upward and downward shifts of its Up and Down variations are added in quadrature, together with
+    # the statistical uncertainty of the templates. Returns the total MC and the lower and upper uncertainties
+    def getPrefitBand(self, templates):
+
+        total = None
+        for proc in templates.keys():
+            if total == None:
+                total = templates[proc][""].Clone("prefit_total")
+                total.SetDirectory(0)
+            else:
+                total.Add(templates[proc][""])
+
+        systs = []
+        for proc in templates.keys():
+            for syst in templates[proc].keys():
+                if syst != "" and syst not in systs:
+                    systs.append(syst)
+
+        errLo = []
+        errHi = []
+        for iBin in range(1, total.GetNbinsX()+1):
+            lo2 = total.GetBinError(iBin)**2.0
+            hi2 = total.GetBinError(iBin)**2.0
+            for syst in systs:
+                shiftUp   = 0.0
+                shiftDown = 0.0
+                for proc in templates.keys():
+                    if syst not in templates[proc]:
+                        continue
+                    nominal = templates[proc][""].GetBinContent(iBin)
+                    shiftUp   += templates[proc][syst][0].GetBinContent(iBin) - nominal
+                    shiftDown += templates[proc][syst][1].GetBinContent(iBin) - nominal
+
+                hi2 += max(shiftUp, shiftDown, 0.0)**2.0
+                lo2 += min(shiftUp, shiftDown, 0.0)**2.0
+
+            errLo.append(lo2**0.5)
+            errHi.append(hi2**0.5)
+
+        return total, errLo, errHi
+
+    # Graph of the band around the given central values, e.g. the total MC or 1 for the ratio
+    def getBandGraph(self, total, centers, errLo, errHi):
+
+        nBins = total.GetNbinsX()
+        xval  = array.array('d', [total.GetXaxis().GetBinCenter(iBin+1) for iBin in range(nBins)])
+        xerr  = array.array('d', [0.5 * total.GetXaxis().GetBinWidth(iBin+1) for iBin in range(nBins)])
+
+        band = ROOT.TGraphAsymmErrors(nBins, xval, array.array('d', centers), xerr, xerr, array.array('d', errLo), array.array('d', errHi))
+        band.SetFillColor(ROOT.kGray+2)
+        band.SetFillStyle(3354)
+        band.SetLineWidth(0)
+        band.SetMarkerSize(0)
+
+        return band
+
+    # Stacked prefit templates of the MC with the systematic band and the data, and the ratio of data to
+    # the total MC, made directly from the inputs of a folder such that no fit is needed at all
+    def makePrefitPlot(self, fitpath, ptBin, measurement, tagger, category):
+
+        orderedNames = None
+        if   measurement == "Eff":
+            orderedNames = ["TTmatch", "TTunmatch", "Other", "QCD", "WJets", "DYJets", "Boson", "TTX", "ST"]
+        elif measurement == "Mis":
+            orderedNames = ["QCD", "TT", "Other", "WJets", "DYJets", "Boson", "TTX", "ST"]
+
+        finputs = ROOT.TFile.Open("%s/top_mass_%s.root"%(fitpath, category), "READONLY")
+        if finputs == None:
+            return False
+
+        templates, data = self.getPrefitTemplates(finputs)
+        finputs.Close()
+
+        if len(templates) == 0:
+            print("No templates in \"%s/top_mass_%s.root\""%(fitpath, category))
+            return False
+
+        # The card scales all MC by the MCnorm rateParam, i.e. the data/MC factor of both categories, so the
+        # templates are scaled by the same factor to match the prefit of combine. Without data they are left as is
+        normalized = False
+        if data != None:
+            dataMC = getDataMCfactor(fitpath, list(templates.keys()))
+            for proc in templates.keys():
+                for syst, histos in templates[proc].items():
+                    if syst == "":
+                        histos.Scale(dataMC)
+                    else:
+                        histos[0].Scale(dataMC)
+                        histos[1].Scale(dataMC)
+            normalized = True
+
+        total, errLo, errHi = self.getPrefitBand(templates)
+        band = self.getBandGraph(total, [total.GetBinContent(iBin+1) for iBin in range(total.GetNbinsX())], errLo, errHi)
+
+        ratioCenters = []
+        ratioLo      = []
+        ratioHi      = []
+        for iBin in range(total.GetNbinsX()):
+            content = total.GetBinContent(iBin+1)
+            ratioCenters.append(1.0)
+            ratioLo.append(errLo[iBin] / content if content > 0.0 else 0.0)
+            ratioHi.append(errHi[iBin] / content if content > 0.0 else 0.0)
+        ratioBand = self.getBandGraph(total, ratioCenters, ratioLo, ratioHi)
+
+        # The first process is drawn on top of the stack
+        procs = [proc for proc in orderedNames if proc in templates] + [proc for proc in templates.keys() if proc not in orderedNames]
+
+        stack = ROOT.THStack("prefit_stack", "")
+        for proc in reversed(procs):
+            histo = templates[proc][""]
+            histo.SetFillColor(self.colors.get(proc, ROOT.kGray))
+            histo.SetLineColor(self.colors.get(proc, ROOT.kGray))
+            histo.SetLineWidth(0)
+            stack.Add(histo, "HIST")
+
+        leg = ROOT.TLegend(0.70, 0.9-(len(procs)+2)*0.06, 0.95, 0.9)
+        leg.SetFillStyle(0)
+        leg.SetFillColor(0)
+        leg.SetLineWidth(0)
+        leg.SetTextSize(0.05)
+        if data != None:
+            data.SetLineColor(1)
+            data.SetLineWidth(3)
+            data.SetMarkerSize(1.2)
+            data.SetMarkerStyle(20)
+            data.SetMarkerColor(1)
+            leg.AddEntry(data, "Data", "ELP")
+        for proc in procs:
+            leg.AddEntry(templates[proc][""], self.names.get(proc, proc), "F")
+        leg.AddEntry(band, "Uncertainty", "F")
+
+        canvas = ROOT.TCanvas("canvas_prefit", "canvas_prefit", 600, 600)
+
+        split = 0.35
+        scale = (1.0 - 0.35) / 0.35
+
+        pMain = ROOT.TPad("pMain", "pMain", 0.0, split, 1.0, 1.0)
+        pMain.SetRightMargin(self.RightMargin)
+        pMain.SetLeftMargin(self.LeftMargin)
+        pMain.SetBottomMargin(0.00)
+        pMain.SetTopMargin(self.TopMargin)
+
+        pRatio = ROOT.TPad("pRatio", "pRatio", 0.0, 0.0, 1.0, split)
+        pRatio.SetRightMargin(self.RightMargin)
+        pRatio.SetLeftMargin(self.LeftMargin)
+        pRatio.SetTopMargin(0.00)
+        pRatio.SetBottomMargin(0.25)
+
+        pMain.Draw()
+        pRatio.Draw()
+
+        pMain.cd()
+
+        maxHeight = max([total.GetBinContent(iBin+1) + errHi[iBin] for iBin in range(total.GetNbinsX())])
+        if data != None:
+            maxHeight = max(maxHeight, data.GetMaximum() + data.GetBinError(data.GetMaximumBin()))
+
+        titleSize = 0.12
+        labelSize = 0.09
+
+        frame = total.Clone("prefit_frame")
+        frame.Reset()
+        frame.SetTitle("")
+        frame.GetYaxis().SetRangeUser(0.0, 1.25*maxHeight)
+        frame.GetYaxis().SetTitle("Events / bin")
+        frame.GetYaxis().SetTitleOffset(0.8)
+        frame.GetYaxis().SetTitleSize(titleSize / scale)
+        frame.GetYaxis().SetLabelSize(labelSize / scale)
+        frame.GetXaxis().SetTitleSize(0.0)
+        frame.GetXaxis().SetLabelSize(0.0)
+        frame.GetYaxis().SetMaxDigits(4)
+        frame.GetXaxis().SetRangeUser(100.0, 250.0)
+        frame.Draw("AXIS")
+
+        stack.Draw("SAME")
+        band.Draw("E2 SAME")
+        if data != None:
+            data.Draw("EP SAME")
+
+        leg.Draw("SAME")
+
+        self.addCMSlogo(pMain)
+
+        mark = ROOT.TLatex()
+        mark.SetNDC(True)
+
+        mark.SetTextAlign(13)
+        mark.SetTextSize(0.055)
+        mark.SetTextFont(61)
+
+        taggerName = ""
+        if tagger == "Res":
+            taggerName = "Resolved"
+        elif tagger == "Mrg":
+            taggerName = "Merged"
+
+        mark.DrawLatex(self.LeftMargin + 0.04, 0.73, taggerName + " | %s"%(category.replace("f", "F").replace("p", "P")))
+
+        mark.SetTextFont(42)
+        mark.SetTextSize(0.045)
+        if normalized:
+            mark.DrawLatex(self.LeftMargin + 0.04, 0.66, "Pre-fit, MC normalized to data")
+        else:
+            mark.DrawLatex(self.LeftMargin + 0.04, 0.66, "Unnormalized MC templates")
+
+        pMain.RedrawAxis()
+
+        pRatio.cd()
+
+        ratioFrame = total.Clone("prefit_ratio_frame")
+        ratioFrame.Reset()
+        ratioFrame.SetTitle("")
+        ratioFrame.GetYaxis().SetTitleOffset(0.4)
+        ratioFrame.GetXaxis().SetTitleOffset(0.9)
+        ratioFrame.GetYaxis().SetNdivisions(5,5,0)
+        ratioFrame.GetYaxis().SetTitleSize(titleSize)
+        ratioFrame.GetYaxis().SetLabelSize(labelSize)
+        ratioFrame.GetXaxis().SetTitleSize(titleSize)
+        ratioFrame.GetXaxis().SetLabelSize(labelSize)
+        ratioFrame.GetXaxis().SetTitle("Top Candidate Mass [GeV]")
+        ratioFrame.GetYaxis().SetTitle("Data / Pre-fit")
+        ratioFrame.GetYaxis().SetRangeUser(0.01,1.99)
+        ratioFrame.GetXaxis().SetRangeUser(100.0, 250.0)
+        ratioFrame.Draw("AXIS")
+
+        ratioBand.Draw("E2 SAME")
+
+        # The ratio only carries the uncertainty of the data, the one of the MC is the band
+        if data != None:
+            noErrors = total.Clone("prefit_total_noErrors")
+            for iBin in range(noErrors.GetNbinsX()+2):
+                noErrors.SetBinError(iBin, 0.0)
+            ratio = self.getDataMCratio(data, noErrors)
+            ratio.SetName("h_r_prefit")
+            ratio.SetMarkerColor(1)
+            ratio.SetLineColor(1)
+            ratio.Draw("P E0 SAME")
+
+        l = ROOT.TLine(100.0, 1.0, 250.0, 1.0)
+        l.SetLineWidth(2)
+        l.SetLineColor(ROOT.kBlack)
+        l.SetLineStyle(7)
+        l.Draw("SAME")
+
+        pRatio.RedrawAxis()
+
+        canvas.Print(self.outputDir + "/%s_%s_%s_%s_%s_prefit.%s"%(self.year, tagger, measurement, ptBin, category, self.fmt))
+
+        return True
+
     def getSFSummary(self, results, measurement):
       
         sfGraphs = []
@@ -620,18 +1010,96 @@ class Plotter:
 
         self.addCMSlogo(canvas, 0.08, 0.03, 0.10)
     
-        canvas.SaveAs("%s/%s_SF_%s.pdf"%(self.outputDir, self.year, measurement))
+        canvas.SaveAs("%s/%s_SF_%s.%s"%(self.outputDir, self.year, measurement, self.fmt))
 
-if __name__ == "__main__":
+# Routine that is called by each pool process in prefit mode for one inputs folder,
+# the plotter is made in the worker, such that nothing of ROOT is passed between processes
+def makePrefitPlots(year, approved, inputDir, outputDir, fmt, fitDir):
+
+    info = getFitDirInfo(fitDir)
+    if info == None:
+        return False
+
+    year, tagger, measure, ptBin = info
+
+    thePlotter = Plotter(year, approved, inputDir, outputDir, fmt=fmt)
+
+    fitPath = "%s/%s"%(os.path.realpath(inputDir), fitDir)
+    with stage("makePrefitPlot", job=fitPath):
+        return thePlotter.makePrefitPlot(fitPath, ptBin, measure, tagger, "pass") and thePlotter.makePrefitPlot(fitPath, ptBin, measure, tagger, "fail")
+
+# Prefit plots of all inputs folders of a year, made in parallel directly from the templates, e.g. right after
+# the inputs stage. Returns False if the plots of any folder could not be made
+def runPrefit(year, approved, inputDir, outputDir, fmt, workers):
+
+    fitDirs = []
+    for fitDir in sorted(os.listdir(inputDir)):
+        info = getFitDirInfo(fitDir)
+        if info == None or info[0] != year:
+            continue
+        if not os.path.exists("%s/%s/top_mass_pass.root"%(inputDir, fitDir)):
+            continue
+        fitDirs.append(fitDir)
+
+    if len(fitDirs) == 0:
+        print("No inputs folders for year %s in \"%s\""%(year, inputDir))
+        return False
+
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+
+    pool = mp.Pool(processes=max(1, min(workers, len(fitDirs))))
+    results = [pool.apply_async(makePrefitPlots, args=(year, approved, inputDir, outputDir, fmt, fitDir)) for fitDir in fitDirs]
+    pool.close()
+    pool.join()
+
+    ok = True
+    for fitDir, result in zip(fitDirs, results):
+        try:
+            if result.get():
+                continue
+            print("Could not make the prefit plots of \"%s\""%(fitDir))
+        except Exception:
+            traceback.print_exc()
+            print("Making the prefit plots of \"%s\" failed"%(fitDir))
+        ok = False
+
+    return ok
+
+# Command line options of a single set of summary plots, also used to parse the jobs of batchRunner.py
+def makeParser():
 
     usage = "usage: %makePlots [options]"
     parser = argparse.ArgumentParser(usage)
-    parser.add_argument("--year",      dest="year",      help="year to process",       required=True)
-    parser.add_argument("--inputDir",  dest="inputDir",  help="area with fit results", required=True)
-    parser.add_argument("--outputDir", dest="outputDir", help="where to put plots",    required=True)
-    parser.add_argument("--approved",  dest="approved",  help="plots approved",        default=False, action="store_true")
-    args = parser.parse_args()
+    parser.add_argument("--year",       dest="year",       help="year to process",       required=True)
+    parser.add_argument("--inputDir",   dest="inputDir",   help="area with fit results", required=True)
+    parser.add_argument("--outputDir",  dest="outputDir",  help="where to put plots",    required=True)
+    parser.add_argument("--approved",   dest="approved",   help="plots approved",        default=False, action="store_true")
+    parser.add_argument("--makeShapes", dest="makeShapes", help="rerun fits for shapes", default=False, action="store_true")
+    parser.add_argument("--useScans",   dest="useScans",   help="SFs from scans",        default=False, action="store_true")
+    parser.add_argument("--trace",      dest="trace",      help="dir for trace",         default=None)
+    parser.add_argument("--format",     dest="format",     help="pdf, png, ...",         default="pdf")
+    parser.add_argument("--prefit",     dest="prefit",     help="only prefit, no fits",  default=False, action="store_true")
+    parser.add_argument("--workers",    dest="workers",    help="prefit processes",      default=4,     type=int)
+
+    return parser
 
-    thePlotter = Plotter(args.year, args.approved, args.inputDir, args.outputDir)
+def run(args):
+
+    if args.trace != None:
+        enableTrace(args.trace)
+
+    if args.prefit:
+        return runPrefit(args.year, args.approved, args.inputDir, args.outputDir, args.format, args.workers)
+
+    thePlotter = Plotter(args.year, args.approved, args.inputDir, args.outputDir, args.makeShapes, args.useScans, args.format)
 
     thePlotter.run()
+
+    return True
+
+if __name__ == "__main__":
+
+    args = makeParser().parse_args()
+
+    run(args)
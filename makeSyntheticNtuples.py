@@ -0,0 +1,112 @@
+#! /bin/env/python
+
+import os
+import re
+import argparse
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+# Suffixes of the trees in the input files, matching the trees read in processFile
+treeStubs = ["", "JECup", "JECdown", "JERup", "JERdown"]
+
+# Names in the draw expressions that are functions and not branches
+functions = ["max", "min", "TMath", "Max", "Min", "abs", "fabs", "sqrt"]
+
+# Collect the names of all branches referenced by the selections, variables and weights of
+# the histograms made by the options file, for both measurements and taggers and all systematics
+def getBranches(importedGoods, year):
+
+    branches = set()
+    for measure in ["Eff", "Mis"]:
+        for tagger in ["Mrg", "Res"]:
+            processes, histograms, systematics = importedGoods.initHistos(year, measure, tagger, "400to480", True, True, True)
+
+            for histOps in histograms.values():
+                for key in ["selection", "variable", "yvariable", "weight"]:
+                    if key not in histOps:
+                        continue
+                    for name in re.findall(r"[A-Za-z_]\w*", histOps[key]):
+                        if name not in functions:
+                            branches.add(name)
+
+    return sorted(branches)
+
+# Input file stubs of all processes of both measurements, e.g. TT, Data_SingleMuon
+def getStubs(importedGoods, year):
+
+    stubs = set()
+    for measure in ["Eff", "Mis"]:
+        processes, histograms, systematics = importedGoods.initHistos(year, measure, "Mrg", "inclusive", False)
+        stubs.update(processes.values())
+
+    return sorted(stubs)
+
+# Expression used to generate a branch, chosen from its name such that all selections
+# are passed by a sizeable fraction of the events and all histograms are filled. Event
+# weights are zero for the given fraction of the events, e.g. to have zero denominators
+def getGenerator(branch, zeroFraction=0.0):
+
+    if   branch.startswith("pass_"):  return "(int)(gRandom->Uniform() < 0.5)"
+    elif "GenMatch" in branch:        return "(int)(gRandom->Uniform() < 0.6)"
+    elif branch.startswith("NGood"):  return "(int)gRandom->Poisson(0.8)"
+    elif "TopDisc" in branch:         return "(float)gRandom->Uniform()"
+    elif "TopMass" in branch:         return "(float)gRandom->Gaus(172.5, 40.0)"
+    elif "TopPt" in branch:           return "(float)gRandom->Exp(400.0)"
+    elif branch == "Weight":          return "(float)1.0"
+
+    # Everything else is an event weight or scale factor
+    if zeroFraction > 0.0:
+        return "(float)(gRandom->Uniform() < %g ? 0.0 : gRandom->Gaus(1.0, 0.1))"%(zeroFraction)
+
+    return "(float)gRandom->Gaus(1.0, 0.1)"
+
+# Write one file with the nominal and all systematic trees for a given process, every
+# tree has all referenced branches, such that any histogram can be drawn from any tree
+def makeNtuple(outputName, treeName, branches, nEvents, zeroFraction=0.0):
+
+    columns = ROOT.std.vector("string")()
+    for branch in branches:
+        columns.push_back(branch)
+
+    options = ROOT.RDF.RSnapshotOptions()
+    for treeStub in treeStubs:
+
+        df = ROOT.RDataFrame(nEvents)
+        for branch in branches:
+            df = df.Define(branch, getGenerator(branch, zeroFraction))
+
+        df.Snapshot(treeName + treeStub, outputName, columns, options)
+
+        # All following trees are added to the same file
+        options.fMode = "UPDATE"
+
+if __name__ == "__main__":
+    usage = "%makeSyntheticNtuples [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--outputDir",    dest="outputDir",    help="dir for ntuples",    required=True                   )
+    parser.add_argument("--year",         dest="year",         help="which year",         default="2017"                  )
+    parser.add_argument("--options",      dest="options",      help="options file",       default="makeInputsAndCards_aux")
+    parser.add_argument("--tree",         dest="tree",         help="TTree name",         default="TopTagSFSkim"          )
+    parser.add_argument("--events",       dest="events",       help="events per tree",    default=100000, type=int        )
+    parser.add_argument("--seed",         dest="seed",         help="random seed",        default=1234,   type=int        )
+    parser.add_argument("--zeroFraction", dest="zeroFraction", help="frac. zero weights", default=0.0,    type=float      )
+
+    args = parser.parse_args()
+
+    importedGoods = __import__(args.options)
+
+    # Single threaded, such that the same seed always gives the same ntuples
+    ROOT.gRandom.SetSeed(args.seed)
+
+    if not os.path.exists(args.outputDir):
+        os.makedirs(args.outputDir)
+
+    branches = getBranches(importedGoods, args.year)
+    print("Generating %d branches: %s"%(len(branches), ", ".join(branches)))
+
+    for stub in getStubs(importedGoods, args.year):
+        outputName = "%s/%s_%s.root"%(args.outputDir, args.year, stub)
+        print("Writing %d events per tree to \"%s\""%(args.events, outputName))
+        makeNtuple(outputName, args.tree, branches, args.events, args.zeroFraction)
@@ -0,0 +1,149 @@
+#! /bin/env/python
+
+import os
+import argparse
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+ROOT.TH1.SetDefaultSumw2()
+
+from makeInputsAndCards import makeOutputDir, getPtEdges, makeDatacard, makeCombineScript
+
+# Path to an existing inputs folder made by makeInputsAndCards.py for a given configuration
+def getInputsDir(inputDir, year, tagger, measure, ptBin):
+
+    ptBinStr = ""
+    if ptBin != "inclusive":
+        ptBinStr = "_topPt%s"%(ptBin)
+
+    return "%s/%s_inputs_%s_%s%s"%(inputDir, year, tagger, measure, ptBinStr)
+
+# Name of the coarser pt bin covering all of the given contiguous pt bins, e.g.
+# 400to480 + 480to600 ==> 400to600. None is returned if the bins are not contiguous
+def getMergedPtBin(ptBins):
+
+    if len(ptBins) == 1:
+        return ptBins[0]
+
+    edges = sorted([getPtEdges(ptBin) for ptBin in ptBins], key=lambda edge : edge[0])
+    for iBin in range(1, len(edges)):
+        if edges[iBin-1][1] != edges[iBin][0]:
+            return None
+
+    ptHigh = "Inf"
+    if edges[-1][1] != None:
+        ptHigh = "%g"%(edges[-1][1])
+
+    return "%gto%s"%(edges[0][0], ptHigh)
+
+# Sum the histograms with the same name across all input folders into top_mass_{pass,fail}.root
+# in the output folder. The per-bin uncertainties are added in quadrature by TH1::Add, as is correct
+# for the disjoint sets of events in different years and pt bins. Under- and overflow bins are summed too
+def mergeTemplates(sourceDirs, outputDir):
+
+    for flag in ["pass", "fail"]:
+
+        sourceFiles = []
+        for sourceDir in sourceDirs:
+            fsource = ROOT.TFile.Open("%s/top_mass_%s.root"%(sourceDir, flag), "READ")
+            if fsource == None:
+                print("Could not open input ROOT file \"%s/top_mass_%s.root\""%(sourceDir, flag))
+                return False
+            sourceFiles.append(fsource)
+
+        histNames = sorted([key.GetName() for key in sourceFiles[0].GetListOfKeys()])
+        for fsource in sourceFiles[1:]:
+            if sorted([key.GetName() for key in fsource.GetListOfKeys()]) != histNames:
+                print("Histograms in \"%s\" do not match those in \"%s\""%(fsource.GetName(), sourceFiles[0].GetName()))
+                return False
+
+        outfile = ROOT.TFile.Open("%s/top_mass_%s.root"%(outputDir, flag), "RECREATE")
+
+        for histName in histNames:
+            merged = sourceFiles[0].Get(histName).Clone(histName)
+            merged.SetDirectory(0)
+            for fsource in sourceFiles[1:]:
+                merged.Add(fsource.Get(histName))
+
+            outfile.cd()
+            merged.Write(histName, ROOT.TObject.kOverwrite)
+
+        outfile.Close()
+        for fsource in sourceFiles:
+            fsource.Close()
+
+    return True
+
+if __name__ == "__main__":
+    usage = "%mergeInputs [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--inputDir",  dest="inputDir",  help="existing inputs",    required=True                     )
+    parser.add_argument("--outputDir", dest="outputDir", help="storing combine",    default=None                      )
+    parser.add_argument("--options",   dest="options",   help="options file",       default="makeInputsAndCards_aux"  )
+    parser.add_argument("--years",     dest="years",     help="comma sep. years",   required=True                     )
+    parser.add_argument("--newYear",   dest="newYear",   help="merged year name",   default=None                      )
+    parser.add_argument("--ptBins",    dest="ptBins",    help="comma sep. pt bins", default="inclusive"               )
+    parser.add_argument("--newPtBin",  dest="newPtBin",  help="merged pt bin name", default=None                      )
+    parser.add_argument("--taggers",   dest="taggers",   help="comma sep. taggers", default="Mrg,Res"                 )
+    parser.add_argument("--measures",  dest="measures",  help="comma sep. measures",default="Eff,Mis"                 )
+    parser.add_argument("--doSysts",   dest="doSysts",   help="include systs",      default=False, action="store_true")
+    parser.add_argument("--overwrite", dest="overwrite", help="clear existing dir", default=False, action="store_true")
+
+    args = parser.parse_args()
+
+    importedGoods = __import__(args.options)
+
+    years  = args.years.split(",")
+    ptBins = args.ptBins.split(",")
+
+    # Merged folders are put next to the existing ones unless specified otherwise
+    outputDir = args.outputDir
+    if outputDir == None:
+        outputDir = args.inputDir
+
+    newYear = args.newYear
+    if newYear == None:
+        if len(years) > 1:
+            print("Must specify '--newYear' when merging several years!")
+            quit()
+        newYear = years[0]
+
+    newPtBin = args.newPtBin
+    if newPtBin == None:
+        newPtBin = getMergedPtBin(ptBins)
+        if newPtBin == None:
+            print("Pt bins %s are not contiguous and cannot be merged!"%(args.ptBins))
+            quit()
+
+    base = os.getenv("PWD")
+
+    for tagger in args.taggers.split(","):
+        for measure in args.measures.split(","):
+
+            sourceDirs = [getInputsDir(args.inputDir, year, tagger, measure, ptBin) for year in years for ptBin in ptBins]
+
+            missingDirs = [sourceDir for sourceDir in sourceDirs if not os.path.isdir(sourceDir)]
+            if len(missingDirs) > 0:
+                print("Skipping tagger:%s, measure:%s, missing inputs %s"%(tagger, measure, ", ".join(missingDirs)))
+                continue
+
+            print("Merging inputs for year:%s, tagger:%s, measure:%s, pt:%s..."%(newYear, tagger, measure, newPtBin))
+
+            mergedDir = makeOutputDir(base, outputDir, newYear, tagger, measure, newPtBin, args.overwrite)
+            if mergedDir == None:
+                continue
+
+            if not mergeTemplates(sourceDirs, mergedDir):
+                continue
+
+            # The processes and systematics only depend on the measurement and not on the year or pt bin
+            processes, histograms, systematics = importedGoods.initHistos(years[0], measure, tagger, newPtBin, args.doSysts)
+
+            makeDatacard(mergedDir, processes, systematics, measure, newYear)
+
+            ptBinStr = ""
+            if newPtBin != "inclusive":
+                ptBinStr = "_%s"%(newPtBin)
+
+            makeCombineScript(mergedDir, ",".join(processes), newYear, tagger, measure, ptBinStr)
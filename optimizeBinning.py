@@ -0,0 +1,218 @@
+#! /bin/env/python
+
+import os
+import json
+import time
+import argparse
+import subprocess
+import multiprocessing as mp
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+from makeInputsAndCards import makeOutputDir, makeTemplatesFromCube, makeDatacard, makeCombineScript
+from runLikelihoodScan import getPOI
+
+# Pt bin boundaries used by runAllFits.sh for each tagger, the default candidate
+ptBoundaries = {"Mrg" : ["400", "480", "600", "Inf"],
+                "Res" : ["0", "200", "400", "Inf"]}
+
+# Pt bins of a list of boundaries, e.g. ["400", "480", "Inf"] ==> ["400to480", "480toInf"]
+def getPtBins(boundaries):
+
+    return ["%sto%s"%(boundaries[iEdge], boundaries[iEdge+1]) for iEdge in range(len(boundaries)-1)]
+
+# Mass binnings to try: the nominal one of the tagger, explicit lists of edges separated by ";" and uniform
+# binnings of the given widths from 100 GeV, ending at or below 265 GeV as the mass is clamped to [101, 264] GeV
+def getMassCandidates(nominal, massBins, massWidths):
+
+    candidates = [[float(edge) for edge in nominal]]
+
+    if massBins != None:
+        for edges in massBins.split(";"):
+            candidates.append([float(edge) for edge in edges.split(",")])
+
+    if massWidths != None:
+        for width in massWidths.split(","):
+            candidates.append([float(edge) for edge in range(100, 266, int(width))])
+
+    unique = []
+    for candidate in candidates:
+        if candidate not in unique:
+            unique.append(candidate)
+
+    return unique
+
+# Routine that is called by each pool process for one pt bin of one candidate: the workspace is built
+# through the shared cache and the expected uncertainty of the SF is obtained from a fit to the Asimov
+# dataset at SF = 1, so that no data is looked at. Returns the exit code and the wall time of the fit
+def runAsimovFit(fitDir, categories, poi, cacheDir):
+
+    repoDir = os.path.dirname(os.path.realpath(__file__))
+
+    command = "python %s/workspaceCache.py --card sf.txt --output sf.root --options \"--PO categories=%s\" --cacheDir %s"%(repoDir, categories, cacheDir)
+    status  = subprocess.call("%s > asimov.log 2>&1"%(command), shell=True, cwd=fitDir)
+    if status != 0:
+        return status, 0.0
+
+    command  = "combine -M MultiDimFit sf.root -m 173.2 -t -1 --algo singles -P %s --floatOtherPOIs 1"%(poi)
+    command += " --robustFit=1 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH -n .asimov"
+
+    start  = time.time()
+    status = subprocess.call("%s >> asimov.log 2>&1"%(command), shell=True, cwd=fitDir)
+
+    return status, time.time() - start
+
+# Expected SF and its lower and upper uncertainty from the Asimov fit, the best fit is
+# the entry with quantileExpected = -1 and the other entries are the interval ends
+def getAsimovResult(fitDir, poi):
+
+    fres = ROOT.TFile.Open("%s/higgsCombine.asimov.MultiDimFit.mH173.2.root"%(fitDir), "READ")
+    if fres == None:
+        return None
+
+    limit = fres.Get("limit")
+    if limit == None:
+        fres.Close()
+        return None
+
+    best   = None
+    bounds = []
+    for entry in limit:
+        if abs(entry.quantileExpected + 1.0) < 1e-6:
+            best = getattr(entry, poi)
+        else:
+            bounds.append(getattr(entry, poi))
+
+    fres.Close()
+
+    if best == None or len(bounds) < 2:
+        return None
+
+    return best, best - min(bounds), max(bounds) - best
+
+# Print the candidates ranked by the largest expected SF uncertainty of any of their pt bins,
+# then by the total fit time. Candidates with a failed fit in any pt bin are listed last
+def printRanking(ranking):
+
+    print("%-6s %-40s %-28s %6s %10s %10s %10s"%("rank", "mass bins", "pt boundaries", "nPt", "max unc.", "mean unc.", "time [s]"))
+    for iCandidate in range(len(ranking)):
+        candidate = ranking[iCandidate]
+        massStr = ",".join(["%g"%(edge) for edge in candidate["massBins"]])
+        ptStr   = ",".join(candidate["ptBoundaries"])
+        if candidate["maxUnc"] == None:
+            print("%-6d %-40s %-28s %6d %10s %10s %10s"%(iCandidate+1, massStr, ptStr, len(candidate["ptBins"]), "failed", "--", "--"))
+            continue
+        print("%-6d %-40s %-28s %6d %10.4f %10.4f %10.1f"%(iCandidate+1, massStr, ptStr, len(candidate["ptBins"]), candidate["maxUnc"], candidate["meanUnc"], candidate["fitTime"]))
+
+if __name__ == "__main__":
+    usage = "%optimizeBinning [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--cubeDir",   dest="cubeDir",   help="dir with top_cube",  required=True                     )
+    parser.add_argument("--outputDir", dest="outputDir", help="storing scan",       required=True                     )
+    parser.add_argument("--year",      dest="year",      help="which year",         default="Run2UL"                  )
+    parser.add_argument("--options",   dest="options",   help="options file",       default="makeInputsAndCards_aux"  )
+    parser.add_argument("--measure",   dest="measure",   help="Eff or mis measure", required=True                     )
+    parser.add_argument("--tagger",    dest="tagger",    help="Which tagger",       required=True                     )
+    parser.add_argument("--doSysts",   dest="doSysts",   help="include systs",      default=False, action="store_true")
+    parser.add_argument("--overwrite", dest="overwrite", help="clear existing dir", default=False, action="store_true")
+    parser.add_argument("--massBins",  dest="massBins",  help="; sep. edge lists",  default=None                      )
+    parser.add_argument("--massWidths",dest="massWidths",help="uniform bin widths", default=None                      )
+    parser.add_argument("--ptBins",    dest="ptBins",    help="; sep. boundaries",  default=None                      )
+    parser.add_argument("--workers",   dest="workers",   help="parallel fits",      default=4,     type=int           )
+
+    args = parser.parse_args()
+
+    importedGoods = __import__(args.options)
+
+    processes, histograms, systematics = importedGoods.initHistos(args.year, args.measure, args.tagger, "inclusive", args.doSysts)
+
+    massCandidates = getMassCandidates(importedGoods.massBins[args.tagger], args.massBins, args.massWidths)
+
+    ptCandidates = [ptBoundaries[args.tagger]]
+    if args.ptBins != None:
+        ptCandidates = [boundaries.split(",") for boundaries in args.ptBins.split(";")]
+
+    base       = os.getenv("PWD")
+    categories = ",".join(processes)
+    poi        = getPOI(args.measure)
+    cacheDir   = "%s/%s/.workspaces"%(base, args.outputDir)
+
+    # Each mass binning gets its own output tree, e.g. BINNING/M00/2017_inputs_Mrg_Eff_topPt400to480/, with the
+    # templates summed from the cube, such that the ntuples are never read again and a candidate can be fit and
+    # plotted exactly like the nominal output of makeInputsAndCards.py. A pt bin is only made and fit once per
+    # mass binning, as its folder is shared by all candidate pt boundaries containing it
+    candidates = []
+    fitDirs    = {}
+    for iMass in range(len(massCandidates)):
+        for iPt in range(len(ptCandidates)):
+
+            candidate = {"label" : "M%02d_P%02d"%(iMass, iPt), "iMass" : iMass, "massBins" : massCandidates[iMass], "ptBoundaries" : ptCandidates[iPt],
+                         "ptBins" : getPtBins(ptCandidates[iPt]), "fitDirs" : {}}
+
+            for ptBin in candidate["ptBins"]:
+                if (iMass, ptBin) not in fitDirs:
+                    outputDir = makeOutputDir(base, "%s/M%02d"%(args.outputDir, iMass), args.year, args.tagger, args.measure, ptBin, args.overwrite)
+                    if outputDir == None:
+                        quit()
+
+                    if not makeTemplatesFromCube(args.cubeDir, outputDir, massCandidates[iMass], ptBin):
+                        print("Skipping mass binning %s and pt bin %s"%(",".join(["%g"%(edge) for edge in massCandidates[iMass]]), ptBin))
+                        fitDirs[(iMass, ptBin)] = None
+                        continue
+
+                    makeDatacard(outputDir, processes, systematics, args.measure, args.year)
+                    makeCombineScript(outputDir, categories, args.year, args.tagger, args.measure, "_%s"%(ptBin), False, "expr", cacheDir)
+
+                    fitDirs[(iMass, ptBin)] = outputDir
+
+                candidate["fitDirs"][ptBin] = fitDirs[(iMass, ptBin)]
+
+            candidates.append(candidate)
+
+    # The Asimov fits of all candidates and pt bins are independent and run in parallel
+    fitKeys = sorted([key for key in fitDirs.keys() if fitDirs[key] != None])
+    pool    = mp.Pool(processes=max(1, min(args.workers, len(fitKeys))))
+
+    statuses = {}
+    for key in fitKeys:
+        statuses[key] = pool.apply_async(runAsimovFit, args=(fitDirs[key], categories, poi, cacheDir))
+
+    pool.close()
+    pool.join()
+
+    fits = {}
+    for key in fitKeys:
+        status, fitTime = statuses[key].get()
+        if status != 0:
+            print("Asimov fit failed, see \"%s/asimov.log\""%(fitDirs[key]))
+            continue
+
+        result = getAsimovResult(fitDirs[key], poi)
+        if result == None:
+            print("No Asimov fit result found in \"%s\""%(fitDirs[key]))
+            continue
+
+        fits[key] = {"SF" : result[0], "SFLoErr" : result[1], "SFHiErr" : result[2], "fitTime" : fitTime}
+
+    # The expected uncertainty of a pt bin is the mean of its lower and upper one
+    for candidate in candidates:
+        candidate["fits"] = dict((ptBin, fits.get((candidate["iMass"], ptBin))) for ptBin in candidate["ptBins"])
+        candidate["maxUnc"]  = None
+        candidate["meanUnc"] = None
+        candidate["fitTime"] = None
+
+        if any([fit == None for fit in candidate["fits"].values()]):
+            continue
+
+        uncs = [0.5 * (fit["SFLoErr"] + fit["SFHiErr"]) for fit in candidate["fits"].values()]
+        candidate["maxUnc"]  = max(uncs)
+        candidate["meanUnc"] = sum(uncs) / len(uncs)
+        candidate["fitTime"] = sum([fit["fitTime"] for fit in candidate["fits"].values()])
+
+    ranking = sorted(candidates, key=lambda candidate : (candidate["maxUnc"] == None, candidate["maxUnc"], candidate["fitTime"]))
+
+    printRanking(ranking)
+
+    json.dump(ranking, open("%s/%s/optimizeBinning.json"%(base, args.outputDir), "w"), indent=4)
@@ -0,0 +1,382 @@
+#! /bin/env/python
+
+import os
+import sys
+import glob
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+from collections import OrderedDict as odict
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs, urlencode
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from urlparse import urlparse, parse_qs
+    from urllib import urlencode
+
+from makeSummaryPlots import Plotter, getFitDirInfo, getSFResult, hasFitShapes
+from plotSystematics import SystPlotter, ttprocs, qcdprocs, ttsysts, qcdsysts
+
+categories = ["pass", "fail"]
+
+# Processes and systematics plotted by plotSystematics.py for a measurement
+def getProcsSysts(measure):
+
+    if measure == "Eff":
+        return ttprocs, ttsysts
+    return qcdprocs, qcdsysts
+
+# Names of the systematics, e.g. JEC, from the list of Up and Down variations
+def getSystNames(systs):
+
+    return [systs[isyst].replace("_", "", 1).replace("Up", "") for isyst in range(1, len(systs), 2)]
+
+# Modification time and size of every ROOT file or json a plot is made from, a missing
+# file is recorded as well, such that the plot is redrawn once the file is produced
+def getSignature(sources):
+
+    signature = []
+    for source in sources:
+        if os.path.exists(source):
+            stat = os.stat(source)
+            signature.append([source, stat.st_mtime, stat.st_size])
+        else:
+            signature.append([source, None, None])
+
+    return signature
+
+# Rendered plots are kept in the cache folder, with an index of the signature of their sources and of their
+# size. The least recently served plots are removed once the cache exceeds maxBytes, and a plot is redrawn
+# if any of its sources changed since it was rendered. The index is saved, such that the cache survives a restart
+class PlotCache:
+
+    def __init__(self, cacheDir, maxBytes):
+
+        self.cacheDir  = os.path.realpath(cacheDir)
+        self.maxBytes  = maxBytes
+        self.indexName = "%s/index.json"%(self.cacheDir)
+        self.entries   = odict()
+
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+        if os.path.exists(self.indexName):
+            for key, entry in json.load(open(self.indexName)):
+                if os.path.exists(self.getPath(key, entry["fmt"])):
+                    self.entries[key] = entry
+
+    def getPath(self, key, fmt):
+
+        return "%s/%s.%s"%(self.cacheDir, key, fmt)
+
+    def getSize(self):
+
+        return sum([entry["size"] for entry in self.entries.values()])
+
+    def save(self):
+
+        tmpName = "%s.tmp"%(self.indexName)
+        json.dump(list(self.entries.items()), open(tmpName, "w"))
+        os.rename(tmpName, self.indexName)
+
+    def remove(self, key):
+
+        entry = self.entries.pop(key)
+        path  = self.getPath(key, entry["fmt"])
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Path of the cached plot, or None if it was never rendered or any of its sources changed
+    def get(self, key, sources):
+
+        if key not in self.entries:
+            return None
+
+        entry = self.entries[key]
+        if entry["signature"] != getSignature(sources) or not os.path.exists(self.getPath(key, entry["fmt"])):
+            self.remove(key)
+            self.save()
+            return None
+
+        # Move the plot to the end, i.e. the most recently used one
+        self.entries[key] = self.entries.pop(key)
+
+        return self.getPath(key, entry["fmt"])
+
+    # Move a rendered plot into the cache and evict the least recently used plots over the size limit,
+    # the plot just added is always kept, even if it is larger than the limit on its own
+    def put(self, key, sources, renderedName, fmt):
+
+        if key in self.entries:
+            self.remove(key)
+
+        path = self.getPath(key, fmt)
+        shutil.move(renderedName, path)
+        self.entries[key] = {"fmt" : fmt, "size" : os.path.getsize(path), "signature" : getSignature(sources)}
+
+        while self.getSize() > self.maxBytes and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
+
+        self.save()
+
+        return path
+
+# Renders single plots from the fit folders in inputDir with the plotting code of makeSummaryPlots.py
+# and plotSystematics.py, each into its own temporary folder, and serves them from the cache
+class PlotServer:
+
+    def __init__(self, inputDir, cache, fmt="png", approved=False, useScans=False):
+
+        self.inputDir = os.path.realpath(inputDir)
+        self.cache    = cache
+        self.fmt      = fmt
+        self.approved = approved
+        self.useScans = useScans
+
+    # The fit folders below inputDir with their year, tagger, measurement and pt bin
+    def getFitDirs(self):
+
+        fitDirs = odict()
+        for fitDir in sorted(os.listdir(self.inputDir)):
+            if not os.path.isdir("%s/%s"%(self.inputDir, fitDir)):
+                continue
+
+            info = getFitDirInfo(fitDir)
+            if info != None:
+                fitDirs[fitDir] = info
+
+        return fitDirs
+
+    # Files a plot is made from, these determine whether a cached plot is still valid
+    def getSources(self, params):
+
+        if params["kind"] == "sf":
+            sources = []
+            for fitDir, (year, tagger, measure, ptBin) in self.getFitDirs().items():
+                if year == params["year"] and measure == params["measure"]:
+                    fitPath = "%s/%s"%(self.inputDir, fitDir)
+                    sources += ["%s/fitDiagnosticsTest.root"%(fitPath), "%s/impacts.json"%(fitPath), "%s/scan.json"%(fitPath)]
+            return sources
+
+        fitPath = "%s/%s"%(self.inputDir, params["dir"])
+        if params["kind"] == "prepost":
+            return ["%s/top_mass_%s.root"%(fitPath, params["category"]), "%s/fitDiagnosticsTest.root"%(fitPath)]
+
+        return ["%s/top_mass_%s.root"%(fitPath, params["category"])]
+
+    # Check the parameters of a plot request, returns a description of the problem or None. Only the fit folders
+    # found in inputDir are accepted, such that no other path can be opened through the request
+    def checkParams(self, params):
+
+        kind = params.get("kind")
+        if kind not in ["prepost", "syst", "sf"]:
+            return "unknown kind of plot \"%s\""%(kind)
+
+        if kind == "sf":
+            if params.get("year") == None or params.get("measure") not in ["Eff", "Mis"]:
+                return "sf plots need the year and measure"
+            return None
+
+        fitDirs = self.getFitDirs()
+        if params.get("dir") not in fitDirs:
+            return "unknown fit folder \"%s\""%(params.get("dir"))
+        if params.get("category") not in categories:
+            return "unknown category \"%s\""%(params.get("category"))
+
+        if kind == "syst":
+            procs, systs = getProcsSysts(fitDirs[params["dir"]][2])
+            if params.get("proc") not in procs:
+                return "unknown process \"%s\""%(params.get("proc"))
+            if params.get("syst") not in getSystNames(systs):
+                return "unknown systematic \"%s\""%(params.get("syst"))
+
+        return None
+
+    def render(self, params, tmpDir):
+
+        if params["kind"] == "sf":
+            plotter = Plotter(params["year"], self.approved, self.inputDir, tmpDir, fmt=self.fmt)
+
+            results = {}
+            for fitDir, (year, tagger, measure, ptBin) in self.getFitDirs().items():
+                if year != params["year"] or measure != params["measure"]:
+                    continue
+
+                fitPath = "%s/%s"%(self.inputDir, fitDir)
+                aResult = getSFResult(fitPath, tagger, measure, ptBin, self.useScans)
+                if aResult == None:
+                    continue
+
+                results[aResult.uniqueId()] = aResult
+
+            if len(results) == 0:
+                return
+
+            # The SF histograms are also written to <year>_SF.root in the working folder, which is the temporary one here
+            cwd = os.getcwd()
+            os.chdir(tmpDir)
+            try:
+                plotter.getSFSummary(results, params["measure"])
+            finally:
+                os.chdir(cwd)
+
+            return
+
+        fitPath = "%s/%s"%(self.inputDir, params["dir"])
+        year, tagger, measure, ptBin = self.getFitDirs()[params["dir"]]
+
+        if params["kind"] == "prepost":
+            plotter = Plotter(year, self.approved, self.inputDir, tmpDir, fmt=self.fmt)
+            plotter.makePrePostFitPlot(fitPath, ptBin, measure, tagger, params["category"])
+
+        elif params["kind"] == "syst":
+            import ROOT
+
+            procs, systs = getProcsSysts(measure)
+
+            infile = ROOT.TFile.Open("%s/top_mass_%s.root"%(fitPath, params["category"]), "READONLY")
+            if infile == None:
+                return
+
+            systPlotter = SystPlotter(tmpDir, tmpDir, self.fmt)
+            systPlotter.makeSystPlot(params["dir"].replace("_inputs", ""), params["proc"], infile, systs, "_" + params["category"], onlySyst=params["syst"])
+            infile.Close()
+
+    # Path of the requested plot, rendered only if it is not in the cache or any of its sources changed.
+    # Returns None if the plot could not be made, e.g. the fit has no shapes
+    def getPlot(self, params):
+
+        key     = hashlib.sha1(json.dumps([params, self.fmt, self.approved, self.useScans], sort_keys=True).encode("utf-8")).hexdigest()
+        sources = self.getSources(params)
+
+        path = self.cache.get(key, sources)
+        if path != None:
+            return path
+
+        tmpDir = tempfile.mkdtemp(prefix="plotServer_")
+        try:
+            self.render(params, tmpDir)
+
+            rendered = glob.glob("%s/*.%s"%(tmpDir, self.fmt))
+            if len(rendered) == 0:
+                return None
+
+            return self.cache.put(key, sources, rendered[0], self.fmt)
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+    def makeLink(self, text, **params):
+
+        return "<a href=\"/plot?%s\">%s</a>"%(urlencode(sorted(params.items())), text)
+
+    # Page listing every fit folder with links to its plots, and the SF summary of every year and measurement
+    def makeIndex(self):
+
+        lines = ["<html><head><title>TopTagSF plots</title></head><body>", "<h2>%s</h2>"%(self.inputDir)]
+
+        fitDirs = self.getFitDirs()
+
+        summaries = sorted(set([(year, measure) for year, tagger, measure, ptBin in fitDirs.values()]))
+        lines.append("<h3>SF summaries</h3><ul>")
+        for year, measure in summaries:
+            lines.append("<li>%s</li>"%(self.makeLink("%s %s"%(year, measure), kind="sf", year=year, measure=measure)))
+        lines.append("</ul>")
+
+        lines.append("<h3>Fit folders</h3><table border=\"1\" cellpadding=\"4\">")
+        lines.append("<tr><th>Year</th><th>Tagger</th><th>Measure</th><th>Pt bin</th><th>Pre-/post-fit</th><th>Systematics</th></tr>")
+        for fitDir, (year, tagger, measure, ptBin) in fitDirs.items():
+            fitPath = "%s/%s"%(self.inputDir, fitDir)
+
+            prepost = "no shapes"
+            if hasFitShapes(fitPath):
+                prepost = " ".join([self.makeLink(category, kind="prepost", dir=fitDir, category=category) for category in categories])
+
+            procs, systs = getProcsSysts(measure)
+            systLinks = []
+            for category in categories:
+                if not os.path.exists("%s/top_mass_%s.root"%(fitPath, category)):
+                    continue
+                for proc in procs:
+                    links = " ".join([self.makeLink(syst, kind="syst", dir=fitDir, category=category, proc=proc, syst=syst) for syst in getSystNames(systs)])
+                    systLinks.append("%s %s: %s"%(proc, category, links))
+
+            lines.append("<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>"%(year, tagger, measure, ptBin, prepost, "<br>".join(systLinks)))
+        lines.append("</table></body></html>")
+
+        return "\n".join(lines)
+
+contentTypes = {"png" : "image/png", "pdf" : "application/pdf", "svg" : "image/svg+xml", "gif" : "image/gif"}
+
+class PlotHandler(BaseHTTPRequestHandler):
+
+    plotServer = None
+
+    def sendBody(self, body, contentType):
+
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+
+        if url.path in ["/", "/index.html"]:
+            self.sendBody(self.plotServer.makeIndex().encode("utf-8"), "text/html; charset=utf-8")
+            return
+
+        if url.path != "/plot":
+            self.send_error(404, "Unknown page")
+            return
+
+        params = dict([(name, values[0]) for name, values in parse_qs(url.query).items()])
+
+        problem = self.plotServer.checkParams(params)
+        if problem != None:
+            self.send_error(400, problem)
+            return
+
+        path = self.plotServer.getPlot(params)
+        if path == None:
+            self.send_error(404, "Could not make the plot, see the server output")
+            return
+
+        self.sendBody(open(path, "rb").read(), contentTypes.get(self.plotServer.fmt, "application/octet-stream"))
+
+if __name__ == "__main__":
+    usage = "%plotServer [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--inputDir",  dest="inputDir",  help="area with fit dirs",  required=True                     )
+    parser.add_argument("--cacheDir",  dest="cacheDir",  help="rendered plots",      default="PLOTCACHE"               )
+    parser.add_argument("--cacheMB",   dest="cacheMB",   help="max size of cache",   default=200.0, type=float         )
+    parser.add_argument("--port",      dest="port",      help="port to listen on",   default=8080,  type=int           )
+    parser.add_argument("--host",      dest="host",      help="address to bind",     default="localhost"               )
+    parser.add_argument("--format",    dest="format",    help="png, svg, ...",       default="png"                     )
+    parser.add_argument("--approved",  dest="approved",  help="plots approved",      default=False, action="store_true")
+    parser.add_argument("--useScans",  dest="useScans",  help="SFs from scans",      default=False, action="store_true")
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.inputDir):
+        print("Input folder \"%s\" does not exist!"%(args.inputDir))
+        quit()
+
+    cache = PlotCache(args.cacheDir, int(args.cacheMB * 1024 * 1024))
+
+    PlotHandler.plotServer = PlotServer(args.inputDir, cache, args.format, args.approved, args.useScans)
+
+    # Requests are handled one at a time, as ROOT and the plotting code are not thread-safe
+    server = HTTPServer((args.host, args.port), PlotHandler)
+    print("Serving plots of \"%s\" on http://%s:%d, with up to %.0f MB of cached plots in \"%s\""%(args.inputDir, args.host, args.port, args.cacheMB, cache.cacheDir))
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -8,6 +8,8 @@ ROOT.gROOT.SetBatch(True)
 ROOT.gStyle.SetOptStat(0)
 ROOT.TH1.SetDefaultSumw2()
 
+from traceStages import stage, enableTrace
+
 ttprocs  = ["TTmatch", "TTunmatch", "Other"]
 #"QCD", "Boson", "TTX", "ST"]
 qcdprocs = ["QCD", "TT", "Other"]
@@ -22,7 +24,7 @@ names = ["nominal", "JEC Up", "JEC Down", "JER Up", "JER Down", "PDF Up", "PDF D
 
 class SystPlotter:
 
-    def __init__(self, inputDir, outputDir):
+    def __init__(self, inputDir, outputDir, fmt="pdf"):
 
         self.TopMargin    = 0.06
         self.BottomMargin = 0.12
@@ -30,6 +32,7 @@ class SystPlotter:
         self.LeftMargin   = 0.16
 
         self.outputDir = outputDir
+        self.fmt       = fmt
 
         self.fitDirs = glob.glob(inputDir + "/*") 
     
@@ -57,8 +60,9 @@ class SystPlotter:
                 systs = qcdsysts
     
             for proc in procs:
-                self.makeSystPlot(newName, proc, fpass, systs, "_pass")
-                self.makeSystPlot(newName, proc, ffail, systs, "_fail")
+                with stage("makeSystPlot", job=fitDir, proc=proc):
+                    self.makeSystPlot(newName, proc, fpass, systs, "_pass")
+                    self.makeSystPlot(newName, proc, ffail, systs, "_fail")
            
     def makeCanvas(self, name, noRatio=False):
     
@@ -108,35 +112,38 @@ class SystPlotter:
         histogram.GetXaxis().SetTitleOffset(1.2);                          histogram.GetYaxis().SetTitleOffset(1.0 * scale)
         histogram.GetXaxis().SetTitle("Top Candidate Mass [GeV]");         histogram.GetYaxis().SetTitle("# Weighted Events")    
 
-    def makeSystPlot(self, nameStub, proc, file, systs, tag, normalize=False):
+    # Plot the Up and Down variations of every systematic, or only of the given one, e.g. "JEC", over the nominal
+    def makeSystPlot(self, nameStub, proc, file, systs, tag, normalize=False, onlySyst=None):
     
         dumpster = []
-        nominal = None
+
+        nominal = file.Get(proc)
+        self.prepHisto(nominal)
+        if normalize and nominal.Integral() > 0.0:
+            nominal.Scale(1.0/nominal.Integral())
+            nominal.GetYaxis().SetRangeUser(0, 0.25)
+        else:
+            nominal.GetYaxis().SetRangeUser(-0.05*nominal.GetMaximum(), nominal.GetMaximum()*1.5)
+    
+        nominal.SetLineWidth(3)
+        nominal.SetLineColor(colors[systs.index("")])
+        nominal.SetMarkerSize(0)
+        nominal.SetMarkerStyle(20)
+
         for isyst in range(1, len(systs), 2):
 
             syst = systs[isyst]
             syst2 = systs[isyst+1]
 
+            if onlySyst != None and syst.replace("Up", "") != "_" + onlySyst:
+                continue
+
             theName = proc + syst
     
             canvas = self.makeCanvas(theName.replace("Down","").replace("Up","").replace("down","").replace("up",""))
     
             canvas.cd(1)
 
-            if isyst == 1:
-                nominal = file.Get(proc)
-                self.prepHisto(nominal)
-                if normalize and nominal.Integral() > 0.0:
-                    nominal.Scale(1.0/nominal.Integral())
-                    nominal.GetYaxis().SetRangeUser(0, 0.25)
-                else:
-                    nominal.GetYaxis().SetRangeUser(-0.05*nominal.GetMaximum(), nominal.GetMaximum()*1.5)
-    
-                nominal.SetLineWidth(3)
-                nominal.SetLineColor(colors[systs.index("")])
-                nominal.SetMarkerSize(0)
-                nominal.SetMarkerStyle(20)
-
             nominal.Draw("EHIST")
         
             iamLegend = ROOT.TLegend(self.LeftMargin, 0.7, 0.96, 1.0-self.RightMargin)
@@ -178,16 +185,21 @@ class SystPlotter:
             nominal.Draw("SAME")
             iamLegend.Draw("SAME")
     
-            canvas.SaveAs("%s/%s_%s%s%s.pdf"%(self.outputDir, nameStub, proc, syst.replace("Down", "").replace("Up",""), tag))
+            canvas.SaveAs("%s/%s_%s%s%s.%s"%(self.outputDir, nameStub, proc, syst.replace("Down", "").replace("Up",""), tag, self.fmt))
 
 if __name__ == "__main__":
     usage = "%plotSystematics [options]"
     parser = argparse.ArgumentParser(usage)
     parser.add_argument("--inputDir",  dest="inputDir",  help="Path to ntuples",    required=True                     )
     parser.add_argument("--outputDir", dest="outputDir", help="storing combine",    required=True                     )
+    parser.add_argument("--trace",     dest="trace",     help="dir for trace",      default=None                      )
+    parser.add_argument("--format",    dest="format",    help="pdf, png, ...",      default="pdf"                     )
 
     args = parser.parse_args()
 
-    systPlotter = SystPlotter(args.inputDir, args.outputDir)
+    if args.trace != None:
+        enableTrace(args.trace)
+
+    systPlotter = SystPlotter(args.inputDir, args.outputDir, args.format)
     
     systPlotter.run()
@@ -0,0 +1,153 @@
+#! /bin/env/python
+
+import sys
+import json
+import time
+import threading
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+# Send a progress message from a pool worker to the monitor of the parent process,
+# nothing is done if no queue is given, e.g. when a worker function is called directly
+def reportProgress(queue, worker, **info):
+
+    if queue == None:
+        return
+
+    info["worker"] = worker
+    info["time"]   = time.time()
+    queue.put(info)
+
+def formatTime(seconds):
+
+    if seconds == None:
+        return "--:--:--"
+
+    seconds = int(seconds)
+    return "%d:%02d:%02d"%(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+# Thread running in the parent process that collects the progress messages of all pool workers
+# from a shared queue. Workers send a "start" message with the total number of entries they will
+# loop over, the number of entries done after each chunk and a "done" message when finished. Every
+# interval, a status line per worker and in total is printed, and a snapshot of the throughput is
+# appended as one JSON line to the snapshot file, e.g. to be followed with tail -f during a campaign
+class ProgressMonitor(threading.Thread):
+
+    def __init__(self, queue, snapshotName, interval=30.0, label=""):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.queue        = queue
+        self.snapshotName = snapshotName
+        self.interval     = interval
+        self.label        = label
+
+        self.workers   = {}
+        self.startTime = time.time()
+        self.lastTime  = self.startTime
+        self.lastDone  = 0
+
+        # Overwrite the status line in place on a terminal, but keep every line in a log file
+        self.inPlace = sys.stdout.isatty()
+
+    def run(self):
+
+        while True:
+            try:
+                message = self.queue.get(timeout=self.interval)
+            except Empty:
+                message = {}
+
+            # The parent puts None once all workers are finished
+            if message == None:
+                break
+
+            if "worker" in message:
+                self.update(message)
+
+            if time.time() - self.lastTime >= self.interval:
+                self.snapshot()
+
+        self.snapshot(final=True)
+
+    def update(self, message):
+
+        worker = message["worker"]
+        if worker not in self.workers:
+            self.workers[worker] = {"file" : "", "task" : "", "done" : 0, "total" : 0, "start" : message["time"], "status" : "running"}
+
+        state = self.workers[worker]
+        if "file"   in message: state["file"]   = message["file"]
+        if "task"   in message: state["task"]   = message["task"]
+        if "total"  in message: state["total"]  = message["total"]
+        if "events" in message: state["done"]  += message["events"]
+        if "status" in message: state["status"] = message["status"]
+        state["last"] = message["time"]
+
+    # Stop the monitor from the parent once the pool is joined, which writes the final snapshot
+    def stop(self):
+
+        self.queue.put(None)
+        self.join()
+
+    def snapshot(self, final=False):
+
+        now     = time.time()
+        elapsed = now - self.startTime
+        done    = sum(state["done"]  for state in self.workers.values())
+        total   = sum(state["total"] for state in self.workers.values())
+
+        # The current rate is the one since the last snapshot, the ETA uses the average rate
+        rate    = (done - self.lastDone) / max(now - self.lastTime, 1e-6)
+        avgRate = done / max(elapsed, 1e-6)
+
+        eta = None
+        if avgRate > 0.0:
+            eta = (total - done) / avgRate
+
+        workers = {}
+        for worker, state in self.workers.items():
+            workerRate = 0.0
+            if state.get("last", state["start"]) > state["start"]:
+                workerRate = state["done"] / (state["last"] - state["start"])
+            workers[worker] = {"file" : state["file"], "task" : state["task"], "done" : state["done"], "total" : state["total"], "eventsPerSec" : workerRate, "status" : state["status"]}
+
+        payload = {"time" : now, "label" : self.label, "elapsed" : elapsed, "done" : done, "total" : total, "eventsPerSec" : rate,
+                   "avgEventsPerSec" : avgRate, "eta" : eta, "final" : final, "workers" : workers}
+
+        snapshots = open(self.snapshotName, "a")
+        snapshots.write("%s\n"%(json.dumps(payload)))
+        snapshots.close()
+
+        self.printStatus(payload)
+
+        self.lastTime = now
+        self.lastDone = done
+
+    def printStatus(self, payload):
+
+        fraction = 0.0
+        if payload["total"] > 0:
+            fraction = 100.0 * payload["done"] / payload["total"]
+
+        line = "[%s] %s %.1f%% of %d entries, %.3g ev/s, ETA %s |"%(formatTime(payload["elapsed"]), self.label, fraction, payload["total"], payload["eventsPerSec"], formatTime(payload["eta"]))
+        for worker in sorted(payload["workers"].keys()):
+            state = payload["workers"][worker]
+
+            workerFraction = 0.0
+            if state["total"] > 0:
+                workerFraction = 100.0 * state["done"] / state["total"]
+
+            line += " %s:%s %.0f%% %.3g ev/s"%(worker, state["task"], workerFraction, state["eventsPerSec"])
+
+        if self.inPlace:
+            sys.stdout.write("\r%s"%(line))
+            if payload["final"]:
+                sys.stdout.write("\n")
+        else:
+            sys.stdout.write("%s\n"%(line))
+        sys.stdout.flush()
@@ -4,7 +4,7 @@ INPUTDIR=FAIL
 OUTPUTDIR=FAIL
 MAKEINPUTS=0
 RUNCOMBINE=0
-RUNIMPACTS=0
+FITLEVEL=diag
 OVERWRITE=0
 TREENAME=TopTagSFSkim
 YEARS=("2016preVFP" "2016postVFP" "2017" "2018")
@@ -12,6 +12,13 @@ TAGGERS=("Mrg" "Res")
 MEASURES=("Eff" "Mis")
 PTBINS=()
 DOSYSTS=0
+MERGEYEARS=0
+SIMULTANEOUS=0
+SHAREDPOIS=0
+WARMSTART=0
+TRACE=0
+BATCH=0
+PREFIT=0
 
 RUNTIME=`date +"%Y%m%d_%H%M%S"`
 
@@ -31,9 +38,13 @@ do
             shift 2
             ;;
         --doImpacts)
-            RUNIMPACTS=1
+            FITLEVEL=impacts
             shift
             ;;
+        --fitLevel)
+            FITLEVEL="$2"
+            shift 2
+            ;;
         --makeInputs)
             MAKEINPUTS=1
             shift
@@ -86,6 +97,34 @@ do
             OVERWRITE=1
             shift
             ;;
+        --mergeYears)
+            MERGEYEARS=1
+            shift
+            ;;
+        --simultaneous)
+            SIMULTANEOUS=1
+            shift
+            ;;
+        --sharedPOIs)
+            SHAREDPOIS=1
+            shift
+            ;;
+        --warmStart)
+            WARMSTART=1
+            shift
+            ;;
+        --trace)
+            TRACE=1
+            shift
+            ;;
+        --batch)
+            BATCH=1
+            shift
+            ;;
+        --prefit)
+            PREFIT=1
+            shift
+            ;;
         *)
             echo "Unknown option \"$1\""
             exit 1
@@ -105,11 +144,23 @@ then
     exit 1
 fi
 
+# All stages of this campaign, i.e. making inputs and every runfits.sh, trace into the same folder
+if [[ ${TRACE} == 1 ]]
+then
+    mkdir -p ${OUTPUTDIR}
+    export TOPTAGSF_TRACE=`cd ${OUTPUTDIR} && pwd`/trace_${RUNTIME}
+    echo "Tracing into ${TOPTAGSF_TRACE}, summarise with: python traceStages.py --summary ${TOPTAGSF_TRACE}"
+fi
+
 UNIQUEPTBINS=("${PTBINS[@]}")
 if [[ ${MAKEINPUTS} == 1 ]]
 then
     mkdir -p ${OUTPUTDIR}
 
+    # In batch mode, all configurations are collected into a job list that is run by a single
+    # batchRunner.py process, such that ROOT and the pool of workers are only started once
+    JOBS=()
+
     for YEAR in "${YEARS[@]}"
     do
         for TAGGER in "${TAGGERS[@]}"
@@ -144,15 +195,148 @@ then
                         OVERWRITESTR="--overwrite"
                     fi
 
-                    python makeInputsAndCards.py --inputDir ${INPUTDIR} --outputDir ${OUTPUTDIR} --tree ${TREENAME} --year ${YEAR} --measure ${MEASURE} --tagger ${TAGGER} --ptBin ${PTBIN} ${SYSTSTR} ${OVERWRITESTR} >> ${OUTPUTDIR}/makeInputsAndCards_${RUNTIME}.log 2>&1
+                    OPTIONS="--inputDir ${INPUTDIR} --outputDir ${OUTPUTDIR} --tree ${TREENAME} --year ${YEAR} --measure ${MEASURE} --tagger ${TAGGER} --ptBin ${PTBIN} ${SYSTSTR} ${OVERWRITESTR}"
+                    if [[ ${BATCH} == 1 ]]
+                    then
+                        # The options are split as on the command line and written as a JSON list, such that any path is quoted properly
+                        JOBS+=("$(python -c 'import json, sys; print(json.dumps({"stage" : "inputs", "args" : sys.argv[1:]}))' ${OPTIONS})")
+                    else
+                        python makeInputsAndCards.py ${OPTIONS} >> ${OUTPUTDIR}/makeInputsAndCards_${RUNTIME}.log 2>&1
+                    fi
                 done
             done
         done
     done
+
+    if [[ ${BATCH} == 1 ]]
+    then
+        JOBSFILE=${OUTPUTDIR}/jobs_${RUNTIME}.json
+        (IFS=, ; echo "{\"jobs\" : [${JOBS[*]}]}") > ${JOBSFILE}
+
+        echo "Running ${#JOBS[@]} jobs from ${JOBSFILE} in one batch..."
+        if ! python batchRunner.py --jobs ${JOBSFILE} >> ${OUTPUTDIR}/makeInputsAndCards_${RUNTIME}.log 2>&1
+        then
+            echo "Some jobs of ${JOBSFILE} failed, see ${OUTPUTDIR}/makeInputsAndCards_${RUNTIME}.log"
+            exit 1
+        fi
+    fi
+
+    # The combined Run2UL inputs are derived by summing the histograms of the individual years
+    if [[ ${MERGEYEARS} == 1 ]]
+    then
+        SYSTSTR=""
+        if [[ ${DOSYSTS} == 1 ]]
+        then
+            SYSTSTR="--doSysts"
+        fi
+
+        OVERWRITESTR=""
+        if [[ ${OVERWRITE} == 1 ]]
+        then
+            OVERWRITESTR="--overwrite"
+        fi
+
+        YEARSSTR=$(IFS=, ; echo "${YEARS[*]}")
+        MEASURESSTR=$(IFS=, ; echo "${MEASURES[*]}")
+        for TAGGER in "${TAGGERS[@]}"
+        do
+            if [[ ${#PTBINS[@]} -eq 0 ]]
+            then
+                if [[ ${TAGGER} == "Mrg" ]]
+                then
+                    UNIQUEPTBINS=("400to480" "480to600" "600toInf")
+                elif [[ ${TAGGER} == "Res" ]]
+                then
+                    UNIQUEPTBINS=("0to200" "200to400" "400toInf")
+                fi
+            fi
+
+            for PTBIN in "${UNIQUEPTBINS[@]}"
+            do
+                echo "Merging input histograms for years:${YEARSSTR}, tagger:${TAGGER}, pt:${PTBIN} into Run2UL..."
+                python mergeInputs.py --inputDir ${OUTPUTDIR} --years ${YEARSSTR} --newYear Run2UL --taggers ${TAGGER} --measures ${MEASURESSTR} --ptBins ${PTBIN} ${SYSTSTR} ${OVERWRITESTR} >> ${OUTPUTDIR}/makeInputsAndCards_${RUNTIME}.log 2>&1
+            done
+        done
+    fi
+fi
+
+if [[ ${MERGEYEARS} == 1 ]]
+then
+    YEARS+=("Run2UL")
 fi
 
-if [[ ${RUNCOMBINE} == 1 ]]
+# Prefit plots straight from the templates, no fits are needed, e.g. to check the inputs before running combine
+if [[ ${PREFIT} == 1 ]]
+then
+    for YEAR in "${YEARS[@]}"
+    do
+        echo "Making prefit plots for year:${YEAR}..."
+        python makeSummaryPlots.py --prefit --year ${YEAR} --inputDir ${OUTPUTDIR} --outputDir ${OUTPUTDIR}/prefit_plots >> ${OUTPUTDIR}/makeSummaryPlots_prefit_${RUNTIME}.log 2>&1
+    done
+fi
+
+# Instead of one fit per pt bin, all pt bins of a year, tagger and measure are fit at once
+# with a combined card, and the results are unpacked into the folder of each pt bin
+if [[ ${RUNCOMBINE} == 1 && ${SIMULTANEOUS} == 1 ]]
+then
+    SYSTSTR=""
+    if [[ ${DOSYSTS} == 1 ]]
+    then
+        SYSTSTR="--doSysts"
+    fi
+
+    SHAREDSTR=""
+    if [[ ${SHAREDPOIS} == 1 ]]
+    then
+        SHAREDSTR="--sharedPOIs"
+    fi
+
+    STARTDIR=`pwd`
+    for YEAR in "${YEARS[@]}"
+    do
+        for TAGGER in "${TAGGERS[@]}"
+        do
+            if [[ ${#PTBINS[@]} -eq 0 ]]
+            then
+                if [[ ${TAGGER} == "Mrg" ]]
+                then
+                    UNIQUEPTBINS=("400to480" "480to600" "600toInf")
+                elif [[ ${TAGGER} == "Res" ]]
+                then
+                    UNIQUEPTBINS=("0to200" "200to400" "400toInf")
+                fi
+            fi
+            PTBINSSTR=$(IFS=, ; echo "${UNIQUEPTBINS[*]}")
+
+            for MEASURE in "${MEASURES[@]}"
+            do
+                COMBINEDDIR=${OUTPUTDIR}/${YEAR}_combined_${TAGGER}_${MEASURE}
+
+                # The combined folder is removed when its card is regenerated, so the previous fit
+                # of the folder is copied aside first and the new fit is seeded from that copy
+                SEEDDIR=""
+                if [[ ${WARMSTART} == 1 && -f ${COMBINEDDIR}/fitDiagnosticsTest.root ]]
+                then
+                    SEEDDIR=`cd ${OUTPUTDIR} && pwd`/.seeds/${YEAR}_combined_${TAGGER}_${MEASURE}
+                    mkdir -p ${SEEDDIR}
+                    cp ${COMBINEDDIR}/fitDiagnosticsTest.root ${SEEDDIR}/
+                fi
+
+                echo "Running combined combine fit for year:${YEAR}, measure:${MEASURE}, tagger:${TAGGER}, pt:${PTBINSSTR}..."
+                python makeInputsAndCards.py --combined --outputDir ${OUTPUTDIR} --year ${YEAR} --measure ${MEASURE} --tagger ${TAGGER} --ptBin ${PTBINSSTR} ${SYSTSTR} ${SHAREDSTR} --overwrite >> ${OUTPUTDIR}/makeInputsAndCards_${RUNTIME}.log 2>&1
+
+                cd ${COMBINEDDIR}
+                ./runfits.sh ${FITLEVEL} ${SEEDDIR} >> combine.log 2>&1
+                cd ${STARTDIR}
+            done
+        done
+    done
+elif [[ ${RUNCOMBINE} == 1 ]]
 then
+    # With warm starts, each fit is seeded from the last fit of the same year, tagger and measure,
+    # i.e. the adjacent pt bin, and the first one from the previous fit of its own folder
+    declare -A LASTFITDIR
+
     STARTDIR=`pwd`
     for JOBDIR in ${OUTPUTDIR}/*
     do
@@ -184,9 +368,16 @@ then
                             continue
                             echo ${JOBDIR}
                         fi
+                        SEEDDIR=""
+                        if [[ ${WARMSTART} == 1 ]]
+                        then
+                            SEEDDIR=${LASTFITDIR["${YEAR}_${TAGGER}_${MEASURE}"]:-.}
+                        fi
+
                         cd ${JOBDIR}
                         echo "Running combine fits for ${JOBDIR}..."
-                        ./runfits.sh ${RUNIMPACTS} >> combine.log 2>&1
+                        ./runfits.sh ${FITLEVEL} ${SEEDDIR} >> combine.log 2>&1
+                        LASTFITDIR["${YEAR}_${TAGGER}_${MEASURE}"]=`pwd`
                         cd ${STARTDIR}
                     done
                 done
@@ -0,0 +1,215 @@
+#! /bin/env/python
+
+import os
+import glob
+import json
+import argparse
+import subprocess
+import multiprocessing as mp
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+from makeSummaryPlots import getFitResult
+
+# Thresholds on 2*deltaNLL for the 68% and 95% CL intervals of a single parameter
+levels = {"68" : 1.0, "95" : 3.84}
+
+# The POI that is reported for a given measurement
+def getPOI(measure):
+
+    proc = "TTmatch"
+    if measure == "Mis":
+        proc = "QCD"
+
+    return "SF_%s"%(proc)
+
+# Routine that is called by each pool process to run one range of points of the grid of a scan,
+# the output of each range is kept in its own file to be merged once all ranges are done
+def runScanPoints(fitDir, poi, scanRange, nPoints, firstPoint, lastPoint):
+
+    command  = "combine -M MultiDimFit sf.root -m 173.2 --algo grid -P %s --floatOtherPOIs 1"%(poi)
+    command += " --points %d --firstPoint %d --lastPoint %d --setParameterRanges %s=%.4f,%.4f"%(nPoints, firstPoint, lastPoint, poi, scanRange[0], scanRange[1])
+    command += " --robustFit=1 --setRobustFitStrategy 1 --stepSize 0.01 --X-rtd MINIMIZER_analytic --X-rtd FAST_VERTICAL_MORPH"
+    command += " -n .scan.POINTS.%d.%d"%(firstPoint, lastPoint)
+
+    return subprocess.call("%s > scan_%d_%d.log 2>&1"%(command, firstPoint, lastPoint), shell=True, cwd=fitDir)
+
+# Range of the POI in the workspace of a fit folder, which is lowered below 2 by --PO failScale=poly
+# such that the fail yields stay positive. The default range of the model is used without a workspace
+def getPOIRange(fitDir, poi):
+
+    fws = ROOT.TFile.Open("%s/sf.root"%(fitDir), "READ")
+    if fws == None:
+        return (0.0, 2.0)
+
+    ws  = fws.Get("w")
+    var = None
+    if ws != None:
+        var = ws.var(poi)
+
+    poiRange = (0.0, 2.0)
+    if var != None:
+        poiRange = (var.getMin(), var.getMax())
+
+    fws.Close()
+
+    return poiRange
+
+# Range of the scan, by default four times the uncertainty of the FitDiagnostics result around
+# the best fit, such that the 95% interval is contained, limited to the range of the SF in the
+# workspace, as --setParameterRanges would otherwise override it
+def getScanRange(fitDir, tagger, measure, ptBin, nSigma):
+
+    poiMin, poiMax = getPOIRange(fitDir, getPOI(measure))
+
+    result = getFitResult(fitDir, tagger, measure, ptBin)
+    if result == None:
+        return (poiMin, poiMax)
+
+    return (max(poiMin, result.SF - nSigma * result.SFLoErr), min(poiMax, result.SF + nSigma * result.SFHiErr))
+
+# Find where 2*deltaNLL crosses a given level on both sides of the minimum by linear
+# interpolation, None is returned for a side on which the scan never crosses the level
+def getInterval(points, level):
+
+    iBest = min(range(len(points)), key=lambda iPoint : points[iPoint][1])
+
+    crossings = []
+    for step in [-1, 1]:
+        crossing = None
+        iPoint = iBest
+        while 0 <= iPoint + step < len(points):
+            x0, y0 = points[iPoint]
+            x1, y1 = points[iPoint + step]
+            if y1 >= level:
+                crossing = x0 + (x1 - x0) * (level - y0) / (y1 - y0) if y1 != y0 else x1
+                break
+            iPoint += step
+        crossings.append(crossing)
+
+    return points[iBest][0], crossings[0], crossings[1]
+
+# Merge the outputs of all ranges of a scan and extract the intervals into scan.json, with the
+# 68% interval also stored as SF, SFLoErr and SFHiErr as used by makeSummaryPlots.SFresult
+def collectScan(fitDir, poi):
+
+    parts = sorted(glob.glob("%s/higgsCombine.scan.POINTS.*.MultiDimFit.mH173.2.root"%(fitDir)))
+    if len(parts) == 0:
+        print("No scan outputs found in \"%s\""%(fitDir))
+        return None
+
+    merged = "%s/higgsCombine.scan.MultiDimFit.mH173.2.root"%(fitDir)
+    if subprocess.call("hadd -f %s %s > /dev/null"%(merged, " ".join(parts)), shell=True) != 0:
+        print("Could not merge scan outputs in \"%s\""%(fitDir))
+        return None
+
+    for part in parts:
+        os.remove(part)
+
+    fscan = ROOT.TFile.Open(merged, "READ")
+    if fscan == None:
+        return None
+
+    limit = fscan.Get("limit")
+    if limit == None:
+        fscan.Close()
+        return None
+
+    # Every range repeats the best fit as its first entry, so only keep unique values
+    values = {}
+    for entry in limit:
+        values[round(getattr(entry, poi), 6)] = entry.deltaNLL
+    fscan.Close()
+
+    minNLL = min(values.values())
+    points = [(x, 2.0 * (values[x] - minNLL)) for x in sorted(values.keys())]
+
+    payload = {"poi" : poi, "points" : points}
+    for name, level in levels.items():
+        best, low, high = getInterval(points, level)
+        payload["best"] = best
+        payload["lo%s"%(name)] = low
+        payload["hi%s"%(name)] = high
+        if low == None or high == None:
+            print("The %s%% interval of %s in \"%s\" is not contained in the scan range"%(name, poi, fitDir))
+
+    payload["SF"] = payload["best"]
+    payload["SFLoErr"] = None
+    payload["SFHiErr"] = None
+    if payload["lo68"] != None:
+        payload["SFLoErr"] = payload["best"] - payload["lo68"]
+    if payload["hi68"] != None:
+        payload["SFHiErr"] = payload["hi68"] - payload["best"]
+
+    json.dump(payload, open("%s/scan.json"%(fitDir), "w"), indent=4)
+
+    return payload
+
+if __name__ == "__main__":
+    usage = "%runLikelihoodScan [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--inputDir",  dest="inputDir",  help="area with fit dirs",  required=True          )
+    parser.add_argument("--year",      dest="year",      help="year to process",     required=True          )
+    parser.add_argument("--taggers",   dest="taggers",   help="comma sep. taggers",  default="Mrg,Res"      )
+    parser.add_argument("--measures",  dest="measures",  help="comma sep. measures", default="Eff,Mis"      )
+    parser.add_argument("--points",    dest="points",    help="grid points",         default=100, type=int  )
+    parser.add_argument("--chunk",     dest="chunk",     help="points per job",      default=5,   type=int  )
+    parser.add_argument("--nSigma",    dest="nSigma",    help="range in Hesse errs", default=4.0, type=float)
+    parser.add_argument("--workers",   dest="workers",   help="parallel jobs",       default=mp.cpu_count(), type=int)
+
+    args = parser.parse_args()
+
+    taggers  = args.taggers.split(",")
+    measures = args.measures.split(",")
+
+    # Folders are selected as in makeSummaryPlots.py, and need the workspace made by runfits.sh
+    scans = []
+    for fitDir in sorted(os.listdir(args.inputDir)):
+
+        chunks = fitDir.split("_")
+        if len(chunks) < 4 or chunks[0] != args.year or "topPt" not in chunks[-1]:
+            continue
+
+        tagger  = chunks[2]
+        measure = chunks[3]
+        if tagger not in taggers or measure not in measures:
+            continue
+
+        fitPath = os.path.realpath("%s/%s"%(args.inputDir, fitDir))
+        if not os.path.exists("%s/sf.root"%(fitPath)):
+            print("No workspace in \"%s\", run runfits.sh first"%(fitPath))
+            continue
+
+        ptBin = chunks[-1].split("topPt")[-1]
+        scans.append((fitPath, getPOI(measure), getScanRange(fitPath, tagger, measure, ptBin, args.nSigma)))
+
+    # The ranges of points of all folders are run in a single pool, such that
+    # all cores are busy until the very last range of the very last scan
+    pool = mp.Pool(processes=max(1, args.workers))
+
+    statuses = []
+    for fitPath, poi, scanRange in scans:
+        for firstPoint in range(0, args.points, args.chunk):
+            lastPoint = min(firstPoint + args.chunk, args.points) - 1
+            statuses.append((fitPath, firstPoint, pool.apply_async(runScanPoints, args=(fitPath, poi, scanRange, args.points, firstPoint, lastPoint))))
+
+    pool.close()
+    pool.join()
+
+    failed = set()
+    for fitPath, firstPoint, status in statuses:
+        if status.get() != 0:
+            print("Scan points starting at %d failed in \"%s\""%(firstPoint, fitPath))
+            failed.add(fitPath)
+
+    for fitPath, poi, scanRange in scans:
+        if fitPath in failed:
+            continue
+
+        payload = collectScan(fitPath, poi)
+        if payload == None:
+            continue
+
+        print("%s: %s = %.4f, 68%% [%s, %s], 95%% [%s, %s]"%(os.path.basename(fitPath), poi, payload["best"], payload["lo68"], payload["hi68"], payload["lo95"], payload["hi95"]))
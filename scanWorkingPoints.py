@@ -0,0 +1,151 @@
+#! /bin/env/python
+
+import os
+import array
+import argparse
+import subprocess
+import multiprocessing as mp
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+ROOT.gStyle.SetOptStat(0)
+
+from makeInputsAndCards import makeOutputDir, makeTemplatesFromScan, makeDatacard, makeCombineScript
+from makeSummaryPlots import getFitResult
+
+# Label used for folders and file names for a given working point, e.g. 0.950 ==> WP0p950
+def getWPLabel(WP):
+
+    return ("WP%.3f"%(WP)).replace(".", "p")
+
+# Routine that is called by each pool process to run the fits prepared in
+# one of the working point folders, only the SF is needed so no shapes are saved
+def runFits(fitDir):
+
+    return subprocess.call("./runfits.sh poi >> combine.log 2>&1", shell=True, cwd=fitDir)
+
+# Draw the SF as a function of the working point and store the numbers in a
+# ROOT file and a text file next to the pdf, results is a list of (WP, SFresult)
+def makeSFvsWPPlot(results, outputName, tagger, measure):
+
+    xval      = array.array('d', [WP for WP, result in results])
+    xvalerr   = array.array('d', [0.0 for WP, result in results])
+    yval      = array.array('d', [result.SF for WP, result in results])
+    yvalerrlo = array.array('d', [result.SFLoErr for WP, result in results])
+    yvalerrhi = array.array('d', [result.SFHiErr for WP, result in results])
+
+    sfGraph = ROOT.TGraphAsymmErrors(len(results), xval, yval, xvalerr, xvalerr, yvalerrlo, yvalerrhi)
+    sfGraph.SetName("SF_vs_WP")
+    sfGraph.SetTitle("")
+    sfGraph.SetMarkerStyle(8)
+    sfGraph.SetMarkerSize(1)
+    sfGraph.SetLineWidth(2)
+    sfGraph.GetXaxis().SetTitle("%s top tagger working point"%(tagger.replace("Res", "Resolved").replace("Mrg", "Merged")))
+    sfGraph.GetYaxis().SetTitle("#epsilon_{  Data} / #epsilon_{  MC}")
+    sfGraph.GetYaxis().SetRangeUser(0.2, 2.4)
+
+    canvas = ROOT.TCanvas("c_sf_vs_wp", "c_sf_vs_wp", 700, 500)
+    canvas.SetLeftMargin(0.10)
+    canvas.SetBottomMargin(0.14)
+    canvas.SetTopMargin(0.08)
+    canvas.SetRightMargin(0.03)
+
+    sfGraph.Draw("AEP")
+
+    canvas.SaveAs("%s.pdf"%(outputName))
+
+    sfFile = ROOT.TFile.Open("%s.root"%(outputName), "RECREATE")
+    sfGraph.Write()
+    sfFile.Close()
+
+    summary = open("%s.txt"%(outputName), "w")
+    summary.write("%s %s\n"%(tagger, measure))
+    for WP, result in results:
+        summary.write("%.3f  %.4f  +%.4f  -%.4f\n"%(WP, result.SF, result.SFHiErr, result.SFLoErr))
+    summary.close()
+
+if __name__ == "__main__":
+    usage = "%scanWorkingPoints [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--inputDir",  dest="inputDir",  help="dir with top_disc",  required=True                     )
+    parser.add_argument("--outputDir", dest="outputDir", help="storing scan",       required=True                     )
+    parser.add_argument("--year",      dest="year",      help="which year",         default="Run2UL"                  )
+    parser.add_argument("--options",   dest="options",   help="options file",       default="makeInputsAndCards_aux"  )
+    parser.add_argument("--measure",   dest="measure",   help="Eff or mis measure", required=True                     )
+    parser.add_argument("--tagger",    dest="tagger",    help="Which tagger",       required=True                     )
+    parser.add_argument("--ptBin",     dest="ptBin",     help="top pt bin",         default="inclusive"               )
+    parser.add_argument("--doSysts",   dest="doSysts",   help="include systs",      default=False, action="store_true")
+    parser.add_argument("--overwrite", dest="overwrite", help="clear existing dir", default=False, action="store_true")
+    parser.add_argument("--WPs",       dest="WPs",       help="comma sep. WPs",     required=True                     )
+    parser.add_argument("--massBins",  dest="massBins",  help="mass bin edges",     default=None                      )
+    parser.add_argument("--runFits",   dest="runFits",   help="run combine fits",   default=False, action="store_true")
+    parser.add_argument("--workers",   dest="workers",   help="parallel fits",      default=4,     type=int           )
+
+    args = parser.parse_args()
+
+    importedGoods = __import__(args.options)
+
+    processes, histograms, systematics = importedGoods.initHistos(args.year, args.measure, args.tagger, args.ptBin, args.doSysts)
+
+    massBins = importedGoods.massBins[args.tagger]
+    if args.massBins != None:
+        massBins = [float(edge) for edge in args.massBins.split(",")]
+
+    WPs = sorted([float(WP) for WP in args.WPs.split(",")])
+
+    base = os.getenv("PWD")
+
+    ptBinStr = ""
+    if args.ptBin != "inclusive":
+        ptBinStr = "_%s"%(args.ptBin)
+
+    # Each working point gets its own output tree, e.g. SCAN/WP0p950/2017_inputs_Mrg_Eff_topPt400to480/,
+    # such that it can be fit and plotted exactly like the nominal output of makeInputsAndCards.py
+    fitDirs = {}
+    for WP in WPs:
+
+        outputDir = makeOutputDir(base, "%s/%s"%(args.outputDir, getWPLabel(WP)), args.year, args.tagger, args.measure, args.ptBin, args.overwrite)
+        if outputDir == None:
+            quit()
+
+        if not makeTemplatesFromScan(args.inputDir, outputDir, massBins, WP):
+            quit()
+
+        makeDatacard(outputDir, processes, systematics, args.measure, args.year)
+        makeCombineScript(outputDir, ",".join(processes), args.year, args.tagger, args.measure, ptBinStr)
+
+        fitDirs[WP] = outputDir
+
+    if not args.runFits:
+        quit()
+
+    # The fits for the different working points are independent and run in parallel
+    pool = mp.Pool(processes=max(1, min(args.workers, len(WPs))))
+
+    statuses = {}
+    for WP in WPs:
+        statuses[WP] = pool.apply_async(runFits, args=(fitDirs[WP],))
+
+    pool.close()
+    pool.join()
+
+    results = []
+    for WP in WPs:
+        if statuses[WP].get() != 0:
+            print("Fits for working point %.3f failed, see \"%s/combine.log\""%(WP, fitDirs[WP]))
+            continue
+
+        result = getFitResult(fitDirs[WP], args.tagger, args.measure, getWPLabel(WP))
+        if result == None:
+            print("No fit result found for working point %.3f"%(WP))
+            continue
+
+        results.append((WP, result))
+
+    if len(results) == 0:
+        print("No working point could be fit successfully!")
+        quit()
+
+    outputName = "%s/%s/%s_%s_%s%s_SFvsWP"%(base, args.outputDir, args.year, args.tagger, args.measure, ptBinStr.replace("_", "_topPt"))
+    makeSFvsWPPlot(results, outputName, args.tagger, args.measure)
@@ -0,0 +1,175 @@
+#! /bin/env/python
+
+import os
+import sys
+import argparse
+
+from executors import makeTask, writeTask, getSpecNames, gatherTasks, getExecutor, executors, repoDir
+
+# Quote options for the shell command of a task
+def quote(options):
+
+    return " ".join(["'%s'"%(option.replace("'", "'\\''")) for option in options])
+
+# One task per configuration and process of the input jobs, i.e. per input file, each drawing into the
+# prepared output folder. Once all processes of a configuration are drawn, they are merged and the data
+# card and combine script are written by the gather command, i.e. makeInputsAndCards.py --mergeOnly
+def getInputsTasks(jobs):
+
+    import makeInputsAndCards
+
+    base = os.getenv("PWD")
+
+    tasks = []
+    for stageName, options in jobs:
+        if stageName != "inputs":
+            continue
+
+        args = makeInputsAndCards.makeParser().parse_args(options)
+        if args.cube or args.wpScan or args.cutflow or args.profile or args.combined or args.fromCube != None:
+            print("Only plain input jobs can be split into tasks, skipping: %s"%(" ".join(options)))
+            continue
+
+        importedGoods = __import__(args.options)
+        processes, histograms, systematics = importedGoods.initHistos(args.year, args.measure, args.tagger, args.ptBin, args.doSysts)
+
+        outputDir = makeInputsAndCards.makeOutputDir(base, args.outputDir, args.year, args.tagger, args.measure, args.ptBin, args.overwrite)
+        if outputDir == None:
+            continue
+        outputDir = outputDir.rstrip("/")
+
+        command = "python %s/makeInputsAndCards.py %s"%(repoDir, quote(options))
+        jobName = os.path.basename(outputDir)
+
+        for proc, stub in processes.items():
+
+            # Each tree of the process is a task of makeInputsAndCards.py with its own output files in the tasks folder,
+            # including the bootstrap replicas of the MC templates filled from that tree
+            nBoot = args.bootstrap
+            if "Data" in stub:
+                nBoot = 0
+
+            outputs  = {}
+            tasksDir = makeInputsAndCards.getTasksDir(outputDir)
+            for treeSyst, group in makeInputsAndCards.getTreeGroups(proc, histograms).items():
+                taskName = makeInputsAndCards.getTaskName(proc, treeSyst)
+                for nameToPass, histOps, output in group:
+                    outputs.setdefault(makeInputsAndCards.getTaskOutput(tasksDir, taskName, output), []).append(nameToPass)
+                for iHist in makeInputsAndCards.getBootHists(group, nBoot):
+                    nameToPass, histOps, output = group[iHist]
+                    outputs.setdefault(makeInputsAndCards.getTaskOutput(tasksDir, taskName, makeInputsAndCards.getBootOutput(output)), []).append(nameToPass)
+
+            gatherOutputs = {"%s/sf.txt"%(outputDir) : [], "%s/runfits.sh"%(outputDir) : []}
+            for output in makeInputsAndCards.getOutputs(histograms):
+                gatherOutputs["%s/%s.root"%(outputDir, output)] = []
+
+            tasks.append(makeTask("inputs_%s_%s"%(jobName, proc), "%s --procs %s --workers 1 --progress 0"%(command, proc), base, outputs,
+                                  outputDir, "%s --mergeOnly --progress 0"%(command), gatherOutputs))
+
+    return tasks
+
+# One task per fit folder below the input folder, i.e. each folder with a runfits.sh, running it at the given fit level
+def getFitsTasks(inputDir, fitLevel):
+
+    tasks = []
+    for fitDir in sorted(os.listdir(inputDir)):
+        fitPath = os.path.realpath("%s/%s"%(inputDir, fitDir))
+        if not os.path.exists("%s/runfits.sh"%(fitPath)):
+            continue
+
+        tasks.append(makeTask("fits_%s"%(fitDir), "./runfits.sh %s > combine.log 2>&1"%(fitLevel), fitPath, {"fitDiagnosticsTest.root" : ["fit_s"]}))
+
+    return tasks
+
+if __name__ == "__main__":
+    usage = "%submitJobs [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--stage",     dest="stage",     help="inputs or fits",     required=True                     )
+    parser.add_argument("--executor",  dest="executor",  help="local or condor",    default="local"                   )
+    parser.add_argument("--taskDir",   dest="taskDir",   help="dir for task specs", default="TASKS"                   )
+    parser.add_argument("--workers",   dest="workers",   help="local processes",    default=4,     type=int           )
+    parser.add_argument("--jobs",      dest="jobs",      help="inputs job list",    default=None                      )
+    parser.add_argument("--inputDir",  dest="inputDir",  help="area with fit dirs", default=None                      )
+    parser.add_argument("--fitLevel",  dest="fitLevel",  help="poi, diag, impacts", default="diag"                    )
+    parser.add_argument("--noSubmit",  dest="noSubmit",  help="only write tasks",   default=False, action="store_true")
+    parser.add_argument("--gather",    dest="gather",    help="only gather tasks",  default=False, action="store_true")
+
+    args = parser.parse_args()
+
+    if args.executor not in executors:
+        print("Unknown executor \"%s\", use one of %s"%(args.executor, ",".join(sorted(executors.keys()))))
+        exit(2)
+
+    taskDir = "%s/%s"%(args.taskDir, args.stage)
+
+    # Tasks that were submitted earlier, e.g. to condor, are only validated and gathered
+    if args.gather:
+        specNames = getSpecNames(taskDir)
+        if len(specNames) == 0:
+            print("No tasks in \"%s\""%(taskDir))
+            exit(2)
+
+    else:
+        if args.stage == "inputs":
+            if args.jobs == None:
+                print("Must specify '--jobs' with the input configurations, as for batchRunner.py!")
+                exit(2)
+
+            from batchRunner import getJobs
+
+            jobs = getJobs(args.jobs)
+            if jobs == None:
+                exit(2)
+
+            tasks = getInputsTasks(jobs)
+
+        elif args.stage == "fits":
+            if args.inputDir == None:
+                print("Must specify '--inputDir' with the fit folders!")
+                exit(2)
+
+            tasks = getFitsTasks(args.inputDir, args.fitLevel)
+
+        else:
+            print("Unknown stage \"%s\", use inputs or fits"%(args.stage))
+            exit(2)
+
+        if len(tasks) == 0:
+            print("No tasks to run")
+            exit(2)
+
+        if not os.path.exists(taskDir):
+            os.makedirs(taskDir)
+
+        # Specs, status files and logs of an earlier submission into the same folder are replaced
+        for name in os.listdir(taskDir):
+            if name.endswith(".json") or name.endswith(".status") or name.endswith(".log"):
+                os.remove("%s/%s"%(taskDir, name))
+
+        specNames = [writeTask(taskDir, task) for task in tasks]
+
+        executor = getExecutor(args.executor, taskDir, args.workers)
+        if args.executor == "condor" and args.noSubmit:
+            executor.doSubmit = False
+
+        print("Submitting %d tasks with the %s executor"%(len(specNames), args.executor))
+        sys.stdout.flush()
+
+        if not executor.submit(specNames):
+            exit(1)
+
+        executor.wait()
+
+        # Without submitting, the tasks are gathered later with '--gather'
+        if args.executor == "condor" and args.noSubmit:
+            quit()
+
+    problems = gatherTasks(specNames)
+
+    if len(problems) > 0:
+        for name, problem in problems:
+            print("%-60s %s"%(name, problem))
+        print("%d problems in %d tasks"%(len(problems), len(specNames)))
+        exit(1)
+
+    print("All %d tasks succeeded and were gathered"%(len(specNames)))
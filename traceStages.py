@@ -0,0 +1,169 @@
+#! /bin/env/python
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import subprocess
+import contextlib
+
+# Tracing is enabled by pointing this environment variable to a folder, such that
+# pool workers, runfits.sh and any other child process trace into the same folder
+traceVar = "TOPTAGSF_TRACE"
+
+def getTraceDir():
+
+    return os.environ.get(traceVar)
+
+# Enable tracing for this process and all of its children
+def enableTrace(traceDir):
+
+    traceDir = os.path.realpath(traceDir)
+    if not os.path.exists(traceDir):
+        try:
+            os.makedirs(traceDir)
+        except OSError:
+            if not os.path.isdir(traceDir):
+                raise
+
+    os.environ[traceVar] = traceDir
+
+# Total bytes read by all ROOT files of this process, None if ROOT is not used here
+def getBytesRead():
+
+    ROOT = sys.modules.get("ROOT")
+    if ROOT == None:
+        return None
+
+    return ROOT.TFile.GetFileBytesRead()
+
+# Peak resident memory in MB of this process, or of its largest waited for child process
+def getPeakRSS(who=resource.RUSAGE_SELF):
+
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+# Append one complete event in the Chrome trace format to the part file of this process,
+# each process writes its own part file such that no locking is needed between workers
+def writeEvent(name, start, end, args):
+
+    traceDir = getTraceDir()
+    if traceDir == None:
+        return
+
+    # The folder may not exist yet if tracing was enabled from the environment
+    if not os.path.isdir(traceDir):
+        enableTrace(traceDir)
+
+    args["cwd"] = os.getcwd()
+
+    event = {"name" : name, "ph" : "X", "ts" : start * 1e6, "dur" : (end - start) * 1e6, "pid" : os.getpid(), "tid" : 0, "args" : args}
+
+    part = open("%s/trace_%s_%d.jsonl"%(traceDir, socket.gethostname(), os.getpid()), "a")
+    part.write("%s\n"%(json.dumps(event)))
+    part.close()
+
+# Time a stage of the pipeline together with the bytes read from ROOT files and the peak memory,
+# e.g. with stage("tree.Draw", hist="TTmatch"): ... Nothing is done if tracing is not enabled
+@contextlib.contextmanager
+def stage(name, **args):
+
+    if getTraceDir() == None:
+        yield
+        return
+
+    start     = time.time()
+    bytesRead = getBytesRead()
+    try:
+        yield
+    finally:
+        end = time.time()
+        args["peakRSS"] = getPeakRSS()
+        if bytesRead != None:
+            args["bytesRead"] = getBytesRead() - bytesRead
+        writeEvent(name, start, end, args)
+
+# Run an external command as a traced stage, used by runfits.sh for combine and friends.
+# The peak memory is the one of the largest process started by the command
+def runCommand(name, command):
+
+    start  = time.time()
+    status = subprocess.call(command)
+    end    = time.time()
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    writeEvent(name, start, end, {"command" : " ".join(command), "status" : status, "peakRSS" : usage.ru_maxrss / 1024.0, "blocksRead" : usage.ru_inblock})
+
+    return status
+
+# Collect the events of all part files below the given folders, merge the parts of every
+# trace folder into a single trace.json to be opened in chrome://tracing or Perfetto
+def collectTraces(dirs):
+
+    events = []
+    for topDir in dirs:
+        for path, subDirs, files in os.walk(topDir):
+
+            parts = sorted([name for name in files if name.startswith("trace_") and name.endswith(".jsonl")])
+            if len(parts) == 0:
+                continue
+
+            traceEvents = []
+            for part in parts:
+                for line in open("%s/%s"%(path, part)):
+                    if line.strip() != "":
+                        traceEvents.append(json.loads(line))
+
+            json.dump({"traceEvents" : traceEvents, "displayTimeUnit" : "ms"}, open("%s/trace.json"%(path), "w"))
+
+            events += traceEvents
+
+    return events
+
+# Print the number of calls, total, mean and maximum time, bytes read and peak memory of every stage,
+# optionally split by job folder (the one given to the stage, or the working directory) to find the slow ones
+def printSummary(events, byJob):
+
+    stats = {}
+    for event in events:
+        key = event["name"]
+        if byJob:
+            job = event["args"].get("job", event["args"].get("cwd", ""))
+            key = "%s  %s"%(os.path.basename(job.rstrip("/")), event["name"])
+
+        if key not in stats:
+            stats[key] = {"calls" : 0, "total" : 0.0, "max" : 0.0, "bytesRead" : 0, "peakRSS" : 0.0}
+
+        duration = event["dur"] / 1e6
+        stats[key]["calls"]     += 1
+        stats[key]["total"]     += duration
+        stats[key]["max"]        = max(stats[key]["max"], duration)
+        stats[key]["bytesRead"] += event["args"].get("bytesRead", 0)
+        stats[key]["peakRSS"]    = max(stats[key]["peakRSS"], event["args"].get("peakRSS", 0.0))
+
+    print("%-60s %7s %10s %10s %10s %10s %10s"%("stage", "calls", "total [s]", "mean [s]", "max [s]", "read [MB]", "RSS [MB]"))
+    for key in sorted(stats.keys(), key=lambda key : -stats[key]["total"]):
+        stat = stats[key]
+        print("%-60s %7d %10.2f %10.3f %10.2f %10.1f %10.0f"%(key, stat["calls"], stat["total"], stat["total"] / stat["calls"], stat["max"], stat["bytesRead"] / 1024.0**2, stat["peakRSS"]))
+
+if __name__ == "__main__":
+    usage = "%traceStages [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--run",     dest="run",     help="stage name of command", default=None                      )
+    parser.add_argument("--summary", dest="summary", help="comma sep. trace dirs", default=None                      )
+    parser.add_argument("--byJob",   dest="byJob",   help="split by job folder",   default=False, action="store_true")
+    parser.add_argument("command",   nargs=argparse.REMAINDER                                                          )
+
+    args = parser.parse_args()
+
+    if args.summary != None:
+        printSummary(collectTraces(args.summary.split(",")), args.byJob)
+        quit()
+
+    if args.run == None or len(args.command) == 0:
+        print("Must specify '--run <stage> <command>' or '--summary <dirs>'!")
+        exit(2)
+
+    exit(runCommand(args.run, args.command))
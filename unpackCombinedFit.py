@@ -0,0 +1,101 @@
+#! /bin/env/python
+
+import os
+import json
+import array
+import argparse
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+# Copy the shapes of the pass_<channel> and fail_<channel> folders of a combined
+# FitDiagnostics output into pass and fail folders as in a single pt bin fit
+def copyShapes(fcombined, fout, channel):
+
+    for folder in ["shapes_prefit", "shapes_fit_s", "shapes_fit_b"]:
+
+        for flag in ["pass", "fail"]:
+
+            source = fcombined.Get("%s/%s_%s"%(folder, flag, channel))
+            if source == None:
+                continue
+
+            target = fout.GetDirectory(folder)
+            if target == None:
+                target = fout.mkdir(folder)
+            target = target.mkdir(flag)
+
+            for key in source.GetListOfKeys():
+                target.cd()
+                key.ReadObj().Write(key.GetName())
+
+# Write the fit result of one channel as the tree_fit_sb of a single pt bin fit, i.e. SF_<proc>
+# and its uncertainties taken from SF_<proc>_<channel> of the combined fit, or from SF_<proc>
+# if the fit was made with --PO sharedPOIs, i.e. one SF per process for all channels
+def copyFitResult(fcombined, fout, channel, processes):
+
+    ctree = fcombined.Get("tree_fit_sb")
+    if ctree == None:
+        return
+
+    ctree.GetEntry(0)
+
+    fout.cd()
+    tree = ROOT.TTree("tree_fit_sb", "tree_fit_sb")
+
+    buffers = {}
+    for proc in processes:
+        poi = "SF_%s_%s"%(proc, channel)
+        if ctree.GetBranch(poi) == None:
+            poi = "SF_%s"%(proc)
+        for suffix in ["", "Err", "LoErr", "HiErr"]:
+            name = "SF_%s%s"%(proc, suffix)
+            buffers[name] = array.array('d', [getattr(ctree, "%s%s"%(poi, suffix))])
+            tree.Branch(name, buffers[name], "%s/D"%(name))
+
+    buffers["fit_status"] = array.array('i', [int(ctree.fit_status)])
+    tree.Branch("fit_status", buffers["fit_status"], "fit_status/I")
+
+    tree.Fill()
+    tree.Write()
+
+# Unpack the result of a combined fit of many pt bins (and years) into a fitDiagnosticsTest.root in
+# the inputs folder of each channel, laid out as if that pt bin had been fit on its own, such
+# that plotting and summary scripts can be run on the inputs folders as usual
+def unpackCombinedFit(combinedDir):
+
+    manifest = json.load(open("%s/channels.json"%(combinedDir)))
+
+    fcombined = ROOT.TFile.Open("%s/fitDiagnosticsTest.root"%(combinedDir), "READ")
+    if fcombined == None:
+        print("Could not open combined fit result in \"%s\""%(combinedDir))
+        return False
+
+    for channel in manifest["channels"]:
+
+        print("Unpacking fit results for channel \"%s\" into \"%s\""%(channel["name"], channel["dir"]))
+
+        fout = ROOT.TFile.Open("%s/fitDiagnosticsTest.root"%(channel["dir"]), "RECREATE")
+
+        copyShapes(fcombined, fout, channel["name"])
+        copyFitResult(fcombined, fout, channel["name"], manifest["processes"])
+
+        fout.Close()
+
+        # The marker tells that this fit result comes from the combined fit, such that it is not replaced by a separate fit
+        json.dump({"combinedDir" : os.path.realpath(combinedDir), "channel" : channel["name"]}, open("%s/unpacked.json"%(channel["dir"]), "w"), indent=4)
+
+    fcombined.Close()
+
+    return True
+
+if __name__ == "__main__":
+    usage = "%unpackCombinedFit [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--combinedDir", dest="combinedDir", help="combined fit dir", required=True)
+
+    args = parser.parse_args()
+
+    if not unpackCombinedFit(args.combinedDir):
+        exit(1)
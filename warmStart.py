@@ -0,0 +1,159 @@
+#! /bin/env/python
+
+import os
+import re
+import json
+import argparse
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+
+# Read the best-fit values of the signal+background fit of the FitDiagnostics output in seedDir,
+# keeping only the parameters that exist in the workspace to be fit, and clipped to their range
+def getSeed(seedDir, workspace):
+
+    fdiag = ROOT.TFile.Open("%s/fitDiagnosticsTest.root"%(seedDir), "READ")
+    if fdiag == None:
+        print("No fit result in \"%s\" to seed from"%(seedDir))
+        return {}
+
+    fitResult = fdiag.Get("fit_s")
+    if fitResult == None or fitResult.status() != 0:
+        print("No converged fit result in \"%s\" to seed from"%(seedDir))
+        fdiag.Close()
+        return {}
+
+    fws = ROOT.TFile.Open(workspace, "READ")
+    if fws == None:
+        print("Could not open workspace \"%s\""%(workspace))
+        fdiag.Close()
+        return {}
+
+    ws = fws.Get("w")
+
+    seed = {}
+    pars = fitResult.floatParsFinal()
+    for iPar in range(pars.getSize()):
+        name = pars.at(iPar).GetName()
+        var  = ws.var(name)
+        if var == None or var.isConstant():
+            continue
+
+        seed[name] = min(max(pars.at(iPar).getVal(), var.getMin()), var.getMax())
+
+    fws.Close()
+    fdiag.Close()
+
+    return seed
+
+# Write the seed as the --setParameters option of combine, empty if there is nothing to seed from
+def writeSeed(seed, output):
+
+    seedFile = open(output, "w")
+    if len(seed) > 0:
+        seedFile.write("--setParameters %s\n"%(",".join(["%s=%.6g"%(name, seed[name]) for name in sorted(seed.keys())])))
+    seedFile.close()
+
+# Append the wall time and iteration counts of the fit just run to fitstats.json. The number of
+# function calls is summed over all minimizations printed in the log, and the number of minimizer
+# calls is taken from the status history of the signal+background fit result
+def recordFit(fitLog, seedDir, wallTime, nSeeded):
+
+    nfcn = None
+    if os.path.exists(fitLog):
+        calls = re.findall(r"Nfcn\s*=\s*(\d+)", open(fitLog).read())
+        if len(calls) > 0:
+            nfcn = sum([int(call) for call in calls])
+
+    record = {"seed" : seedDir, "nSeeded" : nSeeded, "wallTime" : wallTime, "nfcn" : nfcn, "status" : None, "nMinimizations" : None}
+
+    fdiag = ROOT.TFile.Open("fitDiagnosticsTest.root", "READ")
+    if fdiag != None:
+        fitResult = fdiag.Get("fit_s")
+        if fitResult != None:
+            record["status"]         = fitResult.status()
+            record["nMinimizations"] = fitResult.numStatusHistory()
+        fdiag.Close()
+
+    records = []
+    if os.path.exists("fitstats.json"):
+        records = json.load(open("fitstats.json"))
+    records.append(record)
+
+    json.dump(records, open("fitstats.json", "w"), indent=4)
+
+# Compare the latest seeded and unseeded fits of every folder in an output tree
+def printSummary(outputDir):
+
+    totals = {"seeded" : [], "unseeded" : []}
+    for fitDir in sorted(os.listdir(outputDir)):
+
+        statsFile = "%s/%s/fitstats.json"%(outputDir, fitDir)
+        if not os.path.exists(statsFile):
+            continue
+
+        latest = {}
+        for record in json.load(open(statsFile)):
+            if record["status"] != 0:
+                continue
+            if record["nSeeded"] > 0:
+                latest["seeded"] = record
+            else:
+                latest["unseeded"] = record
+
+        if len(latest) < 2:
+            continue
+
+        for kind in ["seeded", "unseeded"]:
+            totals[kind].append(latest[kind])
+
+        print("%-50s wall time %7.1f s ==> %7.1f s, function calls %8s ==> %8s"%(fitDir, latest["unseeded"]["wallTime"], latest["seeded"]["wallTime"], latest["unseeded"]["nfcn"], latest["seeded"]["nfcn"]))
+
+    if len(totals["seeded"]) == 0:
+        print("No folder with both a seeded and an unseeded converged fit")
+        return
+
+    unseeded = sum([record["wallTime"] for record in totals["unseeded"]])
+    seeded   = sum([record["wallTime"] for record in totals["seeded"]])
+    print("Total wall time for %d folders: %.1f s unseeded, %.1f s seeded, %.1f%% saved"%(len(totals["seeded"]), unseeded, seeded, 100.0 * (unseeded - seeded) / unseeded))
+
+if __name__ == "__main__":
+    usage = "%warmStart [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--seedDir",   dest="seedDir",   help="dir with fit result", default=None                      )
+    parser.add_argument("--workspace", dest="workspace", help="workspace to fit",    default="sf.root"                 )
+    parser.add_argument("--output",    dest="output",    help="seed options file",   default="seed.txt"                )
+    parser.add_argument("--record",    dest="record",    help="record fit stats",    default=False, action="store_true")
+    parser.add_argument("--fitLog",    dest="fitLog",    help="log of the fit",      default="fit.log"                 )
+    parser.add_argument("--wallTime",  dest="wallTime",  help="wall time of fit",    default=0.0,   type=float         )
+    parser.add_argument("--summary",   dest="summary",   help="output tree to sum",  default=None                      )
+
+    args = parser.parse_args()
+
+    # An empty seed folder from runfits.sh means the fit is not seeded
+    if args.seedDir == "":
+        args.seedDir = None
+
+    if args.summary != None:
+        printSummary(args.summary)
+        quit()
+
+    if args.record:
+        seedOptions = ""
+        if os.path.exists(args.output):
+            seedOptions = open(args.output).read().strip()
+
+        nSeeded = 0
+        if seedOptions != "":
+            nSeeded = len(seedOptions.split(","))
+
+        recordFit(args.fitLog, args.seedDir, args.wallTime, nSeeded)
+        quit()
+
+    seed = {}
+    if args.seedDir != None:
+        seed = getSeed(args.seedDir, args.workspace)
+        print("Seeding %d parameters from \"%s\""%(len(seed), args.seedDir))
+
+    writeSeed(seed, args.output)
@@ -0,0 +1,220 @@
+#! /bin/env/python
+
+import os
+import re
+import shutil
+import struct
+import hashlib
+import argparse
+import subprocess
+
+from collections import OrderedDict as odict
+
+# The physics model actually used by text2workspace.py is the copy in the CombinedLimit
+# python area, fall back to the one in this repository if it cannot be found
+def getModelSource():
+
+    try:
+        import HiggsAnalysis.CombinedLimit.TagAndProbeExtended as model
+        source = model.__file__
+    except ImportError:
+        source = "%s/TagAndProbeExtended.py"%(os.path.dirname(os.path.realpath(__file__)))
+
+    # Hash the python source and not the compiled file next to it
+    if source.endswith(".pyc"):
+        source = source[:-1]
+
+    return source
+
+# Shape files referenced by the shapes lines of a data card, relative to the folder of the card,
+# as {file : [patterns of the objects taken from it]}, e.g. $PROCESS and $PROCESS_$SYSTEMATIC
+def getShapeFiles(card):
+
+    cardDir = os.path.dirname(os.path.realpath(card))
+
+    shapeFiles = odict()
+    for line in open(card):
+        chunks = line.split()
+        if len(chunks) < 4 or chunks[0] != "shapes":
+            continue
+        shapeFile = os.path.join(cardDir, chunks[3])
+        patterns  = shapeFiles.setdefault(shapeFile, [])
+        for pattern in chunks[4:]:
+            if pattern not in patterns:
+                patterns.append(pattern)
+
+    return shapeFiles
+
+# Regular expression of the object names matching a shapes pattern, with the $ keywords of combine as wildcards
+def getPatternRegex(pattern):
+
+    regex = re.escape(pattern)
+    for keyword in ["PROCESS", "CHANNEL", "SYSTEMATIC", "MASS"]:
+        regex = regex.replace(re.escape("$%s"%(keyword)), ".+")
+
+    return re.compile("^%s$"%(regex))
+
+# Paths of all objects in a ROOT directory and its subdirectories, e.g. ["TTmatch", "pass/TTmatch"]
+def getObjectPaths(directory, prefix=""):
+
+    paths = []
+    for key in directory.GetListOfKeys():
+        name = key.GetName()
+        if "%s%s"%(prefix, name) in paths:
+            continue
+        if key.IsFolder() and key.GetClassName().startswith("TDirectory"):
+            paths += getObjectPaths(directory.Get(name), "%s%s/"%(prefix, name))
+        else:
+            paths.append("%s%s"%(prefix, name))
+
+    return paths
+
+# Add the content of a histogram to the hash, i.e. its name, the edges of all axes and the contents and errors
+# of all bins. Unlike the bytes of the file, these do not change when identical histograms are written again
+def updateHistoHash(key, path, histo):
+
+    key.update(("%s:%s:%d\n"%(path, histo.ClassName(), histo.GetDimension())).encode("utf-8"))
+
+    axes = [histo.GetXaxis(), histo.GetYaxis(), histo.GetZaxis()][:histo.GetDimension()]
+    for axis in axes:
+        edges = [axis.GetBinLowEdge(iBin) for iBin in range(1, axis.GetNbins()+2)]
+        key.update(struct.pack("<%dd"%(len(edges)), *edges))
+
+    nCells   = histo.GetNcells()
+    contents = [histo.GetBinContent(iCell) for iCell in range(nCells)]
+    errors   = [histo.GetBinError(iCell)   for iCell in range(nCells)]
+    key.update(struct.pack("<%dd"%(nCells), *contents))
+    key.update(struct.pack("<%dd"%(nCells), *errors))
+
+# Add the content of the objects of a shape file matching the patterns of the card to the hash, in the order
+# of their names. Returns False if the file has objects that are not histograms, whose content is not hashed
+def updateShapeHash(key, shapeFile, patterns):
+
+    import ROOT
+    ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+    fshapes = ROOT.TFile.Open(shapeFile, "READ")
+    if fshapes == None or fshapes.IsZombie():
+        return False
+
+    # Without patterns the objects taken from the file are not known, so the file is hashed by its bytes
+    regexes = [getPatternRegex(pattern) for pattern in patterns]
+    if len(regexes) == 0:
+        fshapes.Close()
+        return False
+
+    ok = True
+    for path in sorted(getObjectPaths(fshapes)):
+        if not any([regex.match(path) for regex in regexes]):
+            continue
+
+        obj = fshapes.Get(path)
+        if not obj.InheritsFrom("TH1"):
+            ok = False
+            break
+
+        updateHistoHash(key, path, obj)
+
+    fshapes.Close()
+
+    return ok
+
+# Add the content of a file to the hash, read in chunks to not load large shape files at once
+def updateHash(key, path):
+
+    infile = open(path, "rb")
+    chunk = infile.read(1 << 20)
+    while chunk:
+        key.update(chunk)
+        chunk = infile.read(1 << 20)
+    infile.close()
+
+# The key of a workspace is the hash of the full text2workspace.py command, the card, the content of all
+# histograms it takes from the shape files and the source of the physics model. The histograms are hashed
+# by their content, such that regenerated shape files with identical histograms, which differ in their bytes
+# by the UUID and the time stamps of the file, give the same key. Shape files with other objects are hashed
+# by their bytes
+def getWorkspaceKey(card, command):
+
+    key = hashlib.sha1()
+    key.update(command.encode("utf-8"))
+
+    updateHash(key, card)
+    for shapeFile, patterns in getShapeFiles(card).items():
+        if not os.path.exists(shapeFile):
+            return None
+
+        key.update(("%s\n"%(os.path.basename(shapeFile))).encode("utf-8"))
+
+        content = hashlib.sha1()
+        if updateShapeHash(content, shapeFile, patterns):
+            key.update(content.hexdigest().encode("utf-8"))
+        else:
+            updateHash(key, shapeFile)
+
+    updateHash(key, getModelSource())
+
+    return key.hexdigest()
+
+# Copy a file such that readers never see a partially written file, by
+# writing it next to the target first and renaming it to the target
+def atomicCopy(source, target):
+
+    temp = "%s.tmp%d"%(target, os.getpid())
+    shutil.copyfile(source, temp)
+    os.rename(temp, target)
+
+# Build the workspace of a card in the current folder with text2workspace.py, unless a workspace
+# for the same key is already in the cache, in which case it is copied instead. The key of the workspace
+# in the output is stored next to it, such that a rerun with an unchanged card does nothing at all
+def getWorkspace(card, output, model, physOptions, cacheDir):
+
+    command = "text2workspace.py -m 173.2 -P %s %s %s -o %s"%(model, card, physOptions, output)
+
+    key = getWorkspaceKey(card, command)
+    if key == None:
+        print("Could not find all shape files of \"%s\", building workspace without cache"%(card))
+        return subprocess.call(command, shell=True)
+
+    keyFile = "%s.key"%(output)
+    if os.path.exists(output) and os.path.exists(keyFile) and open(keyFile).read().strip() == key:
+        print("Workspace \"%s\" is up to date"%(output))
+        return 0
+
+    if not os.path.exists(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            # Another job may have created it in the meantime
+            if not os.path.isdir(cacheDir):
+                raise
+
+    cached = "%s/%s.root"%(cacheDir, key)
+    if os.path.exists(cached):
+        print("Using cached workspace \"%s\""%(cached))
+        atomicCopy(cached, output)
+    else:
+        print("Building workspace for key %s"%(key))
+        status = subprocess.call(command, shell=True)
+        if status != 0:
+            return status
+        atomicCopy(output, cached)
+
+    keyOut = open(keyFile, "w")
+    keyOut.write("%s\n"%(key))
+    keyOut.close()
+
+    return 0
+
+if __name__ == "__main__":
+    usage = "%workspaceCache [options]"
+    parser = argparse.ArgumentParser(usage)
+    parser.add_argument("--card",     dest="card",     help="data card",          default="sf.txt"                                            )
+    parser.add_argument("--output",   dest="output",   help="output workspace",   default="sf.root"                                           )
+    parser.add_argument("--model",    dest="model",    help="physics model",      default="HiggsAnalysis.CombinedLimit.TagAndProbeExtended:tagAndProbe")
+    parser.add_argument("--options",  dest="options",  help="--PO options",       default=""                                                  )
+    parser.add_argument("--cacheDir", dest="cacheDir", help="shared cache dir",   default="../.workspaces"                                    )
+
+    args = parser.parse_args()
+
+    exit(getWorkspace(args.card, args.output, args.model, args.options, args.cacheDir))